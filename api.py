@@ -0,0 +1,247 @@
+import gzip
+import json
+
+from flask import Blueprint, Response, abort, request
+from werkzeug.exceptions import HTTPException
+
+from facets import parse_facets
+from models import *
+from pagination import InvalidCursor, clamp_limit, paginate
+
+try:
+  import orjson
+except ImportError:
+  orjson = None
+
+try:
+  import brotli
+except ImportError:
+  brotli = None
+
+#------------------------------------------------------------------------------------------
+# JSON API (/api/v1)
+#-------------------------------------------------------------------------------------------
+
+# the same data as the html pages, for the mobile client: built from the same model helpers and view models,
+# but serialized straight to json (with orjson when it is installed) without templates, flash messages or the
+# session. lists are keyset paginated like the html listings (?after= / ?before= cursors from next_cursor /
+# prev_cursor, ?limit=), ?fields=id,name trims each item to the given fields, /venues and /artists take the same
+# facets as the html listings (?genre=&match=&state=&city=&seeking=, see facets.py) and then also return the
+# matches' facet counts, show lists take a time range (?from=2026-10-01&to=2026-10-31), and responses are compressed
+# (brotli when the brotli package is installed, gzip otherwise) for clients that accept it
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+# smaller bodies aren't worth compressing
+COMPRESS_MIN_SIZE = 1024
+
+VENUE_LIST_FIELDS = ('id', 'name', 'city', 'state', 'num_upcoming_shows')
+ARTIST_LIST_FIELDS = ('id', 'name')
+SEARCH_FIELDS = ('id', 'name', 'city', 'state', 'num_upcoming_shows')
+VENUE_FIELDS = VenueDetail.__slots__
+ARTIST_FIELDS = ArtistDetail.__slots__
+SHOW_FIELDS = ('id', 'start_time', 'venue_id', 'venue_name', 'artist_id', 'artist_name', 'artist_image_link')
+VENUE_SHOW_FIELDS = ('id', 'start_time', 'artist_id', 'artist_name', 'artist_image_link')
+ARTIST_SHOW_FIELDS = ('id', 'start_time', 'venue_id', 'venue_name', 'venue_image_link')
+
+#----------------------------------------------------------------------------#
+# Serialization.
+#----------------------------------------------------------------------------#
+
+def to_json(value):
+  if isinstance(value, datetime):
+    return value.isoformat()
+  raise TypeError('{!r} is not JSON serializable'.format(value))
+
+# datetimes come out as ISO 8601 either way
+def dumps(data):
+  if orjson is not None:
+    return orjson.dumps(data)
+  return json.dumps(data, separators=(',', ':'), default=to_json).encode('utf-8')
+
+def json_response(data, status=200):
+  return Response(dumps(data), status=status, mimetype='application/json')
+
+# the ?fields= the client asked for (all of `available` when it didn't)
+def requested_fields(available):
+  fields = [field for field in request.args.get('fields', '').split(',') if field]
+  if not fields:
+    return available
+  unknown = [field for field in fields if field not in available]
+  if unknown:
+    abort(400, 'Unknown fields: {} (available: {})'.format(', '.join(unknown), ', '.join(available)))
+  return fields
+
+# rows (query rows or view models) -> dicts of the given fields
+def serialize(items, fields):
+  return [{ field: getattr(item, field) for field in fields } for item in items]
+
+def page_response(page, fields, facets=None):
+  data = {
+    'data': serialize(page.items, fields),
+    'next_cursor': page.next_cursor,
+    'prev_cursor': page.prev_cursor
+  }
+  if facets is not None:
+    data['facets'] = facets
+  return json_response(data)
+
+def page_args():
+  return {
+    'after': request.args.get('after'),
+    'before': request.args.get('before'),
+    'limit': request.args.get('limit', type=int)
+  }
+
+def facet_args():
+  try:
+    return parse_facets(request.args, genre_registry)
+  except ValueError as error:
+    abort(400, str(error))
+
+# ?from= / ?to=, see Show.parse_range
+def range_args():
+  try:
+    start, end = Show.parse_range(request.args.get('from'), request.args.get('to'))
+  except ValueError:
+    abort(400, 'from and to must be ISO 8601 dates or date-times')
+  return { 'start': start, 'end': end }
+
+def when_arg(default):
+  when = request.args.get('when', default)
+  if when not in ('all', 'past', 'upcoming'):
+    abort(400, "when must be one of 'all', 'past' or 'upcoming'")
+  return when
+
+@api.after_request
+def compress(response):
+  response.vary.add('Accept-Encoding')
+  if response.direct_passthrough or response.status_code != 200 or 'Content-Encoding' in response.headers:
+    return response
+
+  body = response.get_data()
+  if len(body) < COMPRESS_MIN_SIZE:
+    return response
+  if brotli is not None and request.accept_encodings['br']:
+    response.set_data(brotli.compress(body, quality=4))
+    response.headers['Content-Encoding'] = 'br'
+  elif request.accept_encodings['gzip']:
+    response.set_data(gzip.compress(body, compresslevel=5))
+    response.headers['Content-Encoding'] = 'gzip'
+  return response
+
+# (404 has to be named: a handler for the code itself, like app.py's, wins over a handler for HTTPException)
+@api.errorhandler(404)
+@api.errorhandler(HTTPException)
+def http_error(error):
+  return json_response({ 'error': { 'status': error.code, 'message': error.description } }, error.code)
+
+# unlike the html listings, a bad cursor is the client's bug, not something to quietly recover from
+@api.errorhandler(InvalidCursor)
+def invalid_cursor_error(error):
+  return json_response({ 'error': { 'status': 400, 'message': 'Invalid cursor' } }, 400)
+
+#----------------------------------------------------------------------------#
+# Venues.
+#----------------------------------------------------------------------------#
+
+@api.route('/venues')
+def venues():
+  fields = requested_fields(VENUE_LIST_FIELDS)
+  facet_filter = facet_args()
+  ShowRollover.rollover()
+  if facet_filter:
+    page, facets = get_faceted_page(Venue, facet_filter, Venue.directory_query(), Venue.directory_keys(), **page_args())
+    return page_response(page, fields, facets)
+  return page_response(paginate(Venue.directory_query(), Venue.directory_keys(), **page_args()), fields)
+
+@api.route('/venues/search')
+def search_venues():
+  return search_response(Venue)
+
+@api.route('/venues/<int:venue_id>')
+def show_venue(venue_id):
+  fields = requested_fields(VENUE_FIELDS)
+  venue = Venue.get_detail(venue_id)
+  if venue is None:
+    abort(404, 'No venue {}'.format(venue_id))
+  return json_response(detail(venue, fields, VENUE_SHOW_FIELDS))
+
+@api.route('/venues/<int:venue_id>/shows')
+def venue_shows(venue_id):
+  fields = requested_fields(VENUE_SHOW_FIELDS)
+  return shows_page_response(Venue, venue_id, Venue.shows_query, fields)
+
+#----------------------------------------------------------------------------#
+# Artists.
+#----------------------------------------------------------------------------#
+
+@api.route('/artists')
+def artists():
+  fields = requested_fields(ARTIST_LIST_FIELDS)
+  facet_filter = facet_args()
+  if facet_filter:
+    page, facets = Artist.get_faceted_listing_page(facet_filter, **page_args())
+    return page_response(page, fields, facets)
+  return page_response(Artist.get_listing_page(**page_args()), fields)
+
+@api.route('/artists/search')
+def search_artists():
+  return search_response(Artist)
+
+@api.route('/artists/<int:artist_id>')
+def show_artist(artist_id):
+  fields = requested_fields(ARTIST_FIELDS)
+  artist = Artist.get_detail(artist_id)
+  if artist is None:
+    abort(404, 'No artist {}'.format(artist_id))
+  return json_response(detail(artist, fields, ARTIST_SHOW_FIELDS))
+
+@api.route('/artists/<int:artist_id>/shows')
+def artist_shows(artist_id):
+  fields = requested_fields(ARTIST_SHOW_FIELDS)
+  return shows_page_response(Artist, artist_id, Artist.shows_query, fields)
+
+#----------------------------------------------------------------------------#
+# Shows.
+#----------------------------------------------------------------------------#
+
+@api.route('/shows')
+def shows():
+  fields = requested_fields(SHOW_FIELDS)
+  return page_response(Show.get_shows_page(when_arg('all'), **page_args(), **range_args()), fields)
+
+#----------------------------------------------------------------------------#
+# Shared.
+#----------------------------------------------------------------------------#
+
+def detail(entity, fields, show_fields):
+  data = { field: getattr(entity, field) for field in fields }
+  for field in ('past_shows', 'upcoming_shows'):
+    if field in data:
+      data[field] = serialize(data[field], show_fields)
+  return data
+
+# search results with their upcoming show counts (from the counters, see ShowRollover)
+def search_response(model):
+  fields = requested_fields(SEARCH_FIELDS)
+  ShowRollover.rollover()
+  results = model.search(request.args.get('q', ''), limit=clamp_limit(request.args.get('limit', type=int)))
+  return json_response({
+    'count': len(results),
+    'data': [
+      { field: result.upcoming_show_count if field == 'num_upcoming_shows' else getattr(result, field) for field in fields }
+      for result in results
+    ]
+  })
+
+# a venue's / an artist's shows, keyset paginated on start_time, id (404 for an unknown venue/artist). upcoming
+# ones unless the client asks for a time range (?from= / ?to=, e.g. a month for a calendar) or ?when=
+def shows_page_response(model, entity_id, shows_query, fields):
+  show_range = range_args()
+  when = when_arg('upcoming' if show_range['start'] is None and show_range['end'] is None else 'all')
+  query = Show.filter_range(shows_query(entity_id, when).order_by(None), **show_range)
+  page = paginate(query, [Show.start_time, Show.id], **page_args())
+  if not page.items and db.session.query(model.id).filter(model.id == entity_id).first() is None:
+    abort(404, 'No {} {}'.format(model.__tablename__.lower(), entity_id))
+  return page_response(page, fields)
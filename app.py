@@ -3,18 +3,31 @@
 #----------------------------------------------------------------------------#
 
 import babel
-import datetime
+import babel.dates
+import calendar
+from datetime import datetime, timedelta
 import dateutil.parser
-from flask import Flask, render_template, request, Response, flash, redirect, url_for, jsonify, abort
+import functools
+from flask import Flask, render_template, request, Response, flash, redirect, url_for, jsonify, abort, stream_with_context
 from flask_wtf import Form
+from sqlalchemy.exc import IntegrityError
 import inspect
 import json
 import logging
+import secrets
 from logging import Formatter, FileHandler
 
 from app_config import app, db, migrate, moment
+from cache import response_cache, cache_tag, cache_until, conditional, version_etag
+from exports import EXPORT_CONTENT_TYPES, export
+from facets import parse_facets
+from imports import IMPORT_CONTENT_TYPES, IMPORT_FORMATS, import_rows, read_rows
+from partitions import add_months, month_start
+from instrumentation import perf_logger
+from api import api
 from forms import *
 from models import *
+from pagination import InvalidCursor
 
 #----------------------------------------------------------------------------#
 # App Config.
@@ -32,16 +45,136 @@ from models import *
 # Filters.
 #----------------------------------------------------------------------------#
 
-def format_datetime(value, format='medium'):
-  date = dateutil.parser.parse(value)
-  if format == 'full':
-      format="EEEE MMMM, d, y 'at' h:mma"
-  elif format == 'medium':
-      format="EE MM, dd, y h:mma"
-  return babel.dates.format_datetime(date, format, locale='en')
+DATETIME_FORMATS = {
+  'full': "EEEE MMMM, d, y 'at' h:mma",
+  'medium': "EE MM, dd, y h:mma"
+}
+
+# babel pattern and locale objects, parsed once per (format, locale) instead of on every call
+@functools.lru_cache(maxsize=None)
+def datetime_pattern(format, locale):
+  return babel.dates.parse_pattern(DATETIME_FORMATS.get(format, format)), babel.Locale.parse(locale)
+
+# show times repeat a lot across tiles (same nights, same slots), so recently formatted ones are kept
+@functools.lru_cache(maxsize=4096)
+def format_datetime_cached(value, format, locale):
+  pattern, locale = datetime_pattern(format, locale)
+  return babel.dates.format_datetime(value, pattern, locale=locale)
+
+def format_datetime(value, format='medium', locale='en'):
+  # templates hand over datetimes straight from the query rows, only parse when given a string
+  if not isinstance(value, datetime):
+    value = dateutil.parser.parse(value)
+  return format_datetime_cached(value, format, locale)
 
 app.jinja_env.filters['datetime'] = format_datetime
 
+#----------------------------------------------------------------------------#
+# Pagination.
+#----------------------------------------------------------------------------#
+
+# listing routes take ?after=<cursor> / ?before=<cursor> (from the next/previous links) and ?limit=
+def page_args():
+  return {
+    'after': request.args.get('after'),
+    'before': request.args.get('before'),
+    'limit': request.args.get('limit', type=int)
+  }
+
+# links to another page of the same listing (or to the listing with other facets): the page's query args with
+# `args` replaced (None drops one), from the first page unless a cursor is given
+@app.template_global()
+def pager_url(**args):
+  query = request.args.to_dict(flat=False)
+  query.pop('after', None)
+  query.pop('before', None)
+  for name, value in args.items():
+    if value is None:
+      query.pop(name, None)
+    else:
+      query[name] = value
+  return url_for(request.endpoint, **query)
+
+# /shows also takes ?from= / ?to= (ISO 8601 dates or date-times) for the shows in that time range
+def range_args():
+  try:
+    start, end = Show.parse_range(request.args.get('from'), request.args.get('to'))
+  except ValueError:
+    abort(400, 'from and to must be ISO 8601 dates or date-times')
+  return { 'start': start, 'end': end }
+
+#----------------------------------------------------------------------------#
+# Facets.
+#----------------------------------------------------------------------------#
+
+# /venues and /artists also take ?genre= (Genre_Choices names, repeatable) with ?match=any|all, ?state=, ?city=
+# and ?seeking=1 (see facets.py). the filtered pages carry a 'venue_facets' / 'artist_facets' cache tag, which
+# every write to a venue / an artist invalidates since it can move the venue in or out of any of them
+def facet_args():
+  try:
+    return parse_facets(request.args, genre_registry)
+  except ValueError as error:
+    abort(400, str(error))
+
+#----------------------------------------------------------------------------#
+# Response cache.
+#----------------------------------------------------------------------------#
+
+# tags for the cached pages (see cache.py): 'venues' / 'artists' / 'shows' for the listings as a whole,
+# 'area:<state>:<city>' for the /venues pages showing that area, and one per venue/artist detail page
+def venue_tag(venue_id):
+  return 'venue:{}'.format(venue_id)
+
+def artist_tag(artist_id):
+  return 'artist:{}'.format(artist_id)
+
+def area_tag(state, city):
+  return 'area:{}:{}'.format(state, city)
+
+# an area that has just gained its first venue isn't on any cached /venues page yet,
+# so every listing page has to go (it may now sort onto any of them)
+def area_tags(state, city):
+  tags = [area_tag(state, city)]
+  if Venue.query.filter_by(state=state, city=city).count() == 1:
+    tags.append('venues')
+  return tags
+
+# a venue's name shows up on its artists' pages and on /shows (and its image on the artists' pages)
+def venue_show_tags(artist_ids):
+  return ['shows'] + [artist_tag(artist_id) for artist_id in artist_ids]
+
+# an artist's name and image show up on its venues' pages and on /shows
+def artist_show_tags(venue_ids):
+  return ['shows'] + [venue_tag(venue_id) for venue_id in venue_ids]
+
+#----------------------------------------------------------------------------#
+# Conditional GET.
+#----------------------------------------------------------------------------#
+
+# (etag, last_modified) for the cached pages, see conditional() in cache.py. the detail pages' versions
+# come from the updated_at columns, which the write routes below bump for every page a write shows up on
+
+def venue_validators(venue_id):
+  last_modified = Venue.get_last_modified(venue_id)
+  return (version_etag(last_modified), last_modified) if last_modified else None
+
+def artist_validators(artist_id):
+  last_modified = Artist.get_last_modified(artist_id)
+  return (version_etag(last_modified), last_modified) if last_modified else None
+
+# no Last-Modified for /venues: deleting a venue changes it without moving any timestamp (the etag has the count)
+def directory_validators():
+  last_modified, count = Venue.get_directory_version()
+  return version_etag(last_modified, count), None
+
+def artist_listing_validators():
+  last_modified = Artist.get_listing_last_modified()
+  return version_etag(last_modified), last_modified
+
+def show_listing_validators():
+  last_modified = Show.get_listing_last_modified()
+  return version_etag(last_modified), last_modified
+
 #----------------------------------------------------------------------------#
 # Controllers.
 #----------------------------------------------------------------------------#
@@ -55,23 +188,23 @@ def index():
 #  ----------------------------------------------------------------
 
 @app.route('/venues')
+@conditional(directory_validators)
+@response_cache.cached(tags=lambda: ['venues'])
 def venues():
   # COMPLETED: replace with real venues data.
   #       num_shows should be aggregated based on number of upcoming shows per venue.
-    data = []
-    locations = db.session.query(Venue.city, Venue.state).distinct()
-    
-    for location in locations:
-        venue_list = []
-        venues = Venue.query.filter_by(city=location[0], state=location[1]).all()
-        
-        for venue in venues:
-            num_upcoming_shows = len(venue.get_shows('upcoming'))
-            venue_list.append({"id": venue.id, "name": venue.name, "num_upcoming_shows": num_upcoming_shows})
-
-        data.append({"city": location[0], "state": location[1], "venues": venue_list})
-    
-    return render_template('pages/venues.html', areas=data)
+    facet_filter = facet_args()
+    facets = None
+    if facet_filter:
+      page, facets = Venue.get_faceted_directory_page(facet_filter, **page_args())
+      cache_tag('venue_facets')
+    else:
+      page = Venue.get_directory_page(**page_args())
+    cache_tag(*[area_tag(area['state'], area['city']) for area in page.items])
+    cache_until(Show.get_next_start_time())
+
+    return render_template('pages/venues.html', areas=page.items, page=page, facets=facets,
+      genre_choices=Genre_Choices, seeking_label='seeking talent')
 
 @app.route('/venues/search', methods=['POST'])
 def search_venues():
@@ -80,31 +213,53 @@ def search_venues():
   # search for "Music" should return "The Musical Hop" and "Park Square Live Music & Coffee"
 
   search_term = request.form.get('search_term','')
+  ShowRollover.rollover()
   venues = Venue.search(search_term)
   
   data = []
   for venue in venues:
-    num_upcoming_shows = len(venue.get_shows('upcoming'))
-    data.append({ "id": venue.id, "name": venue.name, "num_upcoming shows": num_upcoming_shows})
+    data.append({ "id": venue.id, "name": venue.name, "num_upcoming shows": venue.upcoming_show_count})
   
   response = { "count": len(venues), "data": data}
   return render_template('pages/search_venues.html', results=response, search_term=search_term)
 
 @app.route('/venues/<int:venue_id>')
+@conditional(venue_validators)
+@response_cache.cached(tags=lambda venue_id: [venue_tag(venue_id)])
 def show_venue(venue_id):
   # shows the venue page with the given venue_id
   # COMPLETED: replace with real venue data from the venues table, using venue_id
  
-  venue = Venue.query.get(venue_id)
+  venue = Venue.get_detail(venue_id)
   if not venue:
-    return render_template('errors/404.html')
+    return render_template('errors/404.html'), 404
 
-  past_shows = venue.get_shows('past')
-  upcoming_shows = venue.get_shows('upcoming')
+  # the next upcoming show moves to past shows once it starts
+  if venue.upcoming_shows:
+    cache_until(venue.upcoming_shows[0].start_time)
 
-  data = {**venue.__dict__, "past_shows": past_shows, "upcoming_shows": upcoming_shows, "past_shows_count": len(past_shows), "upcoming_shows_count": len(upcoming_shows)}
+  return render_template('pages/show_venue.html', venue=venue)
 
-  return render_template('pages/show_venue.html', venue=data)
+# a month of the venue's shows (?month=YYYY-MM, the current month by default) as a calendar
+@app.route('/venues/<int:venue_id>/calendar')
+@response_cache.cached(tags=lambda venue_id: [venue_tag(venue_id)])
+def venue_calendar(venue_id):
+  this_month = month_start(datetime.now())
+  try:
+    month = datetime.strptime(request.args['month'], '%Y-%m') if request.args.get('month') else this_month
+  except ValueError:
+    abort(400, 'month must be YYYY-MM')
+
+  found = Venue.get_calendar(venue_id, month)
+  if not found:
+    return render_template('errors/404.html'), 404
+  venue, days = found
+
+  # the default month moves on at the end of this one
+  cache_until(add_months(this_month, 1))
+  weeks = calendar.Calendar(firstweekday=6).monthdatescalendar(month.year, month.month)
+  return render_template('pages/venue_calendar.html', venue=venue, month=month, weeks=weeks, days=days,
+    prev_month=add_months(month, -1), next_month=add_months(month, 1))
 
 #  Create Venue
 #  ----------------------------------------------------------------
@@ -132,12 +287,15 @@ def create_venue_submission():
       venue_params['website'] = request.form.get('website', '')
       venue_params['facebook_link'] = request.form.get('facebook_link', '')
       venue_params['image_link'] = request.form.get('image_link', '')
-      venue_params['genres'] = [Genre.query.get(genre) for genre in request.form.getlist('genres')]
+      venue_params['genres'] = Genre.get_genres(request.form.getlist('genres'))
 
       venue = Venue(**venue_params)
 
       db.session.add(venue)
       db.session.commit()
+      autocomplete_index.add('venue', venue.id, venue.name)
+      update_facets(venue, request.form.getlist('genres'))
+      response_cache.invalidate(venue_tag(venue.id), 'venue_facets', *area_tags(venue.state, venue.city))
       flash('Venue ' + venue.name + ' was successfully listed!')
     except:
       db.session.rollback()
@@ -164,10 +322,19 @@ def delete_venue(venue_id):
   success = True
 
   try:
-    venue = Venue.query.get(venue_id)
-    db.session.delete(venue)
-    db.session.commit()
-    flash('Venue ' + venue.name + ' was successfully deleted.')
+    venue = Venue.query.options(*LOADER_OPTIONS['venue_delete']).get(venue_id)
+    # a venue with shows stays: its shows would have no venue (and no one's counters or pages would drop them)
+    if Show.venue_has_shows(venue.id):
+      flash('Venue ' + venue.name + ' has shows and cannot be deleted.')
+      success = False
+    else:
+      tags = [venue_tag(venue.id), area_tag(venue.state, venue.city)]
+      db.session.delete(venue)
+      db.session.commit()
+      autocomplete_index.remove('venue', venue.id)
+      remove_facets(Venue, venue.id)
+      response_cache.invalidate('venue_facets', *tags)
+      flash('Venue ' + venue.name + ' was successfully deleted.')
   except:
     db.session.rollback()
     flash('An error occurred. Venue ' + venue_id + ' could not be found or there was a problem with deleting it.')
@@ -181,11 +348,11 @@ def delete_venue(venue_id):
 @app.route('/venues/<int:venue_id>/edit', methods=['GET'])
 def edit_venue(venue_id):
   # COMPLETED: populate form with values from venue with ID <venue_id>
-  venue = Venue.query.get(venue_id)
+  venue = Venue.query.options(*LOADER_OPTIONS['venue_form']).get(venue_id)
   if venue:
     form = VenueForm(obj = venue)
     form.state.default = venue.state
-    form.genres.data = [genre.name.value for genre in venue.genres]
+    form.genres.data = [genre.name.name for genre in venue.genres]
     return render_template('forms/edit_venue.html', form=form, venue=venue)
  
   # if venue isn't found send user to 404
@@ -197,12 +364,14 @@ def edit_venue(venue_id):
 def edit_venue_submission(venue_id):
   # COMPLETED: take values from the form submitted, and update existing
   # venue record with ID <venue_id> using the new attributes
-    venue = Venue.query.get(venue_id)
+    venue = Venue.query.options(*LOADER_OPTIONS['venue_edit']).get(venue_id)
     if not venue:
       return render_template('errors/404.html')
     
     form = VenueForm(obj=request)
     if form.validate():
+      listed = (venue.name, venue.image_link)
+      area = (venue.state, venue.city)
       venue.name = request.form.get('name', '')
       venue.city = request.form.get('city', '')
       venue.address = request.form.get('address', '')
@@ -211,10 +380,22 @@ def edit_venue_submission(venue_id):
       venue.website = request.form.get('website', '')
       venue.facebook_link = request.form.get('facebook_link', '')
       venue.image_link = request.form.get('image_link', '')
-      venue.genres = [Genre.query.get(genre) for genre in request.form.getlist('genres')]
+      venue.genres = Genre.get_genres(request.form.getlist('genres'))
+      venue.updated_at = datetime.now()
 
       try:
+        # the artists playing here show the venue's name and image on their pages
+        artist_ids = Show.get_artist_ids(venue.id) if (venue.name, venue.image_link) != listed else []
+        Artist.touch(artist_ids)
         db.session.commit()
+        autocomplete_index.add('venue', venue.id, venue.name)
+        update_facets(venue, request.form.getlist('genres'))
+        tags = [venue_tag(venue.id), 'venue_facets', area_tag(*area)]
+        if (venue.state, venue.city) != area:
+          tags += area_tags(venue.state, venue.city)
+        if artist_ids:
+          tags += venue_show_tags(artist_ids)
+        response_cache.invalidate(*tags)
         flash('Venue ' + venue.name + ' has been updated.')
       except:
         db.session.rollback()
@@ -233,15 +414,21 @@ def edit_venue_submission(venue_id):
 #  Artists
 #  ----------------------------------------------------------------
 @app.route('/artists')
+@conditional(artist_listing_validators)
+@response_cache.cached(tags=lambda: ['artists'])
 def artists():
   # COMPLETED: replace with real data returned from querying the database
 
-  data = []
-  artists = Artist.query.order_by(Artist.name).with_entities(Artist.id, Artist.name).all()
-  for artist in artists:
-    data.append({ "id": artist[0], "name": artist[1]})
+  facet_filter = facet_args()
+  facets = None
+  if facet_filter:
+    page, facets = Artist.get_faceted_listing_page(facet_filter, **page_args())
+    cache_tag('artist_facets')
+  else:
+    page = Artist.get_listing_page(**page_args())
 
-  return render_template('pages/artists.html', artists=data)
+  return render_template('pages/artists.html', artists=page.items, page=page, facets=facets,
+    genre_choices=Genre_Choices, seeking_label='seeking venues')
 
 @app.route('/artists/search', methods=['POST'])
 def search_artists():
@@ -251,41 +438,42 @@ def search_artists():
 
   search_term = request.form.get('search_term','')
 
+  ShowRollover.rollover()
   artists = Artist.search(search_term)
   
   data = []
   for artist in artists:
-    num_upcoming_shows = len(artist.get_shows('upcoming'))
-    data.append({ "id": artist.id, "name": artist.name, "num_upcoming shows": num_upcoming_shows})
+    data.append({ "id": artist.id, "name": artist.name, "num_upcoming shows": artist.upcoming_show_count})
   
   response = { "count": len(artists), "data": data}
   return render_template('pages/search_artists.html', results=response, search_term=request.form.get('search_term', ''))
 
 @app.route('/artists/<int:artist_id>')
+@conditional(artist_validators)
+@response_cache.cached(tags=lambda artist_id: [artist_tag(artist_id)])
 def show_artist(artist_id):
   # shows the venue page with the given venue_id
   # COMPLETED: replace with real venue data from the venues table, using venue_id
 
-  artist = Artist.query.get(artist_id)
+  artist = Artist.get_detail(artist_id)
   if not artist:
-    return render_template('errors/404.html')
-
-  past_shows = artist.get_shows('past')
-  upcoming_shows = artist.get_shows('upcoming')
+    return render_template('errors/404.html'), 404
 
-  data = {**artist.__dict__, "past_shows": past_shows, "upcoming_shows": upcoming_shows, "past_shows_count": len(past_shows), "upcoming_shows_count": len(upcoming_shows)}
+  # the next upcoming show moves to past shows once it starts
+  if artist.upcoming_shows:
+    cache_until(artist.upcoming_shows[0].start_time)
 
-  return render_template('pages/show_artist.html', artist=data)
+  return render_template('pages/show_artist.html', artist=artist)
 
 #  Update
 #  ----------------------------------------------------------------
 @app.route('/artists/<int:artist_id>/edit', methods=['GET'])
 def edit_artist(artist_id):  
-  artist = Artist.query.get(artist_id)
+  artist = Artist.query.options(*LOADER_OPTIONS['artist_form']).get(artist_id)
   if artist:
     form = ArtistForm(obj = artist)
     form.state.default = artist.state
-    form.genres.data = [genre.name.value for genre in artist.genres]
+    form.genres.data = [genre.name.name for genre in artist.genres]
     return render_template('forms/edit_artist.html', form=form, artist=artist)
   
   # if artist isn't found, send user to 404
@@ -300,12 +488,13 @@ def edit_artist_submission(artist_id):
   # artist record with ID <artist_id> using the new attributes
 
   # check to bs sure artist exists, if not send user to 404 page
-    artist = Artist.query.get(artist_id)
+    artist = Artist.query.options(*LOADER_OPTIONS['artist_edit']).get(artist_id)
     if not artist:
       return render_template('errors/404.html')
 
     form = ArtistForm(obj = request)
     if form.validate():
+      listed = (artist.name, artist.image_link)
       artist.name = request.form.get('name', '')
       artist.city = request.form.get('city', '')
       artist.address = request.form.get('address', '')
@@ -314,10 +503,22 @@ def edit_artist_submission(artist_id):
       artist.website = request.form.get('website', '')
       artist.facebook_link = request.form.get('facebook_link', '')
       artist.image_link = request.form.get('image_link', '')
-      artist.genres = [Genre.query.get(genre) for genre in request.form.getlist('genres')]
+      artist.genres = Genre.get_genres(request.form.getlist('genres'))
+      artist.updated_at = datetime.now()
 
       try:
+        # the venues the artist plays at show its name and image on their pages
+        venue_ids = Show.get_venue_ids(artist.id) if (artist.name, artist.image_link) != listed else []
+        Venue.touch(venue_ids)
         db.session.commit()
+        autocomplete_index.add('artist', artist.id, artist.name)
+        update_facets(artist, request.form.getlist('genres'))
+        tags = [artist_tag(artist.id), 'artist_facets']
+        if artist.name != listed[0]:
+          tags.append('artists')
+        if venue_ids:
+          tags += artist_show_tags(venue_ids)
+        response_cache.invalidate(*tags)
         flash('Artist ' + artist.name + ' has been updated.')
       except:
         db.session.rollback()
@@ -357,11 +558,14 @@ def create_artist_submission():
       artist_params['website'] = request.form.get('website', '')
       artist_params['facebook_link'] = request.form.get('facebook_link', '')
       artist_params['image_link'] = request.form.get('image_link', '')
-      artist_params['genres'] = [Genre.query.get(genre) for genre in request.form.getlist('genres')]
+      artist_params['genres'] = Genre.get_genres(request.form.getlist('genres'))
 
       artist = Artist(**artist_params)
       db.session.add(artist)
       db.session.commit()
+      autocomplete_index.add('artist', artist.id, artist.name)
+      update_facets(artist, request.form.getlist('genres'))
+      response_cache.invalidate(artist_tag(artist.id), 'artists', 'artist_facets')
 
       flash('Artist ' + artist.name + ' was successfully listed!')
     except:
@@ -381,20 +585,39 @@ def create_artist_submission():
   
 
 
+#  Autocomplete
+#  ----------------------------------------------------------------
+
+@app.route('/api/autocomplete')
+def autocomplete():
+  # venue/artist names with a word starting with ?q= (optionally only ?type=venue or ?type=artist)
+  prefix = request.args.get('q', '')
+  kind = request.args.get('type')
+  limit = max(1, min(request.args.get('limit', 10, type=int), 50))
+
+  results = get_autocomplete_index().complete(prefix, limit, kind)
+  return jsonify({ 'results': [{ 'type': result_kind, 'id': entity_id, 'name': name } for result_kind, entity_id, name in results] })
+
+
 #  Shows
 #  ----------------------------------------------------------------
 
 @app.route('/shows')
+@conditional(show_listing_validators)
+@response_cache.cached(tags=lambda: ['shows'])
 def shows():
   # displays list of shows at /shows
   # COMPLETED: replace with real venues data.
   #       num_shows should be aggregated based on number of upcoming shows per venue.
+  show_range = range_args()
   try:
-    shows = Show.get_shows()
+    page = Show.get_shows_page(**page_args(), **show_range)
+  except InvalidCursor:
+    raise
   except:
     return render_template('errors/500.html')
 
-  return render_template('pages/shows.html', shows=shows)
+  return render_template('pages/shows.html', shows=page.items, page=page)
 
 @app.route('/shows/create')
 def create_shows():
@@ -414,14 +637,41 @@ def create_show_submission():
     show_params['venue_id'] = request.form.get('venue_id', '')
     start_time = request.form.get('start_time', '')
     show_params['start_time'] = datetime.strptime(start_time, '%Y-%m-%d %H:%M:%S')
+    show_params['end_time'] = show_params['start_time'] + timedelta(minutes=form.duration.data)
 
+    booking = None
     try:
       show = Show(**show_params)
+      show.venue_id, show.artist_id = int(show.venue_id), int(show.artist_id)
+      # rejects a show overlapping one of the venue's or artist's shows before touching the database
+      booking = reserve_booking(show)
+      # (counted before it is added: on a database without a rollover row yet, count_new starts from a full
+      # count of the shows, which would autoflush and count the pending show a second time)
+      Show.count_new([show])
       db.session.add(show)
+      # the venue's upcoming count on /venues changes too
+      tags = [venue_tag(show.venue_id), artist_tag(show.artist_id), 'shows', area_tag(*Venue.get_area(show.venue_id))]
+      db.session.flush()
+      show_id = show.id
       db.session.commit()
+      confirm_booking(booking, show_id)
+      response_cache.invalidate(*tags)
       flash('Show was successfully listed!')
+    except BookingConflict as conflict:
+      db.session.rollback()
+      flash('Show could not be listed: {}.'.format(conflict))
+    except IntegrityError as error:
+      db.session.rollback()
+      release_booking(booking)
+      # (a show created by another process since this one loaded its booking trees)
+      if is_booking_conflict(error):
+        flash('Show could not be listed: the venue or the artist already has a show at that time.')
+      else:
+        flash('An error occurred. Show could not be listed.')
     except:
       db.session.rollback()
+      if booking is not None:
+        release_booking(booking)
       flash('An error occurred. Show could not be listed.')
     finally:
       db.session.close()
@@ -435,6 +685,91 @@ def create_show_submission():
   else:
     return render_template('forms/new_show.html', form=form)  
 
+#  Bulk import
+#  ----------------------------------------------------------------
+
+# the pages an imported batch shows up on (see import_rows): any /venues page for new venues (each one may
+# sort onto any of them), the listings for new artists, and for new shows their venues' and artists' pages
+def import_tags(kind, rows):
+  if kind == 'venues':
+    return ['venues', 'venue_facets']
+  if kind == 'artists':
+    return ['artists', 'artist_facets']
+  venue_ids = set(int(row['venue_id']) for row in rows)
+  artist_ids = set(int(row['artist_id']) for row in rows)
+  return (['shows'] + [venue_tag(venue_id) for venue_id in venue_ids] + [artist_tag(artist_id) for artist_id in artist_ids]
+    + [area_tag(state, city) for state, city in Venue.get_areas(venue_ids)])
+
+def import_format():
+  requested = request.args.get('format', IMPORT_CONTENT_TYPES.get(request.mimetype))
+  if requested not in IMPORT_FORMATS:
+    abort(400, 'format must be one of {} (?format= or the Content-Type)'.format(', '.join(IMPORT_FORMATS)))
+  return requested
+
+# with the token `setting` configured (IMPORT_TOKEN / EXPORT_TOKEN), only requests with an
+# 'Authorization: Bearer <token>' header get through. a `required` token makes the route fail closed: it 404s
+# while the token isn't configured
+def require_token(setting, required=False):
+  token = app.config[setting]
+  if not token:
+    if required:
+      abort(404)
+    return
+  if not secrets.compare_digest(request.headers.get('Authorization', ''), 'Bearer ' + token):
+    abort(401)
+
+@app.route('/import/<any(venues, artists, shows):kind>', methods=['POST'])
+def bulk_import(kind):
+  # creates venues / artists / shows from a CSV or JSONL request body (see imports.py), e.g.
+  #   curl -H 'Authorization: Bearer <IMPORT_TOKEN>' -H 'Content-Type: text/csv' --data-binary @venues.csv localhost:5000/import/venues
+  # a bulk write with no login and no CSRF token, so it only exists with IMPORT_TOKEN set
+  require_token('IMPORT_TOKEN', required=True)
+
+  def invalidate(kind, rows):
+    response_cache.invalidate(*import_tags(kind, rows))
+
+  result = import_rows(kind, read_rows(request.stream, import_format()), on_commit=invalidate)
+  return jsonify({
+    'imported': result.imported,
+    'failed': result.failed,
+    'errors': [{ 'line': row_error.line, 'errors': row_error.errors } for row_error in result.errors]
+  })
+
+#  Bulk export
+#  ----------------------------------------------------------------
+
+@app.route('/export/<any(venues, artists, shows):kind>.<any(csv, jsonl):export_format>')
+def bulk_export(kind, export_format):
+  # streams every venue / artist / show as CSV or JSONL (see exports.py), gzipped for clients that accept it, e.g.
+  #   curl --compressed -o venues.csv localhost:5000/export/venues.csv
+  # ?updated_since= (ISO 8601) only exports the rows created or changed since then: pass the X-Export-Time of
+  # the previous export to pick up where it left off (deleted rows don't show up, only a full export drops them)
+  require_token('EXPORT_TOKEN')
+  try:
+    updated_since = datetime.fromisoformat(request.args['updated_since']) if request.args.get('updated_since') else None
+  except ValueError:
+    abort(400, 'updated_since must be an ISO 8601 date or date-time')
+
+  # (rows changing while the export streams may or may not make it in, and are exported again next time)
+  headers = {
+    'Content-Disposition': 'attachment; filename={}.{}'.format(kind, export_format),
+    'X-Export-Time': datetime.now().isoformat(timespec='seconds'),
+    # (gzipped or not by the request's Accept-Encoding, so caches must keep the two apart)
+    'Vary': 'Accept-Encoding',
+  }
+  compress = bool(request.accept_encodings['gzip'])
+  if compress:
+    headers['Content-Encoding'] = 'gzip'
+  body = export(kind, export_format, updated_since, compress)
+  return Response(stream_with_context(body), mimetype=EXPORT_CONTENT_TYPES[export_format], headers=headers)
+
+#----------------------------------------------------------------------------#
+# API.
+#----------------------------------------------------------------------------#
+
+# JSON versions of the listing, detail, search and show pages under /api/v1 (see api.py)
+app.register_blueprint(api)
+
 @app.errorhandler(404)
 def not_found_error(error):
     return render_template('errors/404.html'), 404
@@ -443,6 +778,12 @@ def not_found_error(error):
 def server_error(error):
     return render_template('errors/500.html'), 500
 
+# a stale or mangled page cursor just sends the user back to the first page of the listing, with its filters
+# (?genre=, ?state=, ?from=, ... and ?limit=) kept
+@app.errorhandler(InvalidCursor)
+def invalid_cursor_error(error):
+    return redirect(pager_url())
+
 
 if not app.debug:
     file_handler = FileHandler('error.log')
@@ -452,7 +793,12 @@ if not app.debug:
     app.logger.setLevel(logging.INFO)
     file_handler.setLevel(logging.INFO)
     app.logger.addHandler(file_handler)
-    app.logger.info('errors')
+
+    # slow queries / slow requests / requests over their query budget, one JSON record per line (see
+    # instrumentation.py). in debug mode they go to the console
+    perf_handler = FileHandler('perf.log')
+    perf_handler.setFormatter(Formatter('%(asctime)s %(message)s'))
+    perf_logger.addHandler(perf_handler)
 
 #----------------------------------------------------------------------------#
 # Launch.
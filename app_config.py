@@ -4,6 +4,10 @@ from flask_migrate import Migrate
 from flask_moment import Moment
 from flask_sqlalchemy import SQLAlchemy
 
+from cache import response_cache
+from instrumentation import sql_instrumentation
+from sessions import RedisSessionInterface
+
 #----------------------------------------------------------------------------#
 # App Config.
 #----------------------------------------------------------------------------#
@@ -17,4 +21,13 @@ db = SQLAlchemy(app)
 # COMPLETED: connect to a local postgresql database
 from config import SQLALCHEMY_DATABASE_URI as dbURI
 app.config['SQLALCHEMY_DATABASE_URI'] = dbURI
-migrate = Migrate(app, db)
\ No newline at end of file
+migrate = Migrate(app, db)
+response_cache.init_app(app)
+sql_instrumentation.init_app(app)
+
+# sessions shared by every worker/server (see sessions.py); the default signed cookie needs nothing but the
+# same SECRET_KEY everywhere
+if app.config['SESSION_BACKEND'] == 'redis':
+    app.session_interface = RedisSessionInterface(app.config['SESSION_REDIS_URL'])
+elif app.config['SESSION_BACKEND'] != 'cookie':
+    raise ValueError('Unknown SESSION_BACKEND: {}'.format(app.config['SESSION_BACKEND']))
@@ -0,0 +1,703 @@
+# Benchmarks for the hot data paths behind the main pages
+# usage: python ./bin/benchmark.py {venues,shows,explain,autocomplete,detail,memory,render,cache,conditional,api,facets,partitions,import,export}
+#                                   [--venues 10000] [--cities 300] [--shows-per-venue 3] [--names 100000] [--page-shows 5000]
+#                                   [--tiles 10000] [--artists 1000000] [--past-shows 0,1000000,10000000] [--import-rows 100000]
+#                                   [--repeat 5]
+#
+# Runs against the database given in DATABASE_URL, defaulting to a throwaway sqlite file
+# WARNING: THE BENCHMARK DATABASE IS DROPPED AND RE-SEEDED ON EVERY RUN - DO NOT POINT IT AT REAL DATA
+
+import sys
+import os
+import argparse
+import random
+import time
+import tracemalloc
+import gzip
+import io
+import json
+import importlib.util
+from datetime import datetime, timedelta
+
+PACKAGE_PARENT = '..'
+SCRIPT_DIR = os.path.dirname(os.path.realpath(os.path.join(os.getcwd(), os.path.expanduser(__file__))))
+sys.path.append(os.path.normpath(os.path.join(SCRIPT_DIR, PACKAGE_PARENT)))
+
+os.environ.setdefault('DATABASE_URL', 'sqlite:////tmp/fyyur-benchmark.db')
+os.environ.setdefault('LAZY_LOAD_POLICY', 'raise')
+
+from sqlalchemy import event
+
+import babel.dates
+import dateutil.parser
+from flask import render_template
+
+from app import app, db, format_datetime
+from cache import response_cache
+from exports import export
+from facets import FacetFilter
+from imports import import_rows, read_rows
+from api import SHOW_FIELDS, dumps, orjson, serialize, to_json
+from models import *
+from partitions import add_months, create_show_partitions, month_start
+
+
+# counts every statement sent to the database while it is active
+class QueryCounter:
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def _count(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self._count)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, 'before_cursor_execute', self._count)
+
+
+# records the statements (and their parameters) sent to the database while it is active
+class QueryRecorder(QueryCounter):
+    def __init__(self, engine):
+        super().__init__(engine)
+        self.statements = []
+
+    def _count(self, conn, cursor, statement, parameters, context, executemany):
+        super()._count(conn, cursor, statement, parameters, context, executemany)
+        self.statements.append((statement, parameters))
+
+
+# runs the database's EXPLAIN on a recorded statement and returns the plan as text
+def explain(statement, parameters):
+    prefix = 'EXPLAIN QUERY PLAN ' if db.engine.dialect.name == 'sqlite' else 'EXPLAIN '
+    connection = db.engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute(prefix + statement, parameters)
+        return '\n'.join(' '.join(str(column) for column in row) for row in cursor.fetchall())
+    finally:
+        connection.close()
+
+
+def reset_db():
+    db.drop_all()
+    db.create_all()
+    db.session.execute(Genre.__table__.insert(), [{ "name": choice } for choice in Genre_Choices])
+    db.session.commit()
+
+
+# seeds venues spread over `cities` areas with a mix of past and upcoming shows
+def seed_venues(num_venues, num_cities, shows_per_venue):
+    states = ['CA', 'NY', 'TX', 'WA', 'IL', 'MA', 'CO', 'OR', 'GA', 'FL']
+    cities = [("City {}".format(i), states[i % len(states)]) for i in range(num_cities)]
+
+    db.session.execute(Artist.__table__.insert(), [{ "name": "Artist {}".format(i) } for i in range(100)])
+
+    venue_rows = []
+    for i in range(num_venues):
+        city, state = random.choice(cities)
+        venue_rows.append({ "name": "Venue {}".format(i), "city": city, "state": state })
+    db.session.execute(Venue.__table__.insert(), venue_rows)
+
+    now = datetime.now()
+    show_rows = []
+    for venue_id in range(1, num_venues + 1):
+        for _ in range(shows_per_venue):
+            show_rows.append({
+                "venue_id": venue_id,
+                "artist_id": random.randint(1, 100),
+                "start_time": now + timedelta(days=random.randint(-365, 365))
+            })
+    db.session.execute(Show.__table__.insert(), show_rows)
+    ShowRollover.recount()
+    db.session.commit()
+
+
+# the /venues data path as it was before Venue.get_directory (one query per area and per venue)
+def legacy_venue_directory():
+    data = []
+    locations = db.session.query(Venue.city, Venue.state).distinct()
+    for location in locations:
+        venue_list = []
+        venues = Venue.query.filter_by(city=location[0], state=location[1]).all()
+        for venue in venues:
+            num_upcoming_shows = len(venue.get_shows('upcoming'))
+            venue_list.append({"id": venue.id, "name": venue.name, "num_upcoming_shows": num_upcoming_shows})
+        data.append({"city": location[0], "state": location[1], "venues": venue_list})
+    return data
+
+
+# the /shows data path as it was before the joined projection (full Show rows, then a Venue and Artist get per show)
+def legacy_show_listing():
+    show_info = []
+    for show in Show.query.order_by(Show.start_time).all():
+        venue = Venue.query.get(show.venue_id)
+        artist = Artist.query.get(show.artist_id)
+        show_info.append({
+            'venue_id': venue.id,
+            'venue_name': venue.name,
+            'artist_id': artist.id,
+            'artist_name': artist.name,
+            'artist_image_link': artist.image_link,
+            'start_time': show.start_time.strftime('%Y-%m-%d %H:%M:%S')
+        })
+    return show_info
+
+
+# the venue page's show list as it was before the ShowCard view models: (Show, Artist) ORM pairs merged into dicts
+def legacy_venue_show_dicts(venue_id):
+    shows = db.session.query(Show, Artist).join(Artist, Artist.id == Show.artist_id) \
+        .filter(Show.venue_id == venue_id).order_by(Show.start_time).all()
+    shows = [{ **vars(show), **vars(artist) } for show, artist in shows]
+    for show in shows:
+        show['start_time'] = show['start_time'].strftime('%Y-%m-%d %H:%M:%S')
+    return shows
+
+
+# the datetime filter as it was before it took datetimes: re-parse the row's string, then format with babel
+def legacy_format_datetime(value, format='medium'):
+    date = dateutil.parser.parse(value)
+    if format == 'full':
+        format = "EEEE MMMM, d, y 'at' h:mma"
+    elif format == 'medium':
+        format = "EE MM, dd, y h:mma"
+    return babel.dates.format_datetime(date, format, locale='en')
+
+
+def percentile(sorted_timings, pct):
+    return sorted_timings[min(len(sorted_timings) - 1, int(len(sorted_timings) * pct / 100.0))]
+
+
+def measure(label, fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        db.session.expire_all()
+        with QueryCounter(db.engine) as counter:
+            start = time.perf_counter()
+            fn()
+            timings.append(time.perf_counter() - start)
+    timings.sort()
+    print("{:<34} queries: {:>7}   best: {:>9.1f} ms   median: {:>9.1f} ms".format(
+        label, counter.count, timings[0] * 1000, timings[len(timings) // 2] * 1000))
+    return timings[0]
+
+
+def bench_venues(args):
+    seed_venues(args.venues, args.cities, args.shows_per_venue)
+    print("/venues directory: {} venues, {} cities, {} shows per venue".format(args.venues, args.cities, args.shows_per_venue))
+    measure('legacy (per-area/per-venue)', legacy_venue_directory, args.repeat)
+    measure('Venue.get_directory', Venue.get_directory, args.repeat)
+
+
+def count_queries(fn):
+    db.session.expire_all()
+    with QueryCounter(db.engine) as counter:
+        fn()
+    return counter.count
+
+
+# fails if the /shows listing (all of it, or a page of it) takes more than one query
+def bench_shows(args):
+    seed_venues(args.venues, args.cities, args.shows_per_venue)
+    print("/shows listing: {} shows".format(args.venues * args.shows_per_venue))
+    measure('legacy (2N+1 gets)', legacy_show_listing, args.repeat)
+    measure('Show.get_shows', Show.get_shows, args.repeat)
+    measure('Show.get_shows_page', Show.get_shows_page, args.repeat)
+
+    extra = [(label, count) for label, count in (
+        ('Show.get_shows', count_queries(Show.get_shows)),
+        ('Show.get_shows_page', count_queries(Show.get_shows_page)),
+    ) if count != 1]
+    for label, count in extra:
+        print("{} ran {} queries, expected 1".format(label, count))
+    if extra:
+        sys.exit(1)
+
+
+# past/upcoming shows for a sample of venue and artist pages. fails if a page's shows take more than one query
+def bench_detail(args):
+    seed_venues(args.venues, args.cities, args.shows_per_venue)
+    venues = Venue.query.order_by(Venue.id).limit(100).all()
+    artists = Artist.query.order_by(Artist.id).limit(100).all()
+    print("detail pages: past/upcoming shows for {} venues and {} artists ({} shows per venue, {} per artist)".format(
+        len(venues), len(artists), args.shows_per_venue, args.venues * args.shows_per_venue // 100))
+
+    for model, entities in [(Venue, venues), (Artist, artists)]:
+        measure('legacy {} (past + upcoming)'.format(model.__name__),
+            lambda: [(entity.get_shows('past'), entity.get_shows('upcoming')) for entity in entities], args.repeat)
+        # (by id: reading entity.id off the expired entities would refresh each of them)
+        entity_ids = [entity.id for entity in entities]
+        measure('{}.get_shows_partitioned'.format(model.__name__),
+            lambda: [model.get_shows_partitioned(entity_id) for entity_id in entity_ids], args.repeat)
+
+    extra = []
+    for model, entities in [(Venue, venues), (Artist, artists)]:
+        entity_ids = [entity.id for entity in entities]
+        count = count_queries(lambda: [model.get_shows_partitioned(entity_id) for entity_id in entity_ids])
+        if count > len(entity_ids):
+            extra.append("{}.get_shows_partitioned ran {} queries for {} pages, expected at most one per page".format(
+                model.__name__, count, len(entity_ids)))
+    for message in extra:
+        print(message)
+    if extra:
+        sys.exit(1)
+
+
+# memory held by the show list of one venue page with --page-shows shows
+def bench_memory(args):
+    shows = args.page_shows
+    seed_venues(1, 1, shows)
+    print("venue page show list: {} shows".format(shows))
+
+    for label, fn in [
+        ('legacy (merged ORM __dict__s)', lambda: legacy_venue_show_dicts(1)),
+        ('ShowCards (projected rows)', lambda: Venue.get_shows_partitioned(1)),
+    ]:
+        db.session.expunge_all()
+        tracemalloc.start()
+        result = fn()
+        retained, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del result
+        print("{:<34} retained: {:>8.0f} KiB ({:>5.0f} B/show)   peak: {:>8.0f} KiB ({:>5.0f} B/show)".format(
+            label, retained / 1024.0, retained / float(shows), peak / 1024.0, peak / float(shows)))
+
+
+# renders /shows with --tiles show tiles (shows at a few evening slots over a year), with the old and new datetime filters
+def bench_render(args):
+    start = datetime(2030, 1, 1)
+    cards = [ShowCard(id=i, venue_id=1, venue_name='The Musical Hop', artist_id=1, artist_name='Guns N Petals',
+                      start_time=start + timedelta(days=random.randint(0, 365), hours=random.choice([19, 20, 21, 22])))
+             for i in range(args.tiles)]
+    legacy_cards = [ShowCard(**{ field: getattr(card, field) for field in ShowCard.__slots__ }) for card in cards]
+    for card in legacy_cards:
+        card.start_time = card.start_time.strftime('%Y-%m-%d %H:%M:%S')
+    print("/shows render: {} tiles".format(args.tiles))
+
+    with app.test_request_context('/shows'):
+        for label, shows, datetime_filter in [
+            ('legacy (str -> dateutil -> babel)', legacy_cards, legacy_format_datetime),
+            ('datetime filter (cached)', cards, format_datetime),
+        ]:
+            app.jinja_env.filters['datetime'] = datetime_filter
+            measure(label, lambda: render_template('pages/shows.html', shows=shows, page=None), args.repeat)
+        app.jinja_env.filters['datetime'] = format_datetime
+
+
+# checks that the planner picks the secondary indexes for the hot lookups (exits non-zero if any is missed)
+def bench_explain(args):
+    seed_venues(args.venues, args.cities, args.shows_per_venue)
+    db.session.execute(Venue_Genres.insert(), [
+        { "venue_id": venue_id, "genre_name": random.choice(list(Genre_Choices)) } for venue_id in range(1, args.venues + 1)
+    ])
+    db.session.commit()
+    db.session.execute(db.text('ANALYZE'))
+
+    checks = [
+        ('venue upcoming shows', 'ix_Show_venue_id_start_time', lambda: Venue.query.get(1).get_shows('upcoming')),
+        ('artist upcoming shows', 'ix_Show_artist_id_start_time', lambda: Artist.query.get(1).get_shows('upcoming')),
+        ('/shows page (upcoming)', 'ix_Show_start_time_id', lambda: Show.get_shows_page('upcoming')),
+        ('/artists page', 'ix_Artist_name_id', lambda: Artist.get_listing_page()),
+        ('/venues page', 'ix_Venue_state_city_name_id', lambda: Venue.get_directory_page()),
+        ('/artists Last-Modified', 'ix_Artist_updated_at', lambda: Artist.get_listing_last_modified()),
+        ('show counter rollover check', 'ix_Show_start_time_id', lambda: ShowRollover.rollover()),
+        ('venues by genre', 'ix_Venue_Genres_genre_name',
+            lambda: db.session.query(Venue_Genres.c.venue_id).filter(Venue_Genres.c.genre_name == Genre_Choices.Jazz).all()),
+    ]
+
+    missed = 0
+    for label, index, fn in checks:
+        db.session.expire_all()
+        with QueryRecorder(db.engine) as recorder:
+            fn()
+        plan = explain(*recorder.statements[-1])
+        used = index in plan
+        missed += not used
+        print("{:<28} {:<32} {}".format(label, index, 'used' if used else 'NOT USED'))
+        if not used or args.verbose:
+            print('    ' + plan.replace('\n', '\n    '))
+
+    if missed:
+        sys.exit(1)
+
+
+# prefix lookups against an autocomplete index of --names venue + artist names (half each)
+def bench_autocomplete(args):
+    words = ['the', 'black', 'blue', 'red', 'velvet', 'jazz', 'club', 'hall', 'room', 'band', 'sax', 'live', 'music',
+             'coffee', 'bar', 'lounge', 'garden', 'electric', 'sound', 'house', 'quartet', 'trio', 'petals', 'wild',
+             'moon', 'river', 'stone', 'golden', 'crystal', 'echo', 'night', 'owl', 'fox', 'kings', 'queens', 'union']
+    def random_name(i):
+        return '{} {} {}'.format(' '.join(random.sample(words, random.randint(1, 3))), random.choice(words).title(), i)
+
+    half = args.names // 2
+    db.session.execute(Venue.__table__.insert(), [{ "name": random_name(i) } for i in range(half)])
+    db.session.execute(Artist.__table__.insert(), [{ "name": random_name(i) } for i in range(args.names - half)])
+    db.session.commit()
+
+    start = time.perf_counter()
+    index = get_autocomplete_index()
+    print("autocomplete: {} names, {} index entries, loaded in {:.0f} ms".format(
+        len(index), len(index.entries), (time.perf_counter() - start) * 1000))
+
+    client = app.test_client()
+    prefixes = [random.choice(words)[:random.randint(1, 4)] for _ in range(10000)]
+    for label, lookup, count in [
+        ('PrefixIndex.complete', lambda prefix: index.complete(prefix), len(prefixes)),
+        ('GET /api/autocomplete', lambda prefix: client.get('/api/autocomplete?q=' + prefix), 2000),
+    ]:
+        timings = []
+        for prefix in prefixes[:count]:
+            start = time.perf_counter()
+            lookup(prefix)
+            timings.append(time.perf_counter() - start)
+        timings.sort()
+        print("{:<28} p50: {:>7.3f} ms   p99: {:>7.3f} ms   max: {:>7.3f} ms".format(
+            label, percentile(timings, 50) * 1000, percentile(timings, 99) * 1000, timings[-1] * 1000))
+
+
+# cold (cache cleared before every request) vs warm requests for the cached pages
+def bench_cache(args):
+    seed_venues(args.venues, args.cities, args.shows_per_venue)
+    print("response cache ({} backend): {} venues, {} shows".format(
+        app.config['RESPONSE_CACHE_BACKEND'], args.venues, args.venues * args.shows_per_venue))
+
+    client = app.test_client()
+    for url in ['/venues', '/artists', '/shows', '/venues/1', '/artists/1']:
+        def cold():
+            response_cache.clear()
+            client.get(url)
+        measure('GET {} (miss)'.format(url), cold, args.repeat)
+        measure('GET {} (hit)'.format(url), lambda: client.get(url), args.repeat)
+
+
+# a venue page revalidated with If-None-Match: the 304 must come from a single query reading the venue's row by
+# primary key plus one entry of ix_Show_venue_id_start_time, without rendering (exits non-zero otherwise)
+def bench_conditional(args):
+    seed_venues(args.venues, args.cities, args.shows_per_venue)
+    db.session.execute(db.text('ANALYZE'))
+    client = app.test_client()
+    etag = client.get('/venues/1').headers['ETag']
+    revalidate = lambda: client.get('/venues/1', headers={ 'If-None-Match': etag })
+
+    with QueryRecorder(db.engine) as recorder:
+        response = revalidate()
+    plan = explain(*recorder.statements[0])
+    print("GET /venues/1 with If-None-Match: {} after {} quer{}".format(
+        response.status_code, len(recorder.statements), 'y' if len(recorder.statements) == 1 else 'ies'))
+    print('    ' + plan.replace('\n', '\n    '))
+
+    def render():
+        response_cache.clear()
+        client.get('/venues/1')
+    measure('GET /venues/1 (rendered)', render, args.repeat)
+    measure('GET /venues/1 (cached)', lambda: client.get('/venues/1'), args.repeat)
+    measure('GET /venues/1 (304)', revalidate, args.repeat)
+
+    if response.status_code != 304 or len(recorder.statements) != 1 or 'ix_Show_venue_id_start_time' not in plan:
+        sys.exit(1)
+
+
+# the json api against the html pages it mirrors: whole requests with the page cache off (so both sides query and
+# render/serialize every time) and their body sizes, then serializing --tiles show cards alone
+def bench_api(args):
+    seed_venues(args.venues, args.cities, args.shows_per_venue)
+    print("json api vs html: {} venues, {} shows".format(args.venues, args.venues * args.shows_per_venue))
+
+    backend = response_cache.backend
+    response_cache.backend = None
+    client = app.test_client()
+    for html_url, api_url in [('/venues', '/api/v1/venues'), ('/shows', '/api/v1/shows'),
+                              ('/venues/1', '/api/v1/venues/1'), ('/artists/1', '/api/v1/artists/1')]:
+        for url in (html_url, api_url):
+            measure('GET {}'.format(url), lambda: client.get(url), args.repeat)
+            body = client.get(url).get_data()
+            print("{:<34} body: {:>9} B   gzip: {:>9} B".format('', len(body), len(gzip.compress(body, compresslevel=5))))
+    response_cache.backend = backend
+
+    start = datetime(2030, 1, 1)
+    cards = [ShowCard(id=i, venue_id=1, venue_name='The Musical Hop', artist_id=1, artist_name='Guns N Petals',
+                      start_time=start + timedelta(days=random.randint(0, 365), hours=random.choice([19, 20, 21, 22])))
+             for i in range(args.tiles)]
+    print("{} show cards:".format(args.tiles))
+    with app.test_request_context('/shows'):
+        measure('render pages/shows.html', lambda: render_template('pages/shows.html', shows=cards, page=None), args.repeat)
+    measure('api dumps ({})'.format('orjson' if orjson is not None else 'stdlib json'),
+        lambda: dumps({ 'data': serialize(cards, SHOW_FIELDS) }), args.repeat)
+    measure('api dumps (stdlib json)',
+        lambda: json.dumps({ 'data': serialize(cards, SHOW_FIELDS) }, separators=(',', ':'), default=to_json).encode('utf-8'), args.repeat)
+
+
+# the counts of a facet filter the way sql would answer them: the matching artists (an EXISTS per genre for 'all',
+# one with IN for 'any'), then their genres, states and seeking flags grouped and counted
+def sql_facet_counts(facet_filter):
+    conditions = []
+    if facet_filter.genres:
+        genre_groups = [[genre] for genre in facet_filter.genres] if facet_filter.match == 'all' else [facet_filter.genres]
+        for genres in genre_groups:
+            conditions.append(db.session.query(Artist_Genres.c.artist_id)
+                .filter(Artist_Genres.c.artist_id == Artist.id, Artist_Genres.c.genre_name.in_([Genre_Choices[genre] for genre in genres]))
+                .exists())
+    if facet_filter.state:
+        conditions.append(Artist.state == facet_filter.state)
+    if facet_filter.city:
+        conditions.append(Artist.city == facet_filter.city)
+    if facet_filter.seeking:
+        conditions.append(Artist.seeking_venue.is_(True))
+    matches = db.session.query(Artist.id).filter(*conditions).subquery()
+
+    genres = dict(db.session.query(Artist_Genres.c.genre_name, db.func.count())
+        .join(matches, matches.c.id == Artist_Genres.c.artist_id).group_by(Artist_Genres.c.genre_name))
+    states = dict(db.session.query(Artist.state, db.func.count()).join(matches, matches.c.id == Artist.id).group_by(Artist.state))
+    count, seeking = db.session.query(db.func.count(), db.func.coalesce(db.func.sum(db.case((Artist.seeking_venue.is_(True), 1), else_=0)), 0)) \
+        .join(matches, matches.c.id == Artist.id).one()
+    return {
+        'count': count,
+        'genres': { choice.name: genres.get(choice, 0) for choice in Genre_Choices },
+        'states': { state: states[state] for state in sorted(states) },
+        'seeking': seeking
+    }
+
+
+# genre / area / seeking facets over --artists artists: loading the bitmap index, then matching and counting a few
+# filters with it against the same counts in sql, and a filtered /artists page (exits non-zero if the counts differ)
+def bench_facets(args):
+    states = ['CA', 'NY', 'TX', 'WA', 'IL', 'MA', 'CO', 'OR', 'GA', 'FL']
+    cities = [("City {}".format(i), states[i % len(states)]) for i in range(args.cities)]
+    choices = list(Genre_Choices)
+    for first in range(1, args.artists + 1, 100000):
+        artist_rows = []
+        genre_rows = []
+        for artist_id in range(first, min(first + 100000, args.artists + 1)):
+            city, state = random.choice(cities)
+            artist_rows.append({ "id": artist_id, "name": "Artist {}".format(artist_id), "city": city, "state": state,
+                "seeking_venue": random.random() < 0.2 })
+            genre_rows.extend({ "artist_id": artist_id, "genre_name": choice } for choice in random.sample(choices, random.randint(1, 3)))
+        db.session.execute(Artist.__table__.insert(), artist_rows)
+        db.session.execute(Artist_Genres.insert(), genre_rows)
+    db.session.commit()
+    db.session.execute(db.text('ANALYZE'))
+
+    start = time.perf_counter()
+    index = get_facet_index(Artist)
+    print("facets: {} artists, {} cities; index of {} bitsets ({:.1f} MiB) loaded in {:.0f} ms".format(
+        len(index), args.cities, len(index.bytes), sum(len(data) for data in index.bytes.values()) / 1048576.0,
+        (time.perf_counter() - start) * 1000))
+
+    filters = [
+        ('1 genre', FacetFilter(['Jazz'], 'any', None, None, False)),
+        ('any of 3 genres, state', FacetFilter(['Jazz', 'Blues', 'Soul'], 'any', 'CA', None, False)),
+        ('all of 2 genres, seeking', FacetFilter(['Jazz', 'Blues'], 'all', None, None, True)),
+        ('genre, city', FacetFilter(['Rock_n_Roll'], 'any', cities[1][1], cities[1][0], False)),
+    ]
+    mismatches = 0
+    for label, facet_filter in filters:
+        counts = facet_counts(index, facet_match(index, facet_filter))
+        print("{}: {} matches".format(label, counts['count']))
+        measure('  bitmap match + counts', lambda: facet_counts(index, facet_match(index, facet_filter)), args.repeat)
+        measure('  sql counts', lambda: sql_facet_counts(facet_filter), args.repeat)
+        measure('  Artist.get_faceted_listing_page', lambda: Artist.get_faceted_listing_page(facet_filter), args.repeat)
+        if counts != sql_facet_counts(facet_filter):
+            print("  bitmap and sql counts differ")
+            mismatches += 1
+
+    # a write updates the bitsets in place: one artist moved to another genre
+    measure('FacetIndex.add (one artist)', lambda: index.add(1, facet_keys(['Jazz'], 'CA', 'City 0', False)), args.repeat)
+    if mismatches:
+        sys.exit(1)
+
+
+# applies the month partitioning migration to the freshly created (postgres) tables
+def partition_show_table():
+    from alembic.migration import MigrationContext
+    from alembic.operations import Operations
+
+    path = os.path.join(SCRIPT_DIR, PACKAGE_PARENT, 'migrations', 'versions', 'c5f8a2d41e97_partition_show_by_month.py')
+    spec = importlib.util.spec_from_file_location('partition_show_by_month', path)
+    migration = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(migration)
+    connection = db.session.connection()
+    with Operations.context(MigrationContext.configure(connection)):
+        migration.upgrade()
+    db.session.commit()
+
+
+# the time range queries (upcoming shows, a month of the /shows feed, a venue's upcoming shows and calendar) with a
+# fixed set of upcoming shows (and the year of past ones from seed_venues) while the past shows grow in --past-shows steps, spread over the 10 years before now.
+# on postgres the Show table is partitioned first, like migration c5f8a2d41e97 does, and the plan of the range query
+# is printed to show the partitions it prunes (exits non-zero if a query got more than 3x slower over the steps)
+def bench_partitions(args):
+    partitioned = db.engine.dialect.name == 'postgresql'
+    if partitioned:
+        partition_show_table()
+    now = datetime.now()
+    first_past = now - timedelta(days=3650)
+    create_show_partitions(db.session.connection(), first_past, now + timedelta(days=365))
+    db.session.commit()
+
+    seed_venues(args.venues, args.cities, args.shows_per_venue)
+
+    next_month = add_months(month_start(now), 1)
+    venue_id = db.session.query(Show.venue_id).filter(Show.start_time > now).first()[0]
+    queries = [
+        ('Show.get_shows_page (upcoming)', lambda: Show.get_shows_page('upcoming')),
+        ('Show.get_shows_page (next month)', lambda: Show.get_shows_page(start=next_month, end=add_months(next_month, 1))),
+        ('Venue.shows_query (upcoming)', lambda: paginate(Venue.shows_query(venue_id, 'upcoming').order_by(None),
+            [Show.start_time, Show.id])),
+        ('Venue.get_calendar (next month)', lambda: Venue.get_calendar(venue_id, next_month)),
+    ]
+
+    print("partitions: {} upcoming shows at {} venues{}".format(Show.query.filter(Show.start_time > now).count(), args.venues,
+        ' (Show partitioned by month)' if partitioned else ' (plain Show table, not postgres)'))
+    past = 0
+    timings = []
+    for target in [int(step) for step in args.past_shows.split(',')]:
+        while past < target:
+            batch = min(100000, target - past)
+            db.session.execute(Show.__table__.insert(), [{
+                "venue_id": random.randint(1, args.venues),
+                "artist_id": random.randint(1, 100),
+                "start_time": first_past + timedelta(seconds=random.randint(0, 3650 * 86400 - 1))
+            } for _ in range(batch)])
+            past += batch
+        db.session.commit()
+        db.session.execute(db.text('ANALYZE'))
+        db.session.commit()
+        print("{} past shows:".format(past))
+        timings.append([measure('  ' + label, fn, args.repeat) for label, fn in queries])
+
+    if partitioned:
+        with QueryRecorder(db.engine) as recorder:
+            Show.get_shows_page(start=next_month, end=add_months(next_month, 1))
+        print(explain(*recorder.statements[-1]))
+
+    slower = [label for (label, fn), first, last in zip(queries, timings[0], timings[-1]) if last > first * 3 + 0.001]
+    for label in slower:
+        print("{} got more than 3x slower as the past shows grew".format(label))
+    if slower:
+        sys.exit(1)
+
+
+# the bulk import (imports.py) of --import-rows venues (CSV), artists (JSONL) and shows between them (CSV), against
+# its target of 50k rows/s
+IMPORT_TARGET_ROWS_PER_SECOND = 50000
+
+def import_stream(lines):
+    return io.BytesIO(('\n'.join(lines) + '\n').encode('utf-8'))
+
+def bench_import(args):
+    rows = args.import_rows
+    venues = import_stream(['name,city,state,address,phone,genres,website,image_link'] + [
+        'Venue {0},City {1},CA,{0} Main St,415-555-{2:04d},Jazz;Folk,https://venue-{0}.example.com,https://img.example.com/venue-{0}.jpg'.format(
+            i, i % 300, i % 10000) for i in range(rows)
+    ])
+    artists = import_stream([json.dumps({
+        'name': 'Artist {}'.format(i), 'city': 'City {}'.format(i % 300), 'state': 'NY', 'phone': '212-555-0100',
+        'genres': ['Rock_n_Roll', 'Blues'], 'website': 'https://artist-{}.example.com'.format(i)
+    }) for i in range(rows)])
+    # every show three hours after the last one, so none of them overlap
+    first = datetime.now().replace(microsecond=0) + timedelta(days=1)
+    shows = import_stream(['venue_id,artist_id,start_time,duration'] + [
+        '{},{},{},120'.format(1 + i % rows, 1 + (i * 7) % rows, first + timedelta(hours=3 * i)) for i in range(rows)
+    ])
+
+    print("bulk import: {} rows of each kind (target {} rows/s)".format(rows, IMPORT_TARGET_ROWS_PER_SECOND))
+    failed = 0
+    for kind, import_format, stream in (('venues', 'csv', venues), ('artists', 'jsonl', artists), ('shows', 'csv', shows)):
+        start = time.perf_counter()
+        result = import_rows(kind, read_rows(stream, import_format))
+        elapsed = time.perf_counter() - start
+        print("{:<8} {:>5}: {:>8} imported, {} failed   {:>8.1f} s   {:>9.0f} rows/s".format(
+            kind, import_format, result.imported, result.failed, elapsed, rows / elapsed))
+        for row_error in result.errors[:5]:
+            print("  line {}: {}".format(row_error.line, row_error.errors))
+        failed += result.failed
+
+    mismatches = ShowRollover.check()
+    print("{} venue/artist show counters off".format(len(mismatches)))
+    if failed or mismatches:
+        sys.exit(1)
+
+
+# the bulk export (exports.py) of the shows as CSV and gzipped JSONL, at --venues x --shows-per-venue shows and
+# at ten times that: its peak memory has to stay flat as the table grows
+def export_shows(export_format, compress):
+    size = 0
+    for chunk in export('shows', export_format, compress=compress):
+        size += len(chunk)
+    return size
+
+def bench_export(args):
+    seed_venues(args.venues, args.cities, args.shows_per_venue)
+    peaks = []
+    for multiple in (1, 10):
+        if multiple > 1:
+            for _ in range(multiple - 1):
+                db.session.execute(Show.__table__.insert(), [{
+                    "venue_id": random.randint(1, args.venues),
+                    "artist_id": random.randint(1, 100),
+                    "start_time": datetime.now() + timedelta(days=random.randint(-365, 365))
+                } for _ in range(args.venues * args.shows_per_venue)])
+            db.session.commit()
+        shows = Show.query.count()
+        print("bulk export: {} shows".format(shows))
+        for export_format, compress in (('csv', False), ('jsonl', True)):
+            start = time.perf_counter()
+            export_shows(export_format, compress)
+            elapsed = time.perf_counter() - start
+            db.session.expunge_all()
+            tracemalloc.start()
+            size = export_shows(export_format, compress)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            peaks.append(peak)
+            print("  {:<12} {:>8.1f} MB   {:>7.2f} s   {:>9.0f} rows/s   peak: {:>8.0f} KiB".format(
+                export_format + (' (gzip)' if compress else ''), size / 1e6, elapsed, shows / elapsed, peak / 1024.0))
+
+    grown = [later / float(earlier) for earlier, later in zip(peaks[:2], peaks[2:])]
+    if any(ratio > 2 for ratio in grown):
+        print("the export's peak memory grew {:.1f}x with 10x the shows".format(max(grown)))
+        sys.exit(1)
+
+
+BENCHMARKS = {
+    'venues': bench_venues,
+    'shows': bench_shows,
+    'explain': bench_explain,
+    'autocomplete': bench_autocomplete,
+    'detail': bench_detail,
+    'memory': bench_memory,
+    'render': bench_render,
+    'cache': bench_cache,
+    'conditional': bench_conditional,
+    'api': bench_api,
+    'facets': bench_facets,
+    'partitions': bench_partitions,
+    'import': bench_import,
+    'export': bench_export,
+}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark fyyur data paths against a freshly seeded database.')
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS))
+    parser.add_argument('--venues', type=int, default=10000)
+    parser.add_argument('--cities', type=int, default=300)
+    parser.add_argument('--shows-per-venue', type=int, default=3)
+    parser.add_argument('--page-shows', type=int, default=5000)
+    parser.add_argument('--tiles', type=int, default=10000)
+    parser.add_argument('--names', type=int, default=100000)
+    parser.add_argument('--artists', type=int, default=1000000)
+    parser.add_argument('--past-shows', default='0,1000000,10000000')
+    parser.add_argument('--import-rows', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    with app.app_context():
+        reset_db()
+        BENCHMARKS[args.benchmark](args)
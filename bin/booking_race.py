@@ -0,0 +1,167 @@
+# Races concurrent show submissions for the same venue / artist slot and checks that exactly one of them gets it
+# usage: python ./bin/booking_race.py [--threads 16] [--processes 4] [--rounds 5]
+#
+# Each round posts /shows/create for the same slot from
+#  1. --threads threads of one process, which the process's booking trees (see intervals.py) have to settle
+#  2. --processes forked processes, each with its own cold booking trees, which only the database's booking
+#     constraint (migration e4b9c1d7a352: GiST exclusion constraints on postgres, a trigger on sqlite) can settle
+# all of them wanting the same venue (with either of two artists) in odd rounds and the same artist (at either of two
+# venues) in even ones, then counts the slot's shows. Also checks
+# that a show right after another one (starting as it ends) is accepted and one overlapping it by a minute is not,
+# and that a slow tree load for one venue doesn't hold up a booking at another.
+# Exits non-zero if a slot ends up with more or less than one show, or the other booking waits for the slow load.
+#
+# Runs against the database given in DATABASE_URL, defaulting to a throwaway sqlite file
+# WARNING: THE DATABASE IS DROPPED AND RE-CREATED ON EVERY RUN - DO NOT POINT IT AT REAL DATA
+
+import sys
+import os
+import argparse
+import importlib.util
+import multiprocessing
+import threading
+import time
+from datetime import datetime, timedelta
+
+PACKAGE_PARENT = '..'
+SCRIPT_DIR = os.path.dirname(os.path.realpath(os.path.join(os.getcwd(), os.path.expanduser(__file__))))
+sys.path.append(os.path.normpath(os.path.join(SCRIPT_DIR, PACKAGE_PARENT)))
+
+os.environ.setdefault('DATABASE_URL', 'sqlite:////tmp/fyyur-booking-race.db')
+
+from alembic.migration import MigrationContext
+from alembic.operations import Operations
+
+from app import app, db
+from models import *
+from intervals import BookingIndex, LOCK_STRIPES
+
+VENUES = 2
+ARTISTS = 2
+
+def reset_db():
+    db.drop_all()
+    db.create_all()
+    db.session.execute(Venue.__table__.insert(), [{ "name": "Race Venue {}".format(i), "city": "Racetown", "state": "CA" } for i in range(VENUES)])
+    db.session.execute(Artist.__table__.insert(), [{ "name": "Race Artist {}".format(i), "city": "Racetown", "state": "CA" } for i in range(ARTISTS)])
+    db.session.commit()
+
+    # the booking constraints come with migration e4b9c1d7a352, not with create_all
+    path = os.path.join(SCRIPT_DIR, PACKAGE_PARENT, 'migrations', 'versions', 'e4b9c1d7a352_add_show_end_time_and_booking_constraints.py')
+    spec = importlib.util.spec_from_file_location('booking_constraints', path)
+    migration = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(migration)
+    with Operations.context(MigrationContext.configure(db.session.connection())):
+        migration.create_booking_constraints()
+    db.session.commit()
+
+# the form of the i-th competitor for a slot: all of them want venue 1 (`shared` 'venue') or artist 1 ('artist'),
+# so each of them conflicts with the first show to get in
+def show_form(i, start_time, shared='venue', duration=120):
+    venue_id, artist_id = (1, 1 + i % 2) if shared == 'venue' else (1 + i % 2, 1)
+    return { 'venue_id': str(venue_id), 'artist_id': str(artist_id), 'start_time': str(start_time), 'duration': str(duration) }
+
+def post_show(form):
+    with app.test_client() as client:
+        return client.post('/shows/create', data=form).status_code
+
+def slot_shows(start_time):
+    with app.app_context():
+        count = Show.query.filter(Show.start_time == start_time).count()
+        db.session.remove()
+        return count
+
+def race_threads(start_time, count, shared):
+    barrier = threading.Barrier(count)
+    def compete(i):
+        barrier.wait()
+        post_show(show_form(i, start_time, shared))
+    threads = [threading.Thread(target=compete, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+def compete_in_process(barrier, i, start_time, shared):
+    # (a forked child must not share its parent's database connections)
+    with app.app_context():
+        db.engine.dispose(close=False)
+    bookings.trees.clear()
+    barrier.wait()
+    post_show(show_form(i, start_time, shared))
+
+def race_processes(start_time, count, shared):
+    context = multiprocessing.get_context('fork')
+    barrier = context.Barrier(count)
+    processes = [context.Process(target=compete_in_process, args=(barrier, i, start_time, shared)) for i in range(count)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+# reserves at one venue while another venue's tree takes `delay` seconds to load; returns how long that took
+def time_beside_slow_load(delay=1.0):
+    slow = ('venue', 'slow')
+    other = next(('venue', i) for i in range(LOCK_STRIPES + 1) if hash(('venue', i)) % LOCK_STRIPES != hash(slow) % LOCK_STRIPES)
+    def load(owner, start, end=None):
+        if owner == slow:
+            time.sleep(delay)
+        return []
+    index = BookingIndex(load, BOOKING_REFRESH_SECONDS)
+    start_time = datetime.now() + timedelta(days=1)
+    thread = threading.Thread(target=index.reserve, args=([slow], start_time, start_time + timedelta(hours=2), object()))
+    thread.start()
+    time.sleep(delay / 10)
+    started = time.perf_counter()
+    index.reserve([other], start_time, start_time + timedelta(hours=2), object())
+    elapsed = time.perf_counter() - started
+    thread.join()
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description='Race show submissions for the same slot.')
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    with app.app_context():
+        reset_db()
+        db.session.remove()
+
+    failures = 0
+    first = (datetime.now() + timedelta(days=30)).replace(hour=20, minute=0, second=0, microsecond=0)
+    for round_number in range(args.rounds):
+        for label, race, count, day in (
+            ('threads', race_threads, args.threads, 2 * round_number),
+            ('processes', race_processes, args.processes, 2 * round_number + 1),
+        ):
+            start_time = first + timedelta(days=day)
+            shared = 'venue' if round_number % 2 == 0 else 'artist'
+            race(start_time, count, shared)
+            shows = slot_shows(start_time)
+            print("round {} {:<9} {:>3} competitors for one {:<6} -> {} show{}".format(
+                round_number + 1, label, count, shared, shows, '' if shows == 1 else 's'))
+            failures += shows != 1
+
+    # a show starting as the previous one ends is fine, one overlapping it by a minute is not
+    slot = first + timedelta(days=2 * args.rounds)
+    post_show(show_form(0, slot))
+    post_show(show_form(0, slot + timedelta(minutes=120)))
+    post_show(show_form(0, slot + timedelta(minutes=239)))
+    with app.app_context():
+        booked = Show.query.filter(Show.start_time >= slot, Show.start_time < slot + timedelta(days=1)).count()
+    print("back to back: {} of 3 shows booked (expected 2)".format(booked))
+    failures += booked != 2
+
+    waited = time_beside_slow_load()
+    print("booking beside a 1s tree load: {:.3f}s".format(waited))
+    failures += waited > 0.5
+
+    if failures:
+        print("{} check(s) failed".format(failures))
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
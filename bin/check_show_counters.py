@@ -0,0 +1,39 @@
+# Checks the venues' and artists' upcoming/past show counters (see ShowRollover in models.py) against their shows
+# usage: python ./bin/check_show_counters.py [--fix]
+#
+# Prints every venue/artist whose counters are off and exits non-zero if there are any. --fix recounts them all.
+
+import sys
+import os
+import argparse
+
+PACKAGE_PARENT = '..'
+SCRIPT_DIR = os.path.dirname(os.path.realpath(os.path.join(os.getcwd(), os.path.expanduser(__file__))))
+sys.path.append(os.path.normpath(os.path.join(SCRIPT_DIR, PACKAGE_PARENT)))
+
+from app import app, db
+from models import *
+
+
+def check_show_counters(fix=False):
+    ShowRollover.rollover()
+    mismatches = ShowRollover.check()
+    for model, entity_id, stored, counted in mismatches:
+        print("{} {}: counters say {} upcoming / {} past, shows say {} / {}".format(model, entity_id, stored[0], stored[1], counted[0], counted[1]))
+    if mismatches and fix:
+        ShowRollover.recount()
+        db.session.commit()
+        print("Recounted the show counters.")
+    return mismatches
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check the upcoming/past show counters against the shows.')
+    parser.add_argument('--fix', action='store_true', help='recount the counters if any are off')
+    args = parser.parse_args()
+
+    with app.app_context():
+        mismatches = check_show_counters(args.fix)
+    print("{} venue/artist counters off".format(len(mismatches)))
+    if mismatches and not args.fix:
+        sys.exit(1)
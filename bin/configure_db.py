@@ -1,31 +1,132 @@
-# Script to populate new db with new data (data matches up with fake data from exercise starter script)
+# Script to populate new db with data, either the data matching up with the fake data from the exercise starter script
+# (the default "fixtures" profile) or a synthetic data set of any size for load testing ("synthetic" profile)
+# usage: python ./bin/configure_db.py [fixtures]
+#        python ./bin/configure_db.py synthetic [--venues 10000] [--artists 20000] [--shows 1000000] [--cities 500]
+#                                     [--max-genres 3] [--past-fraction 0.5] [--days 365] [--skew 1.0] [--seed 0]
 # for dev/setup purposes only
 # WARNING: THIS SCRIPT ERASES ALL EXISTING DATA IN DATABASE (LEAVING TABLES INTACT)
 
 import sys
 import os
+import argparse
+import io
+import random
+import time
+from datetime import datetime, timedelta
+from itertools import accumulate, islice
+
+import dateutil.parser
+from sqlalchemy import event
 
 PACKAGE_PARENT = '..'
 SCRIPT_DIR = os.path.dirname(os.path.realpath(os.path.join(os.getcwd(), os.path.expanduser(__file__))))
 sys.path.append(os.path.normpath(os.path.join(SCRIPT_DIR, PACKAGE_PARENT)))
 
-from app import db
+from app import app, db
 from models import *
+from partitions import create_show_partitions, ensure_show_partitions
+
+# rows are sent to the database in batches of this many (one COPY / executemany each)
+BATCH_SIZE = 50000
 
-# tool to clear all data from database while leaving schema intact:
+# tool to clear all data from database while leaving schema intact (and restarting the id sequences):
 def clear_data(session):
-    meta = db.metadata
-    for table in reversed(meta.sorted_tables):
-        print('Clearing table {tablename}...'.format(tablename=table))
-        session.execute(table.delete())
+    tables = list(reversed(db.metadata.sorted_tables))
+    print('Clearing tables {tablenames}...'.format(tablenames=', '.join(table.name for table in tables)))
+    if session.get_bind().dialect.name == 'postgresql':
+        session.execute(db.text('TRUNCATE {} RESTART IDENTITY CASCADE'.format(', '.join('"{}"'.format(table.name) for table in tables))))
+    else:
+        for table in tables:
+            session.execute(table.delete())
     session.commit()
 
-# clear all data - WARNING: THIS WILL DELETE ALL EXISTING DATA: 
-# USE WITH CAUTION
-clear_data(db.session)
-db.session.execute('ALTER SEQUENCE "Artist_id_seq" RESTART WITH 1')
-db.session.execute('ALTER SEQUENCE "Venue_id_seq" RESTART WITH 1')
-db.session.execute('ALTER SEQUENCE "Show_id_seq" RESTART WITH 1')
+#----------------------------------------------------------------------------#
+# Bulk loading.
+#----------------------------------------------------------------------------#
+
+def batches(rows, size):
+    rows = iter(rows)
+    batch = list(islice(rows, size))
+    while batch:
+        yield batch
+        batch = list(islice(rows, size))
+
+# converts a column's values to what's sent to the database driver (None if they go as they are)
+def column_converter(column):
+    if isinstance(column.type, db.DateTime):
+        return lambda value: value.isoformat(' ') if value is not None else None
+    if isinstance(column.type, db.Enum):
+        return lambda value: value.name if value is not None else None
+    return None
+
+# one value in COPY's text format
+def copy_value(value):
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+# loads rows (tuples of `columns`) into `table` straight through the driver, skipping the ORM/Core per-row
+# processing: with COPY on postgres (psycopg2), with executemany anywhere else. columns left out (e.g.
+# updated_at) get their server defaults
+def bulk_insert(table, columns, rows):
+    start = time.perf_counter()
+    connection = db.session.connection()
+    cursor = connection.connection.cursor()
+    use_copy = hasattr(cursor, 'copy_expert')
+    if use_copy:
+        statement = 'COPY "{}" ({}) FROM STDIN'.format(table.name, ', '.join('"{}"'.format(column) for column in columns))
+    else:
+        # written out by hand: a compiled Core insert would also bind the python-side defaults (e.g. updated_at)
+        paramstyle = connection.dialect.paramstyle
+        placeholders = {
+            'qmark': ['?'] * len(columns),
+            'format': ['%s'] * len(columns),
+            'numeric': [':{}'.format(i) for i in range(1, len(columns) + 1)],
+            'named': [':{}'.format(column) for column in columns],
+            'pyformat': ['%({})s'.format(column) for column in columns],
+        }[paramstyle]
+        quote = connection.dialect.identifier_preparer.quote
+        statement = 'INSERT INTO {} ({}) VALUES ({})'.format(
+            quote(table.name), ', '.join(quote(column) for column in columns), ', '.join(placeholders))
+        positional = paramstyle in ('qmark', 'format', 'numeric')
+
+    converters = [(i, converter) for i, converter in enumerate(column_converter(table.c[column]) for column in columns) if converter]
+    def convert(row):
+        row = list(row)
+        for i, converter in converters:
+            row[i] = converter(row[i])
+        return row
+
+    count = 0
+    for batch in batches(map(convert, rows), BATCH_SIZE):
+        if use_copy:
+            cursor.copy_expert(statement, io.StringIO(''.join('\t'.join(copy_value(value) for value in row) + '\n' for row in batch)))
+        elif positional:
+            cursor.executemany(statement, batch)
+        else:
+            cursor.executemany(statement, [dict(zip(columns, row)) for row in batch])
+        count += len(batch)
+
+    elapsed = time.perf_counter() - start
+    print("Loaded {} rows into {} in {:.1f}s ({:.0f} rows/s)...".format(count, table.name, elapsed, count / max(elapsed, 1e-6)))
+
+# rows are loaded with explicit ids, so the id sequences have to be moved past them afterwards
+def reset_sequences():
+    if db.session.get_bind().dialect.name != 'postgresql':
+        return
+    for model in (Venue, Artist, Show):
+        db.session.execute(db.text(
+            "SELECT setval(pg_get_serial_sequence('\"{table}\"', 'id'), coalesce(max(id), 0) + 1, false) FROM \"{table}\"".format(table=model.__tablename__)
+        ))
+
+def load_genres():
+    bulk_insert(Genre.__table__, ['name'], [(choice,) for choice in Genre_Choices])
+
+#----------------------------------------------------------------------------#
+# Fixtures profile.
+#----------------------------------------------------------------------------#
 
 artist_data = [
     {
@@ -124,7 +225,7 @@ show_data = [
         "artist_id": 3
     },
     {
-        "start_time": "2035-04-15T20:00:00.000Z",
+        "start_time": "2035-04-22T20:00:00.000Z",
         "venue_id": 3,
         "artist_id": 3
     }
@@ -153,33 +254,180 @@ venue_genre_data = [
 ]
 
 
-def populate_table(data, model):
-    for item in data:
-        entry = model(**item)
-        db.session.add(entry)
-        print("New element added to {}...".format(model))
-    print("Finished populating {}...".format(model))
-        
+def rows_of(data, columns):
+    return [tuple(item.get(column) for column in columns) for item in data]
+
+def load_fixtures(args):
+    artist_columns = ['id', 'name', 'city', 'state', 'phone', 'website', 'facebook_link', 'seeking_venue', 'seeking_description', 'image_link']
+    venue_columns = ['id', 'name', 'address', 'city', 'state', 'phone', 'website', 'facebook_link', 'seeking_talent', 'seeking_description', 'image_link']
+
+    bulk_insert(Artist.__table__, artist_columns, rows_of([dict(item, id=i) for i, item in enumerate(artist_data, 1)], artist_columns))
+    bulk_insert(Venue.__table__, venue_columns, rows_of([dict(item, id=i) for i, item in enumerate(venue_data, 1)], venue_columns))
+    load_genres()
+    # fixture times are written as UTC ("Z") but stored as they read, like the original string inserts did
+    start_times = [dateutil.parser.parse(item['start_time']).replace(tzinfo=None) for item in show_data]
+    bulk_insert(Show.__table__, ['id', 'venue_id', 'artist_id', 'start_time', 'end_time'], [
+        (i, item['venue_id'], item['artist_id'], start_time, start_time + DEFAULT_SHOW_DURATION)
+        for i, (item, start_time) in enumerate(zip(show_data, start_times), 1)
+    ])
+    bulk_insert(Artist_Genres, ['artist_id', 'genre_name'], [(item['artist_id'], Genre_Choices[item['genre_name']]) for item in artist_genre_data])
+    bulk_insert(Venue_Genres, ['venue_id', 'genre_name'], [(item['venue_id'], Genre_Choices[item['genre_name']]) for item in venue_genre_data])
+
+#----------------------------------------------------------------------------#
+# Synthetic profile.
+#----------------------------------------------------------------------------#
+
+STATES = ['AL', 'AZ', 'CA', 'CO', 'FL', 'GA', 'IL', 'LA', 'MA', 'MI', 'MN', 'NC', 'NV', 'NY', 'OH', 'OR', 'PA', 'TN', 'TX', 'WA']
+WORDS = ['the', 'black', 'blue', 'red', 'velvet', 'jazz', 'club', 'hall', 'room', 'band', 'sax', 'live', 'music',
+         'coffee', 'bar', 'lounge', 'garden', 'electric', 'sound', 'house', 'quartet', 'trio', 'petals', 'wild',
+         'moon', 'river', 'stone', 'golden', 'crystal', 'echo', 'night', 'owl', 'fox', 'kings', 'queens', 'union']
+# shows start on the hour or half hour between 7pm and 11pm
+SHOW_SLOTS = [timedelta(hours=hour, minutes=minute) for hour in range(19, 23) for minute in (0, 30)]
+
+# cumulative zipf-like weights for n items (item i weighs 1 / i ** skew; skew 0 is uniform)
+def zipf_weights(n, skew):
+    return list(accumulate(1.0 / (rank ** skew) for rank in range(1, n + 1)))
+
+def random_name(i):
+    return '{} {} {}'.format(' '.join(random.sample(WORDS, random.randint(1, 3))), random.choice(WORDS).title(), i).title()
+
+# (id, name, city, state, ...) for `count` venues/artists spread over the areas, more of them in the big ones
+def synthetic_entities(count, areas, area_weights, kind):
+    for entity_id, (city, state) in enumerate(random.choices(areas, cum_weights=area_weights, k=count), 1):
+        yield (
+            entity_id,
+            random_name(entity_id),
+            city,
+            state,
+            '{:03d}-555-{:04d}'.format(random.randint(200, 999), entity_id % 10000),
+            'https://{}{}.example.com'.format(kind, entity_id),
+            random.random() < 0.3
+        )
+
+def synthetic_genre_links(count, max_genres):
+    choices = list(Genre_Choices)
+    for entity_id in range(1, count + 1):
+        for choice in random.sample(choices, random.randint(1, max_genres)):
+            yield (entity_id, choice)
+
+# shows for the venues and artists, the popular ones (low ids) getting most of them; `past_fraction` of them
+# fall in the `days` before now, the rest in the `days` after. a venue or an artist has at most one show a day
+# (shows end by half past midnight, so they never overlap: see the booking constraints in models.py), so once a
+# popular one's days are all taken its further shows go to a random other venue / artist
+def synthetic_shows(args):
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    days = [today - timedelta(days=days) for days in range(1, args.days + 1)] + [today + timedelta(days=days) for days in range(1, args.days + 1)]
+    if args.shows > min(args.venues, args.artists) * len(days):
+        sys.exit('{} shows do not fit in {} days at one show a day per venue and artist'.format(args.shows, len(days)))
+    # one byte per venue / artist and day: 1 once it has a show that day
+    venue_days = bytearray((args.venues + 1) * len(days))
+    artist_days = bytearray((args.artists + 1) * len(days))
+    venue_ids = range(1, args.venues + 1)
+    artist_ids = range(1, args.artists + 1)
+    venue_weights = zipf_weights(args.venues, args.skew)
+    artist_weights = zipf_weights(args.artists, args.skew)
+
+    show_id = 0
+    for batch in batches(range(args.shows), BATCH_SIZE):
+        venues = random.choices(venue_ids, cum_weights=venue_weights, k=len(batch))
+        artists = random.choices(artist_ids, cum_weights=artist_weights, k=len(batch))
+        slots = random.choices(SHOW_SLOTS, k=len(batch))
+        for venue_id, artist_id, slot in zip(venues, artists, slots):
+            show_id += 1
+            tries = 0
+            while True:
+                day = random.randrange(args.days) if random.random() < args.past_fraction else args.days + random.randrange(args.days)
+                if not venue_days[venue_id * len(days) + day] and not artist_days[artist_id * len(days) + day]:
+                    break
+                tries += 1
+                if tries % 8 == 0:
+                    venue_id, artist_id = random.randint(1, args.venues), random.randint(1, args.artists)
+            venue_days[venue_id * len(days) + day] = artist_days[artist_id * len(days) + day] = 1
+            yield (show_id, venue_id, artist_id, days[day] + slot, days[day] + slot + DEFAULT_SHOW_DURATION)
+
+def load_synthetic(args):
+    areas = [('City {}'.format(i), STATES[i % len(STATES)]) for i in range(args.cities)]
+    area_weights = zipf_weights(args.cities, args.skew)
+    entity_columns = ['id', 'name', 'city', 'state', 'phone', 'website']
+
+    bulk_insert(Venue.__table__, entity_columns + ['seeking_talent'], synthetic_entities(args.venues, areas, area_weights, 'venue'))
+    bulk_insert(Artist.__table__, entity_columns + ['seeking_venue'], synthetic_entities(args.artists, areas, area_weights, 'artist'))
+    load_genres()
+    bulk_insert(Venue_Genres, ['venue_id', 'genre_name'], synthetic_genre_links(args.venues, args.max_genres))
+    bulk_insert(Artist_Genres, ['artist_id', 'genre_name'], synthetic_genre_links(args.artists, args.max_genres))
+    # (on a partitioned Show table, postgres only: a month partition for every month of the shows, rather than
+    # piling the past ones up in the default partition)
+    today = datetime.now()
+    create_show_partitions(db.session.connection(), today - timedelta(days=args.days), today + timedelta(days=args.days))
+    bulk_insert(Show.__table__, ['id', 'venue_id', 'artist_id', 'start_time', 'end_time'], synthetic_shows(args))
+
+#----------------------------------------------------------------------------#
+# Launch.
+#----------------------------------------------------------------------------#
+
+PROFILES = {
+    'fixtures': load_fixtures,
+    'synthetic': load_synthetic,
+}
+
+# erases the database and loads a profile into it (needs an app context; also used by ./bin/loadtest.py)
+# loading and indexing a large data set takes far longer than the web app's statement timeout (see config.py)
+def disable_statement_timeout(engine):
+    if engine.dialect.name != 'postgresql':
+        return
 
-populate_table(artist_data, Artist)
-populate_table(venue_data, Venue)
-populate_table(genre_data, Genre)
-populate_table(show_data, Show)
+    @event.listens_for(engine, 'checkout')
+    def no_statement_timeout(dbapi_connection, connection_record, connection_proxy):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('SET statement_timeout = 0')
+        cursor.close()
 
+def populate(profile, args):
+    disable_statement_timeout(db.engine)
+    # clear all data - WARNING: THIS WILL DELETE ALL EXISTING DATA:
+    # USE WITH CAUTION
+    clear_data(db.session)
 
-for entry in artist_genre_data:
-    artist = Artist.query.filter_by(id=entry['artist_id']).one()
-    genre = Genre.query.filter_by(name=entry['genre_name']).one()
-    artist.genres.append(genre)
+    start = time.perf_counter()
+    # the secondary indexes are built once at the end rather than updated row by row
+    connection = db.session.connection()
+    indexes = [index for table in db.metadata.sorted_tables for index in table.indexes]
+    for index in indexes:
+        index.drop(connection)
+    ensure_show_partitions(connection)
 
-print("Finished adding artist genres...")
+    PROFILES[profile](args)
 
-for entry in venue_genre_data:
-    venue = Venue.query.filter_by(id=entry['venue_id']).one()
-    genre = Genre.query.filter_by(name=entry['genre_name']).one()
-    venue.genres.append(genre)
+    index_start = time.perf_counter()
+    for index in indexes:
+        index.create(connection)
+    print("Rebuilt {} indexes in {:.1f}s...".format(len(indexes), time.perf_counter() - index_start))
+    reset_sequences()
+    # the bulk inserts skip the venues' / artists' show counters
+    ShowRollover.recount()
+    db.session.commit()
+    # fresh planner statistics for the new data
+    db.session.execute(db.text('ANALYZE'))
+    db.session.commit()
+    print("Finished populating the database with {} data in {:.1f}s...".format(profile, time.perf_counter() - start))
 
-print("Finished adding venue genres...")
+def add_synthetic_arguments(parser):
+    parser.add_argument('--venues', type=int, default=10000)
+    parser.add_argument('--artists', type=int, default=20000)
+    parser.add_argument('--shows', type=int, default=1000000)
+    parser.add_argument('--cities', type=int, default=500)
+    parser.add_argument('--max-genres', type=int, default=3)
+    parser.add_argument('--past-fraction', type=float, default=0.5)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--skew', type=float, default=1.0, help='popularity skew of areas, venues and artists (0 = uniform)')
+    parser.add_argument('--seed', type=int, default=0)
 
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Erase the database and fill it with fixture or synthetic data.')
+    parser.add_argument('profile', nargs='?', default='fixtures', choices=sorted(PROFILES))
+    add_synthetic_arguments(parser)
+    args = parser.parse_args()
 
-db.session.commit()
+    random.seed(args.seed)
+    with app.app_context():
+        populate(args.profile, args)
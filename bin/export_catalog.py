@@ -0,0 +1,60 @@
+# Exports the venues, artists or shows as CSV or JSONL (see exports.py)
+# usage: python ./bin/export_catalog.py {venues,artists,shows} [FILE] [--format {csv,jsonl}] [--gzip]
+#                                       [--updated-since 2026-10-01T00:00:00]
+#
+# Writes to FILE (stdout without one, or with '-'), a chunk of rows at a time, so the size of the table doesn't
+# matter. The format defaults to the file's extension (venues.csv, venues.jsonl.gz, ...), and a .gz file is
+# gzipped. --updated-since only exports the rows created or changed since then; the time to pass next time is
+# printed to stderr when the export is done. The output imports back with ./bin/import_catalog.py.
+#
+# Runs against the database given in DATABASE_URL (or config.py's default).
+
+import sys
+import os
+import argparse
+import time
+from datetime import datetime
+
+PACKAGE_PARENT = '..'
+SCRIPT_DIR = os.path.dirname(os.path.realpath(os.path.join(os.getcwd(), os.path.expanduser(__file__))))
+sys.path.append(os.path.normpath(os.path.join(SCRIPT_DIR, PACKAGE_PARENT)))
+
+from app import app, db
+from exports import EXPORT_FORMATS, EXPORTS, export
+
+
+def export_file(kind, path, export_format, updated_since, compress):
+    output = sys.stdout.buffer if path == '-' else open(path, 'wb')
+    size = 0
+    try:
+        for chunk in export(kind, export_format, updated_since, compress):
+            output.write(chunk)
+            size += len(chunk)
+    finally:
+        if output is not sys.stdout.buffer:
+            output.close()
+        else:
+            output.flush()
+    return size
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export the venues, artists or shows as CSV or JSONL.')
+    parser.add_argument('kind', choices=sorted(EXPORTS))
+    parser.add_argument('file', nargs='?', default='-', help="the file to write ('-' or none for stdout)")
+    parser.add_argument('--format', choices=EXPORT_FORMATS, help="the output's format (by default, the file's extension)")
+    parser.add_argument('--gzip', action='store_true', help='gzip the output (the default for .gz files)')
+    parser.add_argument('--updated-since', type=datetime.fromisoformat, help='only the rows created or changed since then (ISO 8601)')
+    args = parser.parse_args()
+
+    name = args.file[:-3] if args.file.endswith('.gz') else args.file
+    export_format = args.format or os.path.splitext(name)[1].lstrip('.').lower()
+    if export_format not in EXPORT_FORMATS:
+        parser.error('cannot tell the format of {} - pass --format'.format(args.file))
+
+    start = time.perf_counter()
+    export_time = datetime.now()
+    with app.app_context():
+        size = export_file(args.kind, args.file, export_format, args.updated_since, args.gzip or args.file.endswith('.gz'))
+    print("exported {} ({:.1f} MB) in {:.1f}s; pass --updated-since {} next time for the changes since".format(
+        args.kind, size / 1e6, time.perf_counter() - start, export_time.isoformat(timespec='seconds')), file=sys.stderr)
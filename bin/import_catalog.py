@@ -0,0 +1,59 @@
+# Imports venues, artists or shows from a CSV or JSONL file (see imports.py)
+# usage: python ./bin/import_catalog.py {venues,artists,shows} FILE [--format {csv,jsonl}] [--batch-size 5000]
+#
+# FILE is read a line at a time ('-' for stdin), so its size doesn't matter. The format defaults to the file's
+# extension. CSV files have a header row with the fields of the kind's form in forms.py (genres separated by ;),
+# JSONL files one object per line with the same keys (genres as a list). Shows take a venue_id, an artist_id, a
+# start_time and a duration in minutes.
+# Prints the rejected rows with their errors and exits non-zero if there were any.
+#
+# Runs against the database given in DATABASE_URL (or config.py's default). The running app servers' page caches
+# and in-memory indexes don't see the import until they expire - use POST /import/<kind> to import into a live site.
+
+import sys
+import os
+import argparse
+import time
+
+PACKAGE_PARENT = '..'
+SCRIPT_DIR = os.path.dirname(os.path.realpath(os.path.join(os.getcwd(), os.path.expanduser(__file__))))
+sys.path.append(os.path.normpath(os.path.join(SCRIPT_DIR, PACKAGE_PARENT)))
+
+from app import app, db
+from imports import IMPORT_BATCH_SIZE, IMPORT_FORMATS, IMPORT_FORMS, import_rows, read_rows
+
+
+def import_file(kind, path, import_format, batch_size):
+    stream = sys.stdin.buffer if path == '-' else open(path, 'rb')
+    try:
+        return import_rows(kind, read_rows(stream, import_format), batch_size=batch_size)
+    finally:
+        stream.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Import venues, artists or shows from a CSV or JSONL file.')
+    parser.add_argument('kind', choices=sorted(IMPORT_FORMS))
+    parser.add_argument('file', help="the file to import ('-' for stdin)")
+    parser.add_argument('--format', choices=IMPORT_FORMATS, help="the file's format (by default, its extension)")
+    parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE, help='rows per transaction')
+    args = parser.parse_args()
+
+    import_format = args.format or os.path.splitext(args.file)[1].lstrip('.').lower()
+    if import_format not in IMPORT_FORMATS:
+        parser.error('cannot tell the format of {} - pass --format'.format(args.file))
+
+    start = time.perf_counter()
+    with app.app_context():
+        result = import_file(args.kind, args.file, import_format, args.batch_size)
+    elapsed = time.perf_counter() - start
+
+    for row_error in result.errors:
+        print("line {}: {}".format(row_error.line, '; '.join(
+            '{}: {}'.format(field, ' '.join(messages)) for field, messages in sorted(row_error.errors.items()))))
+    if result.failed > len(result.errors):
+        print("... and {} more rejected rows".format(result.failed - len(result.errors)))
+    print("{} {} imported, {} rejected in {:.1f}s ({:.0f} rows/s)".format(
+        result.imported, args.kind, result.failed, elapsed, (result.imported + result.failed) / max(elapsed, 1e-9)))
+    if result.failed:
+        sys.exit(1)
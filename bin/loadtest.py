@@ -0,0 +1,470 @@
+# Load test for every route in app.py
+# usage: python ./bin/loadtest.py [--scale {1k,100k,1m}] [--requests 50] [--concurrency 8] [--duration 10]
+#                                 [--output results.json] [--compare previous.json] [--skip-seed] [--seed 0]
+#                                 [--workers 1,4,16]
+#
+# Seeds a database at the given scale (1k / 100k / 1m shows, with ./bin/configure_db.py's synthetic profile), then
+#  1. sends --requests requests to every route through the flask test client, one at a time, recording the
+#     latency and the number of queries of each
+#  2. serves the app from a threaded http server and has --concurrency clients hit the GET routes for
+#     --duration seconds
+# and reports p50/p95/p99 latency, queries per request and peak RSS. --output saves the results as JSON, and
+# --compare prints the changes against an earlier run's JSON (e.g. one saved on the previous commit).
+# --workers 1,4,16 repeats step 2 against gunicorn (gunicorn.conf.py, wsgi.py) with each number of workers.
+# Exits non-zero if a route has no load test scenario, any request fails, any request runs more queries than
+# its route's QUERY_BUDGETS entry in config.py or the show counters end up off (bin/check_show_counters.py). The slow query / slow request records of the run (see
+# instrumentation.py) are written to --perf-log.
+#
+# Runs against the database given in DATABASE_URL, defaulting to a throwaway sqlite file
+# WARNING: THE LOAD TEST DATABASE IS DROPPED AND RE-SEEDED ON EVERY RUN (UNLESS --skip-seed) - DO NOT POINT IT AT REAL DATA
+
+import sys
+import os
+import argparse
+import itertools
+import json
+import logging
+import random
+import resource
+import secrets
+import socket
+import subprocess
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+
+PACKAGE_PARENT = '..'
+SCRIPT_DIR = os.path.dirname(os.path.realpath(os.path.join(os.getcwd(), os.path.expanduser(__file__))))
+sys.path.append(os.path.normpath(os.path.join(SCRIPT_DIR, PACKAGE_PARENT)))
+
+os.environ.setdefault('DATABASE_URL', 'sqlite:////tmp/fyyur-loadtest.db')
+# every relationship a route touches must come from its loader options (see LOADER_OPTIONS in models.py)
+os.environ.setdefault('LAZY_LOAD_POLICY', 'raise')
+
+from sqlalchemy import event
+from werkzeug.serving import make_server
+
+from app import app, db
+from instrumentation import perf_logger, sql_instrumentation
+from models import *
+from benchmark import QueryCounter, percentile
+from check_show_counters import check_show_counters
+from configure_db import WORDS, populate
+
+SCALES = {
+    '1k': { 'venues': 100, 'artists': 200, 'shows': 1000, 'cities': 20 },
+    '100k': { 'venues': 5000, 'artists': 10000, 'shows': 100000, 'cities': 200 },
+    '1m': { 'venues': 10000, 'artists': 20000, 'shows': 1000000, 'cities': 500 },
+}
+
+OK_STATUSES = (200, 302, 304)
+
+
+def seed(scale):
+    db.drop_all()
+    db.create_all()
+    populate('synthetic', argparse.Namespace(max_genres=3, past_fraction=0.5, days=365, skew=1.0, **SCALES[scale]))
+
+
+def peak_rss_kib():
+    # ru_maxrss is in KiB on linux but in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=SCRIPT_DIR, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+#----------------------------------------------------------------------------#
+# Scenarios.
+#----------------------------------------------------------------------------#
+
+# one per endpoint in app.py: (method, fn) where fn(state) returns the (url, form data[, headers]) of one request, doing any
+# setup the request needs (e.g. a venue to delete) beforehand so it isn't timed
+
+def venue_form(state):
+    n = next(state['serial'])
+    return {
+        'name': 'Load Test Venue {}'.format(n), 'city': 'City 1', 'state': 'CA', 'address': '1 Main St', 'phone': '415-555-0100',
+        'genres': ['Jazz', 'Folk'], 'website': 'https://venue-{}.loadtest.example.com'.format(n),
+        'facebook_link': 'https://www.facebook.com/loadtest-venue-{}'.format(n)
+    }
+
+def artist_form(state):
+    n = next(state['serial'])
+    return {
+        'name': 'Load Test Artist {}'.format(n), 'city': 'City 1', 'state': 'CA', 'phone': '415-555-0100',
+        'genres': ['Jazz'], 'website': 'https://artist-{}.loadtest.example.com'.format(n),
+        'facebook_link': 'https://www.facebook.com/loadtest-artist-{}'.format(n)
+    }
+
+def show_form(state):
+    start_time = datetime.now().replace(microsecond=0) + timedelta(days=random.randint(1, 365))
+    return { 'venue_id': str(random_venue(state)), 'artist_id': str(random_artist(state)), 'start_time': str(start_time), 'duration': '120' }
+
+# a small CSV body for the bulk import, with the columns of venue_form
+def venue_import(state, rows=10):
+    lines = ['name,city,state,address,phone,genres,website,facebook_link']
+    for _ in range(rows):
+        venue = venue_form(state)
+        lines.append(','.join([venue['name'], venue['city'], venue['state'], venue['address'], venue['phone'],
+            ';'.join(venue['genres']), venue['website'], venue['facebook_link']]))
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+def random_venue(state):
+    return random.randint(1, state['venues'])
+
+def random_artist(state):
+    return random.randint(1, state['artists'])
+
+# a fresh venue (without shows) for every delete
+def venue_to_delete(state):
+    with app.app_context():
+        venue = Venue(name='Load Test Venue (deleted)', city='City 1', state='CA')
+        db.session.add(venue)
+        db.session.commit()
+        return '/venues/{}'.format(venue.id), None
+
+SCENARIOS = {
+    'index': ('GET', lambda state: ('/', None)),
+    'venues': ('GET', lambda state: ('/venues', None)),
+    'search_venues': ('POST', lambda state: ('/venues/search', { 'search_term': random.choice(WORDS) })),
+    'show_venue': ('GET', lambda state: ('/venues/{}'.format(random_venue(state)), None)),
+    'create_venue_form': ('GET', lambda state: ('/venues/create', None)),
+    'create_venue_submission': ('POST', lambda state: ('/venues/create', venue_form(state))),
+    'venue_calendar': ('GET', lambda state: ('/venues/{}/calendar'.format(random_venue(state)), None)),
+    'delete_venue': ('DELETE', venue_to_delete),
+    'edit_venue': ('GET', lambda state: ('/venues/{}/edit'.format(random_venue(state)), None)),
+    'edit_venue_submission': ('POST', lambda state: ('/venues/{}/edit'.format(random_venue(state)), venue_form(state))),
+    'artists': ('GET', lambda state: ('/artists', None)),
+    'search_artists': ('POST', lambda state: ('/artists/search', { 'search_term': random.choice(WORDS) })),
+    'show_artist': ('GET', lambda state: ('/artists/{}'.format(random_artist(state)), None)),
+    'edit_artist': ('GET', lambda state: ('/artists/{}/edit'.format(random_artist(state)), None)),
+    'edit_artist_submission': ('POST', lambda state: ('/artists/{}/edit'.format(random_artist(state)), artist_form(state))),
+    'create_artist_form': ('GET', lambda state: ('/artists/create', None)),
+    'create_artist_submission': ('POST', lambda state: ('/artists/create', artist_form(state))),
+    'autocomplete': ('GET', lambda state: ('/api/autocomplete?' + urlencode({ 'q': random.choice(WORDS)[:random.randint(1, 4)] }), None)),
+    'shows': ('GET', lambda state: ('/shows', None)),
+    'create_shows': ('GET', lambda state: ('/shows/create', None)),
+    'create_show_submission': ('POST', lambda state: ('/shows/create', show_form(state))),
+    'bulk_import': ('POST', lambda state: ('/import/venues?format=csv', venue_import(state),
+        { 'Authorization': 'Bearer ' + app.config['IMPORT_TOKEN'] })),
+    # the venues created / edited since the run started (an incremental export)
+    'bulk_export': ('GET', lambda state: ('/export/venues.csv?' + urlencode({ 'updated_since': state['started'].isoformat() }), None)),
+    'api.venues': ('GET', lambda state: ('/api/v1/venues', None)),
+    'api.search_venues': ('GET', lambda state: ('/api/v1/venues/search?' + urlencode({ 'q': random.choice(WORDS) }), None)),
+    'api.show_venue': ('GET', lambda state: ('/api/v1/venues/{}'.format(random_venue(state)), None)),
+    'api.venue_shows': ('GET', lambda state: ('/api/v1/venues/{}/shows'.format(random_venue(state)), None)),
+    'api.artists': ('GET', lambda state: ('/api/v1/artists', None)),
+    'api.search_artists': ('GET', lambda state: ('/api/v1/artists/search?' + urlencode({ 'q': random.choice(WORDS) }), None)),
+    'api.show_artist': ('GET', lambda state: ('/api/v1/artists/{}'.format(random_artist(state)), None)),
+    'api.artist_shows': ('GET', lambda state: ('/api/v1/artists/{}/shows'.format(random_artist(state)), None)),
+    'api.shows': ('GET', lambda state: ('/api/v1/shows?when=upcoming', None)),
+}
+
+#----------------------------------------------------------------------------#
+# Runs.
+#----------------------------------------------------------------------------#
+
+def latency_stats(timings):
+    timings = sorted(timings)
+    return {
+        'p50_ms': round(percentile(timings, 50) * 1000, 3),
+        'p95_ms': round(percentile(timings, 95) * 1000, 3),
+        'p99_ms': round(percentile(timings, 99) * 1000, 3),
+    }
+
+
+# every route through the test client, one request at a time (a fresh client for each, so no flash
+# messages or cookies carry over between requests)
+def run_routes(state, engine, requests):
+    results = {}
+    for endpoint in sorted(SCENARIOS):
+        method, scenario = SCENARIOS[endpoint]
+        timings, queries, statuses = [], [], defaultdict(int)
+        for _ in range(requests):
+            url, data, *headers = scenario(state)
+            client = app.test_client()
+            with QueryCounter(engine) as counter:
+                start = time.perf_counter()
+                response = client.open(url, method=method, data=data, headers=headers[0] if headers else None)
+                # (a streamed response, like the exports', only runs as its body is read)
+                response.get_data()
+                timings.append(time.perf_counter() - start)
+            response.close()
+            queries.append(counter.count)
+            statuses[response.status_code] += 1
+
+        budget = sql_instrumentation.budget(endpoint)
+
+        results[endpoint] = dict(latency_stats(timings),
+            method=method,
+            requests=requests,
+            errors=sum(count for status, count in statuses.items() if status not in OK_STATUSES),
+            statuses={ str(status): count for status, count in sorted(statuses.items()) },
+            queries_per_request=round(sum(queries) / float(requests), 2),
+            max_queries=max(queries),
+            query_budget=budget,
+            over_budget=sum(1 for count in queries if budget is not None and count > budget)
+        )
+    return results
+
+
+# the GET routes over http from `concurrency` threads for `duration` seconds, against a threaded server in this
+# process or (with `base_url`) an already running one, whose queries can't be counted from here
+def run_http(state, engine, concurrency, duration, base_url=None):
+    server = None
+    if base_url is None:
+        # no access log line per request
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        server = make_server('127.0.0.1', 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = 'http://127.0.0.1:{}'.format(server.server_port)
+    endpoints = sorted(endpoint for endpoint, (method, _) in SCENARIOS.items() if method == 'GET')
+
+    lock = threading.Lock()
+    samples = defaultdict(list)
+    query_count = [0]
+
+    def count_query(*args):
+        with lock:
+            query_count[0] += 1
+
+    def client():
+        while time.perf_counter() < deadline:
+            endpoint = random.choice(endpoints)
+            url, _ = SCENARIOS[endpoint][1](state)
+            start = time.perf_counter()
+            try:
+                with urlopen(Request(base_url + url)) as response:
+                    response.read()
+                    status = response.status
+            except HTTPError as error:
+                status = error.code
+            except OSError:
+                status = None
+            with lock:
+                samples[endpoint].append((time.perf_counter() - start, status))
+
+    event.listen(engine, 'before_cursor_execute', count_query)
+    deadline = time.perf_counter() + duration
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    event.remove(engine, 'before_cursor_execute', count_query)
+    if server is not None:
+        server.shutdown()
+
+    total = sum(len(endpoint_samples) for endpoint_samples in samples.values())
+    return dict(latency_stats([elapsed for endpoint_samples in samples.values() for elapsed, _ in endpoint_samples] or [0]), **{
+        'concurrency': concurrency,
+        'duration_s': duration,
+        'requests': total,
+        'errors': sum(1 for endpoint_samples in samples.values() for _, status in endpoint_samples if status not in OK_STATUSES),
+        'throughput_rps': round(total / float(duration), 1),
+        'queries_per_request': round(query_count[0] / float(max(total, 1)), 2) if server is not None else None,
+        'routes': {
+            endpoint: dict(latency_stats([elapsed for elapsed, _ in endpoint_samples]), requests=len(endpoint_samples))
+            for endpoint, endpoint_samples in sorted(samples.items())
+        }
+    })
+
+
+# starts gunicorn with the production settings (gunicorn.conf.py) and `workers` worker processes on a free port,
+# returning the process and its url once it answers
+def start_gunicorn(workers):
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    env = dict(os.environ, WEB_CONCURRENCY=str(workers), GUNICORN_ACCESS_LOG='/dev/null')
+    process = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--bind', '127.0.0.1:{}'.format(port), 'wsgi:app'],
+        cwd=os.path.normpath(os.path.join(SCRIPT_DIR, PACKAGE_PARENT)), env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = 'http://127.0.0.1:{}'.format(port)
+    deadline = time.perf_counter() + 60
+    while time.perf_counter() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('gunicorn exited with status {} (is it installed?)'.format(process.returncode))
+        try:
+            with urlopen(base_url + '/') as response:
+                response.read()
+            return process, base_url
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError('gunicorn did not start answering within 60s')
+
+
+# the http run against gunicorn with each number of workers in turn
+def run_workers(state, engine, workers, concurrency, duration):
+    results = {}
+    for count in workers:
+        process, base_url = start_gunicorn(count)
+        try:
+            results[str(count)] = run_http(state, engine, concurrency, duration, base_url=base_url)
+        finally:
+            process.terminate()
+            process.wait(timeout=60)
+    return results
+
+#----------------------------------------------------------------------------#
+# Reports.
+#----------------------------------------------------------------------------#
+
+def print_routes(results):
+    print("{:<26} {:<6} {:>9} {:>9} {:>9} {:>8} {:>7} {:>7}".format('route', 'method', 'p50 ms', 'p95 ms', 'p99 ms', 'queries', 'budget', 'errors'))
+    for endpoint, result in results.items():
+        print("{:<26} {:<6} {:>9.2f} {:>9.2f} {:>9.2f} {:>8.1f} {:>7} {:>7}".format(
+            endpoint, result['method'], result['p50_ms'], result['p95_ms'], result['p99_ms'], result['queries_per_request'],
+            '-' if result['query_budget'] is None else result['query_budget'], result['errors']))
+
+
+def print_http(results):
+    print("{} clients for {}s: {} requests ({} rps), {} errors, {} queries per request".format(
+        results['concurrency'], results['duration_s'], results['requests'], results['throughput_rps'], results['errors'], results['queries_per_request']))
+    print("{:<26} {:>9} {:>9} {:>9} {:>9}".format('route', 'requests', 'p50 ms', 'p95 ms', 'p99 ms'))
+    for endpoint, result in results['routes'].items():
+        print("{:<26} {:>9} {:>9.2f} {:>9.2f} {:>9.2f}".format(endpoint, result['requests'], result['p50_ms'], result['p95_ms'], result['p99_ms']))
+
+
+def print_workers(results):
+    print("gunicorn ({} worker class):".format(os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')))
+    print("{:<8} {:>9} {:>9} {:>9} {:>9} {:>7}".format('workers', 'rps', 'p50 ms', 'p95 ms', 'p99 ms', 'errors'))
+    for count, result in results.items():
+        print("{:<8} {:>9} {:>9.2f} {:>9.2f} {:>9.2f} {:>7}".format(count, result['throughput_rps'], result['p50_ms'], result['p95_ms'], result['p99_ms'], result['errors']))
+
+
+def change(old, new):
+    if not old:
+        return ''
+    return '{:+.0f}%'.format((new - old) * 100.0 / old)
+
+
+def print_comparison(previous, results):
+    print("compared to {} ({}, scale {}):".format(previous.get('commit'), previous.get('timestamp'), previous.get('scale')))
+    print("{:<26} {:>20} {:>20} {:>16}".format('route', 'p50 ms', 'p99 ms', 'queries'))
+    for endpoint, result in results['routes'].items():
+        old = previous.get('routes', {}).get(endpoint)
+        if old is None:
+            print("{:<26} (new)".format(endpoint))
+            continue
+        print("{:<26} {:>20} {:>20} {:>16}".format(endpoint,
+            '{:.2f} -> {:.2f} {}'.format(old['p50_ms'], result['p50_ms'], change(old['p50_ms'], result['p50_ms'])),
+            '{:.2f} -> {:.2f} {}'.format(old['p99_ms'], result['p99_ms'], change(old['p99_ms'], result['p99_ms'])),
+            '{:.1f} -> {:.1f}'.format(old['queries_per_request'], result['queries_per_request'])))
+    if 'http' in previous and 'http' in results:
+        print("http throughput: {} -> {} rps {}".format(previous['http']['throughput_rps'], results['http']['throughput_rps'],
+            change(previous['http']['throughput_rps'], results['http']['throughput_rps'])))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load test every fyyur route against a freshly seeded database.')
+    parser.add_argument('--scale', choices=sorted(SCALES), default='1k')
+    parser.add_argument('--requests', type=int, default=50, help='requests per route through the test client')
+    parser.add_argument('--concurrency', type=int, default=8, help='http clients (0 skips the http run)')
+    parser.add_argument('--duration', type=float, default=10, help='seconds of http load')
+    parser.add_argument('--output', help='save the results to this JSON file')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare against')
+    parser.add_argument('--skip-seed', action='store_true', help='reuse the database left by the previous run')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=lambda value: [int(count) for count in value.split(',')], default=[],
+        help='comma separated gunicorn worker counts to repeat the http run with, e.g. 1,4,16')
+    parser.add_argument('--perf-log', default='/tmp/fyyur-loadtest-perf.log', help='file for the slow query / slow request records')
+    args = parser.parse_args()
+
+    endpoints = set(rule.endpoint for rule in app.url_map.iter_rules() if rule.endpoint != 'static')
+    missing = sorted(endpoints - set(SCENARIOS))
+    if missing:
+        print("No load test scenario for: {}".format(', '.join(missing)))
+        sys.exit(1)
+
+    # the form posts come from the load generator, not from a rendered form with a token
+    app.config['WTF_CSRF_ENABLED'] = False
+    # the bulk import only exists with a token
+    app.config['IMPORT_TOKEN'] = app.config['IMPORT_TOKEN'] or secrets.token_hex(16)
+    perf_logger.propagate = False
+    perf_logger.addHandler(logging.FileHandler(args.perf_log, mode='w'))
+
+    random.seed(args.seed)
+    with app.app_context():
+        if not args.skip_seed:
+            seed(args.scale)
+        engine = db.engine
+        state = {
+            'venues': db.session.query(db.func.max(Venue.id)).scalar() or 0,
+            'artists': db.session.query(db.func.max(Artist.id)).scalar() or 0,
+            'shows': db.session.query(db.func.count(Show.id)).scalar(),
+            'started': datetime.now(),
+            # websites must be unique, also against the rows an earlier run (--skip-seed) left behind
+            'serial': itertools.count(int(time.time() * 1000)),
+        }
+        # venues created by an earlier run (or by the delete scenario) may be gone, the seeded ones never are
+        state['venues'] = min(state['venues'], SCALES[args.scale]['venues'])
+        state['artists'] = min(state['artists'], SCALES[args.scale]['artists'])
+        db.session.remove()
+
+    results = {
+        'commit': git_commit(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'database': engine.dialect.name,
+        'scale': args.scale,
+        'rows': { 'venues': state['venues'], 'artists': state['artists'], 'shows': state['shows'] },
+        'cache_backend': app.config.get('RESPONSE_CACHE_BACKEND'),
+        'peak_rss_kib': { 'seeded': peak_rss_kib() },
+    }
+    print("{} database, {} venues, {} artists, {} shows".format(results['database'], state['venues'], state['artists'], state['shows']))
+
+    results['routes'] = run_routes(state, engine, args.requests)
+    results['peak_rss_kib']['routes'] = peak_rss_kib()
+    print_routes(results['routes'])
+
+    if args.concurrency > 0:
+        results['http'] = run_http(state, engine, args.concurrency, args.duration)
+        results['peak_rss_kib']['http'] = peak_rss_kib()
+        print_http(results['http'])
+
+    if args.concurrency > 0 and args.workers:
+        results['gunicorn'] = run_workers(state, engine, args.workers, args.concurrency, args.duration)
+        print_workers(results['gunicorn'])
+
+    print("peak RSS: {}".format(', '.join('{} {:.0f} MiB'.format(phase, kib / 1024.0) for phase, kib in results['peak_rss_kib'].items())))
+
+    if args.compare:
+        with open(args.compare) as previous:
+            print_comparison(json.load(previous), results)
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+        print("Saved results to {}".format(args.output))
+
+    # the runs created shows and venues: the materialized show counters must still match
+    with app.app_context():
+        counters_off = len(check_show_counters())
+
+    # (a lazy load fails its request, unless the route swallows the exception)
+    with open(args.perf_log) as perf_log:
+        lazy_loads = sum(1 for line in perf_log if json.loads(line)['event'] == 'lazy_load')
+
+    errors = sum(result['errors'] for result in results['routes'].values()) + results.get('http', {}).get('errors', 0) + \
+        sum(result['errors'] for result in results.get('gunicorn', {}).values())
+    if errors:
+        print("{} requests failed".format(errors))
+    over_budget = { endpoint: result for endpoint, result in results['routes'].items() if result['over_budget'] }
+    for endpoint, result in over_budget.items():
+        print("{}: {} of {} requests over the budget of {} queries (max {}), see {}".format(
+            endpoint, result['over_budget'], result['requests'], result['query_budget'], result['max_queries'], args.perf_log))
+    if counters_off:
+        print("{} venue/artist show counters are off".format(counters_off))
+    if lazy_loads:
+        print("{} unexpected lazy loads, see {}".format(lazy_loads, args.perf_log))
+    if errors or over_budget or counters_off or lazy_loads:
+        sys.exit(1)
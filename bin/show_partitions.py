@@ -0,0 +1,32 @@
+# Script to create the month partitions of the Show table up to PARTITION_MONTHS_AHEAD months from now (see
+# partitions.py). runs in the release phase of every deploy (see the Procfile) and should also run daily, e.g. from
+# a scheduler. does nothing on a database without a partitioned Show table (sqlite, or before the migration)
+# usage: python ./bin/show_partitions.py [--months-ahead 12]
+
+import sys
+import os
+import argparse
+
+PACKAGE_PARENT = '..'
+SCRIPT_DIR = os.path.dirname(os.path.realpath(os.path.join(os.getcwd(), os.path.expanduser(__file__))))
+sys.path.append(os.path.normpath(os.path.join(SCRIPT_DIR, PACKAGE_PARENT)))
+
+from app import app, db
+from partitions import PARTITION_MONTHS_AHEAD, ensure_show_partitions, is_partitioned
+
+def main():
+    parser = argparse.ArgumentParser(description='Create the upcoming month partitions of the Show table.')
+    parser.add_argument('--months-ahead', type=int, default=PARTITION_MONTHS_AHEAD)
+    args = parser.parse_args()
+
+    with app.app_context():
+        connection = db.session.connection()
+        if not is_partitioned(connection):
+            print('Show is not partitioned here, nothing to do.')
+            return
+        created = ensure_show_partitions(connection, months_ahead=args.months_ahead)
+        db.session.commit()
+        print('Created {} Show partitions{}'.format(len(created), ': ' + ', '.join(created) if created else '.'))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,267 @@
+import functools
+import pickle
+import time
+
+from collections import OrderedDict
+from datetime import datetime
+from threading import Lock
+
+from flask import g, make_response, request, session
+from werkzeug.http import is_resource_modified
+
+#------------------------------------------------------------------------------------------
+# Response cache
+#-------------------------------------------------------------------------------------------
+
+# caches rendered GET pages by url. every cached page carries a set of tags (e.g. 'venue:3', 'area:CA:San Francisco',
+# 'shows') along with the version each tag had when the page was rendered; writes bump the versions of the tags
+# they affect (response_cache.invalidate(...)), which makes every page carrying those tags stale at once.
+# pages that depend on the upcoming/past boundary also get an expiry time (cache_until) so they are re-rendered
+# once their next show starts.
+#
+# backends: 'local' (in-process LRU, per worker), 'redis' (shared between workers/servers, needs the redis package)
+# or 'none'. with the local backend a write only evicts pages in the worker that handled it, other workers keep
+# serving their copy until RESPONSE_CACHE_TTL runs out
+
+
+class LocalBackend:
+
+  def __init__(self, max_entries=1000, max_bytes=64 * 1024 * 1024):
+    self.max_entries = max_entries
+    self.max_bytes = max_bytes
+    self.entries = OrderedDict()
+    self.size = 0
+    self.versions = {}
+    self.lock = Lock()
+
+  def get(self, key):
+    with self.lock:
+      entry = self.entries.get(key)
+      if entry is None:
+        return None
+      value, size, expires_at = entry
+      if expires_at <= time.time():
+        self._delete(key)
+        return None
+      self.entries.move_to_end(key)
+      return value
+
+  def set(self, key, value, ttl, size=0):
+    with self.lock:
+      self._delete(key)
+      self.entries[key] = (value, size, time.time() + ttl)
+      self.size += size
+      while self.entries and (len(self.entries) > self.max_entries or self.size > self.max_bytes):
+        self._delete(next(iter(self.entries)))
+
+  def delete(self, key):
+    with self.lock:
+      self._delete(key)
+
+  def _delete(self, key):
+    entry = self.entries.pop(key, None)
+    if entry is not None:
+      self.size -= entry[1]
+
+  def clear(self):
+    with self.lock:
+      self.entries.clear()
+      self.size = 0
+
+  def tag_versions(self, tags):
+    return [self.versions.get(tag, 0) for tag in tags]
+
+  def bump_tags(self, tags):
+    with self.lock:
+      for tag in tags:
+        self.versions[tag] = self.versions.get(tag, 0) + 1
+
+
+class RedisBackend:
+
+  prefix = 'fyyur:page:'
+  tag_prefix = 'fyyur:tag:'
+
+  def __init__(self, url):
+    try:
+      import redis
+    except ImportError:
+      raise RuntimeError("RESPONSE_CACHE_BACKEND = 'redis' needs the redis package (pip install redis)")
+    self.client = redis.Redis.from_url(url)
+
+  def get(self, key):
+    value = self.client.get(self.prefix + key)
+    return pickle.loads(value) if value is not None else None
+
+  def set(self, key, value, ttl, size=0):
+    self.client.set(self.prefix + key, pickle.dumps(value), ex=max(1, int(ttl)))
+
+  def delete(self, key):
+    self.client.delete(self.prefix + key)
+
+  def clear(self):
+    for key in self.client.scan_iter(self.prefix + '*'):
+      self.client.delete(key)
+
+  def tag_versions(self, tags):
+    if not tags:
+      return []
+    return [int(version or 0) for version in self.client.mget([self.tag_prefix + tag for tag in tags])]
+
+  def bump_tags(self, tags):
+    pipeline = self.client.pipeline()
+    for tag in tags:
+      pipeline.incr(self.tag_prefix + tag)
+    pipeline.execute()
+
+
+class ResponseCache:
+
+  def __init__(self, app=None):
+    self.backend = None
+    self.ttl = 300
+    if app is not None:
+      self.init_app(app)
+
+  def init_app(self, app):
+    name = app.config.get('RESPONSE_CACHE_BACKEND', 'local')
+    self.ttl = app.config.get('RESPONSE_CACHE_TTL', 300)
+    if name == 'local':
+      self.backend = LocalBackend(
+        max_entries=app.config.get('RESPONSE_CACHE_MAX_ENTRIES', 1000),
+        max_bytes=app.config.get('RESPONSE_CACHE_MAX_BYTES', 64 * 1024 * 1024)
+      )
+    elif name == 'redis':
+      self.backend = RedisBackend(app.config['RESPONSE_CACHE_URL'])
+    elif name == 'none':
+      self.backend = None
+    else:
+      raise ValueError('Unknown RESPONSE_CACHE_BACKEND: {}'.format(name))
+
+  def get(self, key):
+    if self.backend is None:
+      return None
+    entry = self.backend.get(key)
+    if entry is None:
+      return None
+
+    body, status, headers, tags, versions = entry
+    if self.backend.tag_versions(tags) != versions:
+      return None
+    return make_response(body, status, headers)
+
+  def tag_versions(self, tags):
+    return dict(zip(tags, self.backend.tag_versions(tags))) if self.backend is not None else {}
+
+  # `versions` are the tag versions read *before* the page's data was queried, so a write that lands while
+  # the page renders leaves it stale rather than cached under the newer versions
+  def set(self, key, response, versions, expires_at=None):
+    if self.backend is None:
+      return
+
+    ttl = self.ttl
+    if expires_at is not None:
+      ttl = min(ttl, (expires_at - datetime.now()).total_seconds())
+    if ttl < 1:
+      return
+
+    tags = sorted(versions)
+    body = response.get_data()
+    headers = [(name, value) for name, value in response.headers if name.lower() not in ('content-length', 'set-cookie')]
+    entry = (body, response.status_code, headers, tags, [versions[tag] for tag in tags])
+    self.backend.set(key, entry, ttl, size=len(body))
+
+  def invalidate(self, *tags):
+    if self.backend is not None and tags:
+      self.backend.bump_tags(tags)
+
+  def clear(self):
+    if self.backend is not None:
+      self.backend.clear()
+
+  # decorator for GET views; `tags` is called with the view's arguments and returns the page's base tags,
+  # the view can add more with cache_tag() / set an expiry with cache_until() while it renders
+  def cached(self, tags=lambda **kwargs: ()):
+    def decorator(view):
+      @functools.wraps(view)
+      def wrapper(**kwargs):
+        # pages rendered while a flash message is pending would show (or swallow) that message for everyone
+        if self.backend is None or request.method != 'GET' or '_flashes' in session:
+          return view(**kwargs)
+
+        # pages behind conditional() are also keyed by their current etag, so a write made through another
+        # worker (which can't evict this worker's local copy) still shows up here right away
+        key = request.full_path
+        if 'page_etag' in g:
+          key += '#' + g.page_etag
+        response = self.get(key)
+        if response is not None:
+          return response
+
+        g.cache_versions = self.tag_versions(list(tags(**kwargs)))
+        g.cache_expires_at = None
+        response = make_response(view(**kwargs))
+        if response.status_code == 200 and '_flashes' not in session:
+          self.set(key, response, g.cache_versions, g.cache_expires_at)
+        return response
+      return wrapper
+    return decorator
+
+
+response_cache = ResponseCache()
+
+
+# called from inside a cached view: add tags to the page being rendered (as soon as they are known,
+# i.e. right after the query that reveals them)
+def cache_tag(*tags):
+  if 'cache_versions' in g:
+    new_tags = [tag for tag in tags if tag not in g.cache_versions]
+    g.cache_versions.update(response_cache.tag_versions(new_tags))
+
+# called from inside a cached view: the page must be re-rendered by `when` (None = no limit)
+def cache_until(when):
+  if when is not None and 'cache_expires_at' in g:
+    g.cache_expires_at = when if g.cache_expires_at is None else min(g.cache_expires_at, when)
+
+
+#------------------------------------------------------------------------------------------
+# Conditional GET
+#-------------------------------------------------------------------------------------------
+
+# decorator for GET views (goes above response_cache.cached); `validators` is called with the view's arguments
+# and returns (etag, last_modified) from a cheap version lookup, or None to just run the view (e.g. unknown id).
+# requests whose If-None-Match / If-Modified-Since still match get an empty 304 without running the view.
+# last_modified may be None for pages that can change without any row's timestamp moving (e.g. a deletion)
+def conditional(validators):
+  def decorator(view):
+    @functools.wraps(view)
+    def wrapper(**kwargs):
+      if request.method != 'GET' or '_flashes' in session:
+        return view(**kwargs)
+
+      page_validators = validators(**kwargs)
+      if page_validators is None:
+        return view(**kwargs)
+
+      etag, last_modified = page_validators
+      if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = make_response('', 304)
+      else:
+        g.page_etag = etag
+        response = make_response(view(**kwargs))
+        if response.status_code != 200:
+          return response
+
+      response.set_etag(etag)
+      if last_modified is not None:
+        response.last_modified = last_modified
+      # let browsers keep the page, but have them check back every time
+      response.cache_control.no_cache = True
+      return response
+    return wrapper
+  return decorator
+
+
+# etag for a page version made of a timestamp (plus anything else that identifies it)
+def version_etag(last_modified, *extra):
+  return '-'.join([last_modified.strftime('%Y%m%d%H%M%S%f') if last_modified else '0'] + [str(part) for part in extra])
@@ -1,10 +1,55 @@
 import os
-SECRET_KEY = os.urandom(32)
+import secrets
 # Grabs the folder where the script runs.
 basedir = os.path.abspath(os.path.dirname(__file__))
 
-# Enable debug mode.
-DEBUG = True
+
+# a secret from the environment (NAME), or from the file named by NAME_FILE (e.g. a docker/kubernetes secret)
+def read_secret(name, default=None):
+    if os.environ.get(name):
+        return os.environ[name]
+    path = os.environ.get(name + '_FILE')
+    if path:
+        with open(path) as secret_file:
+            return secret_file.read().strip()
+    return default
+
+# without a configured key, every process on this machine shares one generated on first use in instance/secret_key
+# (the link makes the first writer win, so workers starting together still agree). servers behind the same load
+# balancer need the same SECRET_KEY, so set it there
+def instance_secret_key():
+    path = os.path.join(basedir, 'instance', 'secret_key')
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        candidate = '{}.{}'.format(path, os.getpid())
+        with open(os.open(candidate, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as key_file:
+            key_file.write(secrets.token_hex(32))
+        try:
+            os.link(candidate, path)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(candidate)
+    with open(path) as key_file:
+        return key_file.read().strip()
+
+# Signs the session cookie (flash messages) and the forms' CSRF tokens. To rotate it, move the current key into
+# SECRET_KEY_FALLBACKS (comma separated, newest last) and set a new SECRET_KEY: sessions and tokens signed with a
+# fallback key are still accepted until it is dropped from the list
+SECRET_KEY = read_secret('SECRET_KEY') or instance_secret_key()
+SECRET_KEY_FALLBACKS = [key for key in (read_secret('SECRET_KEY_FALLBACKS') or '').split(',') if key]
+# flask-wtf signs and checks tokens with a single key, itsdangerous takes a list (the last one signs)
+WTF_CSRF_SECRET_KEY = SECRET_KEY_FALLBACKS + [SECRET_KEY]
+
+# Sessions: 'cookie' keeps the (signed) session in the cookie itself, 'redis' keeps it server side under a random id
+# (needs the redis package) so it can be revoked and doesn't grow the cookie
+SESSION_BACKEND = os.environ.get('SESSION_BACKEND', 'cookie')
+SESSION_REDIS_URL = os.environ.get('SESSION_REDIS_URL', os.environ.get('RESPONSE_CACHE_URL', 'redis://localhost:6379/0'))
+SESSION_COOKIE_SAMESITE = 'Lax'
+SESSION_COOKIE_SECURE = os.environ.get('SESSION_COOKIE_SECURE', '0') == '1'
+
+# Enable debug mode (off unless FLASK_DEBUG=1 - never in production).
+DEBUG = os.environ.get('FLASK_DEBUG', '0') == '1'
 
 # Connect to the database
 
@@ -17,3 +62,88 @@ port = 5432
 
 SQLALCHEMY_DATABASE_URI = "{dialect}://{username}:{password}@localhost:{port}/{dbname}".format(dialect=dialect, username=username, password=password, port=port, dbname=dbname)
 
+# allow the database to be swapped out (e.g. for heroku or a throwaway benchmark db)
+SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', SQLALCHEMY_DATABASE_URI)
+# sqlalchemy only knows the postgresql:// spelling (heroku still hands out postgres:// urls)
+if SQLALCHEMY_DATABASE_URI.startswith('postgres://'):
+    SQLALCHEMY_DATABASE_URI = 'postgresql://' + SQLALCHEMY_DATABASE_URI[len('postgres://'):]
+
+# Connection pool, per worker process (so the database sees up to workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW)
+# connections). pre-ping replaces connections the database or a proxy dropped while they sat in the pool, recycle
+# retires them before a server-side idle timeout does
+SQLALCHEMY_ENGINE_OPTIONS = {
+    'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING', '1') == '1',
+    'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+}
+if not SQLALCHEMY_DATABASE_URI.startswith('sqlite'):
+    SQLALCHEMY_ENGINE_OPTIONS.update({
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 10)),
+    })
+# a runaway query is cancelled by postgres after DB_STATEMENT_TIMEOUT_MS instead of holding a worker (0 = no limit)
+DB_STATEMENT_TIMEOUT_MS = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 5000))
+if SQLALCHEMY_DATABASE_URI.startswith('postgresql') and DB_STATEMENT_TIMEOUT_MS:
+    SQLALCHEMY_ENGINE_OPTIONS['connect_args'] = { 'options': '-c statement_timeout={}'.format(DB_STATEMENT_TIMEOUT_MS) }
+
+
+# Rendered page cache (see cache.py): 'local' (per process), 'redis' (shared, set RESPONSE_CACHE_URL) or 'none'
+RESPONSE_CACHE_BACKEND = os.environ.get('RESPONSE_CACHE_BACKEND', 'local')
+RESPONSE_CACHE_URL = os.environ.get('RESPONSE_CACHE_URL', 'redis://localhost:6379/0')
+RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', 300))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', 1000))
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+
+
+# Bulk import (POST /import/<kind>, see imports.py): requests need an 'Authorization: Bearer <IMPORT_TOKEN>' header.
+# the route is disabled (404) until IMPORT_TOKEN (or IMPORT_TOKEN_FILE) is set: ./bin/import_catalog.py doesn't need it
+IMPORT_TOKEN = read_secret('IMPORT_TOKEN')
+# Bulk export (GET /export/<kind>.<format>, see exports.py): when set, requests need an 'Authorization: Bearer <EXPORT_TOKEN>' header
+EXPORT_TOKEN = read_secret('EXPORT_TOKEN')
+
+
+# Request instrumentation (see instrumentation.py): queries/statements slower than these get a 'fyyur.perf' log record
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 100))
+SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS', 500))
+SERVER_TIMING = os.environ.get('SERVER_TIMING', '1') == '1'
+# the most queries a request to each route may run. QUERY_BUDGET_STRICT makes a request over budget fail instead of just being logged
+QUERY_BUDGETS = {
+    'index': 0,
+    'venues': 4,
+    # the first search in a process also builds the in-memory search index (sqlite / no pg_trgm, see models.py)
+    'search_venues': 4,
+    'show_venue': 4,
+    'venue_calendar': 2,
+    'create_venue_form': 0,
+    'create_venue_submission': 4,
+    'delete_venue': 5,
+    'edit_venue': 2,
+    'edit_venue_submission': 10,
+    'artists': 2,
+    'search_artists': 4,
+    'autocomplete': 2,
+    'show_artist': 4,
+    'create_artist_form': 0,
+    'create_artist_submission': 3,
+    'edit_artist': 2,
+    'edit_artist_submission': 9,
+    'shows': 2,
+    'create_shows': 0,
+    # plus loading the venue's and the artist's booking trees on their first booking check (see models.py)
+    'create_show_submission': 8,
+    'api.venues': 2,
+    # the first search in a process also builds the in-memory search index (sqlite / no pg_trgm, see models.py)
+    'api.search_venues': 4,
+    'api.show_venue': 3,
+    'api.venue_shows': 2,
+    'api.artists': 1,
+    'api.search_artists': 4,
+    'api.show_artist': 3,
+    'api.artist_shows': 2,
+    'api.shows': 1,
+}
+# (no budget for bulk_import and bulk_export: their queries grow with the number of rows)
+QUERY_BUDGET_STRICT = os.environ.get('QUERY_BUDGET_STRICT', '0') == '1'
+# what a lazy load in a request (a relationship no loader option covered, see LOADER_OPTIONS in models.py) does:
+# 'raise' fails the request, 'warn' logs it to the perf log, 'allow' ignores it. development raises so one is caught early
+LAZY_LOAD_POLICY = os.environ.get('LAZY_LOAD_POLICY', 'raise' if DEBUG else 'warn')
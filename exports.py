@@ -0,0 +1,118 @@
+import csv
+import io
+import zlib
+
+from collections import defaultdict
+
+from api import dumps
+from models import *
+
+#------------------------------------------------------------------------------------------
+# Bulk export
+#-------------------------------------------------------------------------------------------
+
+# full (or, with updated_since, incremental) dumps of the venues, artists and shows as CSV or JSONL, through
+# GET /export/<kind>.<format> or ./bin/export_catalog.py. the rows are read with a server-side cursor
+# (yield_per: psycopg fetches EXPORT_CHUNK_SIZE rows at a time instead of the whole result) as plain column
+# tuples rather than entities, so nothing piles up in the session, and each chunk's genres come from one query
+# on the chunk's ids. every chunk is serialized (and optionally gzipped) and handed on before the next one is
+# fetched, so memory stays flat whatever the size of the table.
+# the columns are the ones imports.py reads (genres separated by ; in CSV, a list in JSONL, shows with their
+# duration in minutes), so an export imports back as is; the ids, seeking fields and updated_at are extra
+
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_FORMATS = ('csv', 'jsonl')
+EXPORT_CONTENT_TYPES = {
+  'csv': 'text/csv',
+  'jsonl': 'application/x-ndjson',
+}
+
+VENUE_EXPORT_COLUMNS = ('id', 'name', 'city', 'state', 'address', 'phone', 'genres', 'website', 'facebook_link', 'image_link',
+  'seeking_talent', 'seeking_description', 'updated_at')
+ARTIST_EXPORT_COLUMNS = ('id', 'name', 'city', 'state', 'phone', 'genres', 'website', 'facebook_link', 'image_link',
+  'seeking_venue', 'seeking_description', 'updated_at')
+SHOW_EXPORT_COLUMNS = ('id', 'venue_id', 'artist_id', 'start_time', 'duration', 'end_time', 'updated_at')
+
+# kind -> (model, its genre link table and column, the columns)
+EXPORTS = {
+  'venues': (Venue, Venue_Genres, 'venue_id', VENUE_EXPORT_COLUMNS),
+  'artists': (Artist, Artist_Genres, 'artist_id', ARTIST_EXPORT_COLUMNS),
+  'shows': (Show, None, None, SHOW_EXPORT_COLUMNS),
+}
+
+#----------------------------------------------------------------------------#
+# Rows.
+#----------------------------------------------------------------------------#
+
+# genre names by id for one chunk of venues / artists
+def chunk_genres(link_table, link_column, ids):
+  genres = defaultdict(list)
+  owner = link_table.c[link_column]
+  query = db.session.query(owner, link_table.c.genre_name).filter(owner.in_(ids)).order_by(owner, link_table.c.genre_name)
+  for entity_id, genre in query:
+    genres[entity_id].append(genre.name)
+  return genres
+
+# lists of row dicts, one per chunk of EXPORT_CHUNK_SIZE rows, ordered by id. `updated_since` narrows the rows
+# down to the ones created or changed since then (updated_at, see the write routes)
+def export_chunks(kind, updated_since=None, chunk_size=EXPORT_CHUNK_SIZE):
+  model, link_table, link_column, columns = EXPORTS[kind]
+  table_columns = [model.__table__.c[column] for column in columns if column not in ('genres', 'duration')]
+  query = db.select(*table_columns).order_by(model.id)
+  if updated_since is not None:
+    query = query.where(model.updated_at >= updated_since)
+
+  result = db.session.execute(query.execution_options(yield_per=chunk_size))
+  for partition in result.mappings().partitions():
+    rows = [dict(row) for row in partition]
+    if link_table is not None:
+      genres = chunk_genres(link_table, link_column, [row['id'] for row in rows])
+      for row in rows:
+        row['genres'] = genres.get(row['id'], [])
+    else:
+      for row in rows:
+        row['duration'] = int((row['end_time'] - row['start_time']).total_seconds()) // 60
+    yield [{ column: row[column] for column in columns } for row in rows]
+
+#----------------------------------------------------------------------------#
+# Serialization.
+#----------------------------------------------------------------------------#
+
+def csv_value(value):
+  if value is None:
+    return ''
+  if isinstance(value, list):
+    return ';'.join(value)
+  return value
+
+# the chunks of export_chunks as bytes: a header row, then one line per row (CSV), or one JSON object per line
+def serialize_chunks(kind, export_format, chunks):
+  columns = EXPORTS[kind][3]
+  if export_format == 'csv':
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(columns)
+    for chunk in chunks:
+      writer.writerows([csv_value(row[column]) for column in columns] for row in chunk)
+      yield buffer.getvalue().encode('utf-8')
+      buffer.seek(0)
+      buffer.truncate()
+    # (an empty export still has its header row)
+    if buffer.tell():
+      yield buffer.getvalue().encode('utf-8')
+  else:
+    for chunk in chunks:
+      yield b''.join(dumps(row) + b'\n' for row in chunk)
+
+# the chunks as one gzip stream (a gzip file when saved), compressed as they go
+def gzip_chunks(chunks, level=6):
+  compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+  for chunk in chunks:
+    compressed = compressor.compress(chunk)
+    if compressed:
+      yield compressed
+  yield compressor.flush()
+
+def export(kind, export_format, updated_since=None, compress=False, chunk_size=EXPORT_CHUNK_SIZE):
+  chunks = serialize_chunks(kind, export_format, export_chunks(kind, updated_since, chunk_size))
+  return gzip_chunks(chunks) if compress else chunks
@@ -6,8 +6,9 @@ from fabric.contrib.console import confirm
 
 def test():
     with settings(warn_only=True):
+        # drives every route against a throwaway database (see bin/loadtest.py), failing on any error
         result = local(
-            "python test_tasks.py -v && python test_users.py -v", capture=True
+            "python bin/loadtest.py --scale 1k --requests 10 --duration 5", capture=True
         )
     if result.failed and not confirm("Tests failed. Continue?"):
         abort("Aborted at user request.")
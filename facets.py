@@ -0,0 +1,147 @@
+import re
+import time
+
+from collections import defaultdict, namedtuple
+from threading import Lock
+
+#------------------------------------------------------------------------------------------
+# Facets
+#-------------------------------------------------------------------------------------------
+
+# in-memory bitmap index for narrowing the /venues and /artists listings down by genre, area and seeking flag.
+# every facet value (e.g. ('genre', 'Jazz'), ('state', 'CA'), ('city', 'CA', 'San Francisco'), ('seeking',)) has a
+# bitset where bit n is set for the venue/artist with id n. a filter is a few &s and |s over whole bitsets and its
+# facet counts are (result & bitset).bit_count() per value, all of which run in C over python ints, instead of a
+# join (or EXISTS) per genre. ids are dense, so each bitset takes about (highest id / 8) bytes
+
+# filter parsed from the query string: genre choice names, 'any' or 'all' of them, state, city and the seeking flag
+FacetFilter = namedtuple('FacetFilter', ['genres', 'match', 'state', 'city', 'seeking'])
+
+NONZERO_BYTE = re.compile(b'[^\x00]')
+
+# bit positions set in each byte value
+BYTE_BITS = [tuple(bit for bit in range(8) if byte >> bit & 1) for byte in range(256)]
+
+
+# the facet filter in `args` (a request's MultiDict), None when there is none. raises ValueError for a genre that
+# isn't one of `genres` or a bad match
+def parse_facets(args, genres):
+  facet_filter = FacetFilter(
+    genres=args.getlist('genre'),
+    match=args.get('match', 'any'),
+    state=args.get('state') or None,
+    city=args.get('city') or None,
+    seeking=args.get('seeking') in ('1', 'true', 'on')
+  )
+  unknown = [genre for genre in facet_filter.genres if genre not in genres]
+  if unknown:
+    raise ValueError('Unknown genres: {}'.format(', '.join(unknown)))
+  if facet_filter.match not in ('any', 'all'):
+    raise ValueError("match must be 'any' or 'all'")
+  if not (facet_filter.genres or facet_filter.state or facet_filter.city or facet_filter.seeking):
+    return None
+  return facet_filter
+
+
+def bits_from_ids(ids, size):
+  data = bytearray(size)
+  for doc_id in ids:
+    data[doc_id >> 3] |= 1 << (doc_id & 7)
+  return data
+
+
+# each bitset is kept twice: as a bytearray, where a write sets or clears a single bit in place, and as the int
+# the queries work on, which is rebuilt from the bytearray (int.from_bytes, a copy in C) on first use after a write
+class FacetIndex:
+
+  def __init__(self):
+    self.bytes = {}
+    self.ints = {}
+    self.lock = Lock()
+    self.loaded_at = None
+
+  def __len__(self):
+    return self.bitset(None).bit_count()
+
+  # replaces the whole index in one go, from (id, facet key) pairs plus an (id, None) pair for every document
+  # (the None bitset has them all)
+  def load(self, pairs):
+    ids_by_key = defaultdict(list)
+    for doc_id, key in pairs:
+      ids_by_key[key].append(doc_id)
+    size = max(ids_by_key[None], default=0) // 8 + 1
+    data = { key: bits_from_ids(ids, size) for key, ids in ids_by_key.items() }
+    with self.lock:
+      self.bytes, self.ints = data, {}
+      self.loaded_at = time.time()
+
+  def keys(self):
+    return [key for key in list(self.bytes) if key is not None]
+
+  # sets the document's facet keys, replacing the ones it had
+  def add(self, doc_id, keys):
+    with self.lock:
+      self._remove(doc_id)
+      for key in [None] + list(keys):
+        data = self.bytes.get(key)
+        if data is None:
+          data = self.bytes[key] = bytearray()
+        if len(data) <= doc_id >> 3:
+          data.extend(bytes((doc_id >> 3) - len(data) + 1))
+        data[doc_id >> 3] |= 1 << (doc_id & 7)
+        self.ints.pop(key, None)
+
+  def remove(self, doc_id):
+    with self.lock:
+      self._remove(doc_id)
+
+  # (a document's keys aren't stored, at a million documents that would take more memory than the bitsets:
+  # clearing its bit in every bitset is one byte test per facet value)
+  def _remove(self, doc_id):
+    offset, mask = doc_id >> 3, 1 << (doc_id & 7)
+    for key, data in self.bytes.items():
+      if offset < len(data) and data[offset] & mask:
+        data[offset] &= ~mask
+        self.ints.pop(key, None)
+
+  def bitset(self, key):
+    bits = self.ints.get(key)
+    if bits is None:
+      # (under the lock, so a write can't land between reading the bytes and caching the int)
+      with self.lock:
+        data = self.bytes.get(key)
+        bits = self.ints[key] = int.from_bytes(data, 'little') if data is not None else 0
+    return bits
+
+  # documents that have every key in all_of and, for each group in any_of, at least one of the group's keys
+  def match(self, all_of=(), any_of=()):
+    bits = self.bitset(None)
+    for key in all_of:
+      bits &= self.bitset(key)
+    for group in any_of:
+      union = 0
+      for key in group:
+        union |= self.bitset(key)
+      bits &= union
+    return bits
+
+  # number of documents in `bits` that have each of the keys
+  def counts(self, bits, keys):
+    return { key: (bits & self.bitset(key)).bit_count() for key in keys }
+
+  # ids in `bits`, in ascending order
+  @staticmethod
+  def ids(bits):
+    data = bits.to_bytes((bits.bit_length() + 7) // 8, 'little')
+    ids = []
+    for byte in NONZERO_BYTE.finditer(data):
+      offset = byte.start()
+      ids.extend((offset << 3) + bit for bit in BYTE_BITS[data[offset]])
+    return ids
+
+  # membership test for the ids in `bits` (one byte lookup per test, `bits >> n & 1` would copy the whole int)
+  @staticmethod
+  def contains(bits):
+    data = bits.to_bytes((bits.bit_length() + 7) // 8, 'little')
+    size = len(data)
+    return lambda doc_id: (doc_id >> 3) < size and bool(data[doc_id >> 3] >> (doc_id & 7) & 1)
@@ -2,10 +2,10 @@ import re
 
 from datetime import datetime
 from flask_wtf import FlaskForm
-from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField
-from wtforms.validators import DataRequired, AnyOf, Regexp, Optional, URL, ValidationError
+from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField, IntegerField
+from wtforms.validators import DataRequired, AnyOf, NumberRange, Regexp, Optional, URL, ValidationError
 
-from models import Genre_Choices
+from models import DEFAULT_SHOW_DURATION, MAX_SHOW_DURATION, Genre_Choices
 
 # ------------------------------------------------------------------------------
 # Custom validators
@@ -53,6 +53,12 @@ class ShowForm(FlaskForm):
         validators=[DataRequired()],
         default= datetime.today()
     )
+    # minutes the show books its venue and artist for
+    duration = IntegerField(
+        'duration',
+        validators=[DataRequired(), NumberRange(min=15, max=int(MAX_SHOW_DURATION.total_seconds()) // 60)],
+        default=int(DEFAULT_SHOW_DURATION.total_seconds()) // 60
+    )
 
 class VenueForm(FlaskForm):
     name = StringField(
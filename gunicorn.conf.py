@@ -0,0 +1,47 @@
+# gunicorn settings, all overridable from the environment:
+#   gunicorn -c gunicorn.conf.py wsgi:app
+#
+# worker classes:
+#  - 'gthread' (default): WEB_CONCURRENCY processes with GUNICORN_THREADS threads each. keep DB_POOL_SIZE at
+#    least GUNICORN_THREADS, or threads queue for a connection
+#  - 'sync': one request at a time per process
+#  - 'gevent': GUNICORN_WORKER_CONNECTIONS greenlets per process (pip install gevent psycogreen). most of them
+#    wait for a database connection unless DB_POOL_SIZE + DB_MAX_OVERFLOW is raised to match
+# see README.md for throughput with 1/4/16 workers (python ./bin/loadtest.py --workers 1,4,16)
+
+import multiprocessing
+import os
+
+bind = '0.0.0.0:{}'.format(os.environ.get('PORT', 8000))
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 100))
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = 30
+keepalive = 5
+# recycle workers now and then, so a slow leak (or the per-process page cache) can't grow without bound
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 5000))
+max_requests_jitter = max_requests // 10
+
+# import the app once in the master and fork the workers from it; not with gevent, which has to patch the
+# standard library before anything else is imported
+preload_app = worker_class != 'gevent'
+
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-')
+errorlog = '-'
+
+
+def post_fork(server, worker):
+    if worker_class == 'gevent':
+        try:
+            from psycogreen.gevent import patch_psycopg
+            patch_psycopg()
+        except ImportError:
+            server.log.warning('psycogreen is not installed: database calls will block the whole gevent worker')
+
+    # connections opened in the master (while preloading) must not be shared with the forked workers
+    from app_config import app, db
+    with app.app_context():
+        db.engine.dispose(close=False)
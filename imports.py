@@ -0,0 +1,380 @@
+import csv
+import io
+import json
+import re
+
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import SQLAlchemyError
+from wtforms import DateTimeField, IntegerField, SelectField, SelectMultipleField
+from wtforms.fields.core import UnboundField
+from wtforms.validators import StopValidation, ValidationError
+
+from forms import ArtistForm, ShowForm, VenueForm
+from models import *
+
+#------------------------------------------------------------------------------------------
+# Bulk import
+#-------------------------------------------------------------------------------------------
+
+# venues, artists and shows from CSV (a header row, then one row per entity; genres separated by ; or ,) or JSONL
+# (one JSON object per line; genres as a list), through POST /import/<kind> or ./bin/import_catalog.py. the input
+# flows through a pipeline of generators, so memory stays flat whatever its size:
+#   read_rows       parses the stream a line at a time into (line number, row dict) pairs
+#   validated_rows  checks each row with the validators of the kind's form in forms.py (PhoneValidator,
+#                   ImageLinkValidator, ...), run directly on each value rather than through a FlaskForm per row,
+#                   and resolves its genres to Genre_Choices
+#   import_rows     inserts the valid rows IMPORT_BATCH_SIZE at a time, one transaction and a few executemany
+#                   statements per batch, and reports the rows that were rejected along with why
+# shows are checked against their venue's and artist's bookings (see Bookings in models.py) and counted into their
+# show counters like the ones created through the form
+
+IMPORT_BATCH_SIZE = 5000
+# at most this many rejected rows are reported (all of them are counted)
+IMPORT_MAX_ERRORS = 1000
+IMPORT_FORMATS = ('csv', 'jsonl')
+# the format of a request body without ?format=
+IMPORT_CONTENT_TYPES = {
+  'text/csv': 'csv',
+  'application/jsonl': 'jsonl',
+  'application/x-ndjson': 'jsonl',
+}
+
+IMPORT_FORMS = {
+  'venues': VenueForm,
+  'artists': ArtistForm,
+  'shows': ShowForm,
+}
+
+GENRE_SEPARATOR = re.compile(r'\s*[;,]\s*')
+
+# a rejected row: its line in the input and its errors by field ('row' for the row as a whole)
+RowError = namedtuple('RowError', ['line', 'errors'])
+ImportResult = namedtuple('ImportResult', ['imported', 'failed', 'errors'])
+
+# one field of an import form: its validators, and the converter that turns an imported value into the field's
+# data (raising ValueError with the message the form field would show)
+FieldRule = namedtuple('FieldRule', ['name', 'convert', 'validators'])
+
+#----------------------------------------------------------------------------#
+# Parsing.
+#----------------------------------------------------------------------------#
+
+# (line number, row dict or None, parse error or None) for each row of `stream` (binary, e.g. request.stream)
+def read_rows(stream, import_format):
+  if not isinstance(stream, io.BufferedIOBase):
+    stream = io.BufferedReader(stream)
+  # (utf-8-sig: spreadsheets tend to start their CSVs with a byte order mark)
+  text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+  if import_format == 'csv':
+    reader = csv.DictReader(text)
+    for row in reader:
+      if None in row:
+        yield reader.line_num, None, 'More values than columns'
+      else:
+        yield reader.line_num, row, None
+  else:
+    for number, line in enumerate(text, 1):
+      if not line.strip():
+        continue
+      try:
+        row = json.loads(line)
+      except ValueError as error:
+        yield number, None, 'Invalid JSON: {}'.format(error)
+        continue
+      if isinstance(row, dict):
+        yield number, row, None
+      else:
+        yield number, None, 'Expected a JSON object'
+
+#----------------------------------------------------------------------------#
+# Validation.
+#----------------------------------------------------------------------------#
+
+# just enough of a wtforms Field for the forms' validators to run on an imported value
+class RowField:
+  __slots__ = ('data', 'raw_data', 'errors')
+
+  def gettext(self, string):
+    return string
+
+  def ngettext(self, singular, plural, n):
+    return singular if n == 1 else plural
+
+def string_value(value):
+  return '' if value is None else str(value).strip()
+
+def convert_string(value):
+  return string_value(value)
+
+def convert_integer(value):
+  if value is None or string_value(value) == '':
+    return None
+  try:
+    return int(value)
+  except (TypeError, ValueError):
+    raise ValueError('Not a valid integer value.')
+
+def datetime_converter(formats):
+  def convert(value):
+    value = string_value(value)
+    if not value:
+      return None
+    for datetime_format in formats:
+      try:
+        return datetime.strptime(value, datetime_format)
+      except ValueError:
+        pass
+    # (and ISO 8601, which is what JSON exports hold)
+    try:
+      return datetime.fromisoformat(value)
+    except ValueError:
+      raise ValueError('Not a valid datetime value.')
+  return convert
+
+def choice_converter(choices):
+  def convert(value):
+    value = string_value(value)
+    if value and value not in choices:
+      raise ValueError('Not a valid choice.')
+    return value
+  return convert
+
+# genre names or values (e.g. 'Hip_Hop' or 'Hip-Hop') -> Genre_Choices names
+def convert_genres(value):
+  if value is None:
+    values = []
+  elif isinstance(value, (list, tuple)):
+    values = [string_value(item) for item in value]
+  else:
+    values = GENRE_SEPARATOR.split(string_value(value))
+  names = []
+  for genre in values:
+    if not genre:
+      continue
+    if genre in Genre_Choices.__members__:
+      names.append(genre)
+    else:
+      try:
+        names.append(Genre_Choices(genre).name)
+      except ValueError:
+        raise ValueError("'{}' is not a valid choice for this field.".format(genre))
+  return names
+
+# the fields of a form class, in their declared order, as FieldRules (built once per form)
+def form_rules(form_class):
+  fields = sorted(
+    ((name, field) for name, field in vars(form_class).items() if isinstance(field, UnboundField)),
+    key=lambda item: item[1].creation_counter
+  )
+  rules = []
+  for name, field in fields:
+    field_class = field.field_class
+    if issubclass(field_class, SelectMultipleField):
+      convert = convert_genres
+    elif issubclass(field_class, SelectField):
+      convert = choice_converter(set(value for value, _ in field.kwargs.get('choices', [])))
+    elif issubclass(field_class, IntegerField):
+      convert = convert_integer
+    elif issubclass(field_class, DateTimeField):
+      formats = field.kwargs.get('format', '%Y-%m-%d %H:%M:%S')
+      convert = datetime_converter([formats] if isinstance(formats, str) else formats)
+    else:
+      convert = convert_string
+    rules.append(FieldRule(name, convert, list(field.kwargs.get('validators') or [])))
+  return rules
+
+import_rules = { kind: form_rules(form_class) for kind, form_class in IMPORT_FORMS.items() }
+
+# runs a field's validators like wtforms does: in order, a StopValidation ends the chain
+def run_validators(rule, field):
+  for validator in rule.validators:
+    try:
+      validator(None, field)
+    except StopValidation as error:
+      if error.args and error.args[0]:
+        field.errors.append(error.args[0])
+      return
+    except ValidationError as error:
+      field.errors.append(error.args[0])
+
+# the row's values by field and its errors by field (an empty dict for a valid row)
+def validate_row(rules, row, field):
+  values = {}
+  errors = {}
+  for rule in rules:
+    raw = row.get(rule.name)
+    field.errors = []
+    field.raw_data = [] if raw is None else [raw]
+    try:
+      field.data = rule.convert(raw)
+    except ValueError as error:
+      errors[rule.name] = [str(error)]
+      continue
+    run_validators(rule, field)
+    if field.errors:
+      errors[rule.name] = field.errors
+    values[rule.name] = field.data
+  return values, errors
+
+# (line number, values, errors) for each row of read_rows
+def validated_rows(kind, rows):
+  rules = import_rules[kind]
+  field = RowField()
+  for line, row, parse_error in rows:
+    if parse_error is not None:
+      yield line, None, { 'row': [parse_error] }
+      continue
+    values, errors = validate_row(rules, row, field)
+    yield line, values, errors
+
+#----------------------------------------------------------------------------#
+# Inserts.
+#----------------------------------------------------------------------------#
+
+# empty optional strings are stored as NULL (website and facebook_link are unique, '' would clash)
+def nullable(value):
+  return value if value not in ('', None) else None
+
+def insert_entities(model, link_table, link_column, columns, batch):
+  table = model.__table__
+  rows = [{ column: nullable(values[column]) for column in columns } for _, values in batch]
+  ids = db.session.execute(table.insert().returning(table.c.id, sort_by_parameter_order=True), rows).scalars().all()
+  links = [
+    { link_column: entity_id, 'genre_name': Genre_Choices[genre] }
+    for entity_id, (_, values) in zip(ids, batch) for genre in values['genres']
+  ]
+  if links:
+    db.session.execute(link_table.insert(), links)
+  db.session.commit()
+  return []
+
+VENUE_COLUMNS = ('name', 'city', 'state', 'address', 'phone', 'website', 'facebook_link', 'image_link')
+ARTIST_COLUMNS = ('name', 'city', 'state', 'phone', 'website', 'facebook_link', 'image_link')
+
+def insert_venues(batch):
+  return insert_entities(Venue, Venue_Genres, 'venue_id', VENUE_COLUMNS, batch)
+
+def insert_artists(batch):
+  return insert_entities(Artist, Artist_Genres, 'artist_id', ARTIST_COLUMNS, batch)
+
+ImportedShow = namedtuple('ImportedShow', ['venue_id', 'artist_id', 'start_time', 'end_time'])
+
+# shows whose venue and artist exist and are free at the time, counted into the counters like count_new does for
+# the form's shows. returns the rejected rows
+def insert_shows(batch):
+  rejected = []
+  shows = []
+  for line, values in batch:
+    try:
+      venue_id, artist_id = int(values['venue_id']), int(values['artist_id'])
+    except ValueError:
+      field = 'artist_id' if values['venue_id'].isdigit() else 'venue_id'
+      rejected.append(RowError(line, { field: ['Not a valid integer value.'] }))
+      continue
+    start_time = values['start_time']
+    shows.append((line, ImportedShow(venue_id, artist_id, start_time, start_time + timedelta(minutes=values['duration']))))
+
+  venue_ids = set(Venue.get_existing_ids(show.venue_id for _, show in shows))
+  artist_ids = set(Artist.get_existing_ids(show.artist_id for _, show in shows))
+  preload_bookings([show for _, show in shows if show.venue_id in venue_ids and show.artist_id in artist_ids])
+  accepted = []
+  ids = []
+  try:
+    for line, show in shows:
+      if show.venue_id not in venue_ids or show.artist_id not in artist_ids:
+        field = 'venue_id' if show.venue_id not in venue_ids else 'artist_id'
+        rejected.append(RowError(line, { field: ['No such {} {}'.format(field[:-3], getattr(show, field))] }))
+        continue
+      try:
+        accepted.append((show, reserve_booking(show)))
+      except BookingConflict as conflict:
+        rejected.append(RowError(line, { 'row': [str(conflict)] }))
+
+    if accepted:
+      # (counted before they are inserted, like the form's: on a database without a rollover row yet, count_new
+      # starts from a full count of the shows)
+      Show.count_new([show for show, _ in accepted])
+      table = Show.__table__
+      ids = db.session.execute(table.insert().returning(table.c.id, sort_by_parameter_order=True),
+        [show._asdict() for show, _ in accepted]).scalars().all()
+    db.session.commit()
+  except:
+    db.session.rollback()
+    for _, booking in accepted:
+      release_booking(booking)
+    raise
+
+  for (_, booking), show_id in zip(accepted, ids):
+    confirm_booking(booking, show_id)
+  return rejected
+
+INSERTERS = {
+  'venues': insert_venues,
+  'artists': insert_artists,
+  'shows': insert_shows,
+}
+
+IMPORT_MODELS = {
+  'venues': Venue,
+  'artists': Artist,
+  'shows': Show,
+}
+
+# the database's message for a failed insert, without the statement and parameters
+def database_error(error):
+  return str(getattr(error, 'orig', error)).split('\n')[0]
+
+# inserts a batch of (line, values) in one transaction. if the database rejects it (e.g. a duplicate website), the
+# rows are inserted one by one to find the ones it rejects. returns the rejected rows
+def import_batch(kind, batch):
+  insert = INSERTERS[kind]
+  try:
+    return insert(batch)
+  except SQLAlchemyError:
+    db.session.rollback()
+
+  rejected = []
+  for item in batch:
+    try:
+      rejected += insert([item])
+    except SQLAlchemyError as error:
+      db.session.rollback()
+      rejected.append(RowError(item[0], { 'row': [database_error(error)] }))
+  return rejected
+
+# imports the rows of read_rows into `kind` ('venues', 'artists' or 'shows'). on_commit(kind, values) is called
+# with the values of each batch's rows once they are saved (e.g. to evict the cached pages they show up on)
+def import_rows(kind, rows, batch_size=IMPORT_BATCH_SIZE, max_errors=IMPORT_MAX_ERRORS, on_commit=None):
+  imported = failed = 0
+  errors = []
+
+  def reject(row_errors):
+    nonlocal failed
+    failed += len(row_errors)
+    errors.extend(row_errors[:max(0, max_errors - len(errors))])
+
+  valid = []
+  for line, values, row_errors in validated_rows(kind, rows):
+    if row_errors:
+      reject([RowError(line, row_errors)])
+      continue
+    valid.append((line, values))
+    if len(valid) >= batch_size:
+      imported += save_batch(kind, valid, reject, on_commit)
+      valid = []
+  if valid:
+    imported += save_batch(kind, valid, reject, on_commit)
+
+  if imported:
+    drop_in_memory_indexes(IMPORT_MODELS[kind])
+  return ImportResult(imported, failed, sorted(errors, key=lambda row_error: row_error.line))
+
+def save_batch(kind, batch, reject, on_commit):
+  rejected = import_batch(kind, batch)
+  reject(rejected)
+  if on_commit is not None and len(rejected) < len(batch):
+    lines = set(row_error.line for row_error in rejected)
+    on_commit(kind, [values for line, values in batch if line not in lines])
+  return len(batch) - len(rejected)
@@ -0,0 +1,196 @@
+import functools
+import json
+import logging
+import re
+import time
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+#------------------------------------------------------------------------------------------
+# SQL instrumentation
+#-------------------------------------------------------------------------------------------
+
+# counts the queries, rows and database time of every request (through the engine's before/after_cursor_execute
+# events) and
+#  - adds a Server-Timing header (db and app time, visible in the browser's network tab)
+#  - logs a JSON 'slow_query' record for every query over SLOW_QUERY_MS, and a 'slow_request' / 'over_budget'
+#    record (with the request's most repeated statements, which is what an N+1 looks like) for requests over
+#    SLOW_REQUEST_MS or over their query budget
+#  - checks each request against its route's entry in QUERY_BUDGETS (endpoint -> max queries); with
+#    QUERY_BUDGET_STRICT a request over budget raises QueryBudgetExceeded, so a test or load test hitting it fails
+#  - watches for lazy loads (a relationship loaded on first access, through the session's do_orm_execute event):
+#    routes name the loader options they need (see LOADER_OPTIONS in models.py), so a lazy load in a request is
+#    one that was missed. LAZY_LOAD_POLICY 'warn' logs a 'lazy_load' record, 'raise' also raises UnexpectedLazyLoad
+#    (what the load test and benchmarks run with) and 'allow' lets it through
+#
+# the records go to the 'fyyur.perf' logger. statements are logged as fingerprints (literals, parameters and
+# IN lists collapsed) so the same query always logs the same text, and no parameter values end up in the log
+
+perf_logger = logging.getLogger('fyyur.perf')
+
+
+class QueryBudgetExceeded(Exception):
+
+  def __init__(self, endpoint, queries, budget):
+    super().__init__('{} ran {} queries, its budget is {}'.format(endpoint, queries, budget))
+    self.endpoint = endpoint
+    self.queries = queries
+    self.budget = budget
+
+
+class UnexpectedLazyLoad(Exception):
+
+  def __init__(self, endpoint, relationship):
+    super().__init__('{} lazy loaded {}, add a loader option for it'.format(endpoint, relationship))
+    self.endpoint = endpoint
+    self.relationship = relationship
+
+
+class RequestStats:
+  __slots__ = ('start', 'queries', 'rows', 'db_time', 'statements')
+
+  def __init__(self):
+    self.start = time.perf_counter()
+    self.queries = 0
+    self.rows = 0
+    self.db_time = 0.0
+    # fingerprint -> [count, seconds]
+    self.statements = {}
+
+
+_literals = [
+  (re.compile(r"'(?:[^']|'')*'"), '?'),
+  (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),
+  (re.compile(r'%\(\w+\)s|(?<!:):\w+|\$\d+|%s'), '?'),
+  (re.compile(r'\(\s*(?:\?|\[POSTCOMPILE_\w+\])(?:\s*,\s*\?)*\s*\)'), '(...)'),
+  (re.compile(r'\s+'), ' '),
+]
+
+# the same statement with different values (or a different number of IN values) gives the same fingerprint
+@functools.lru_cache(maxsize=2048)
+def fingerprint(statement):
+  for pattern, replacement in _literals:
+    statement = pattern.sub(replacement, statement)
+  return statement.strip()
+
+
+class SQLInstrumentation:
+
+  def __init__(self, app=None):
+    self.slow_query = 0.1
+    self.slow_request = 0.5
+    self.server_timing = True
+    self.budgets = {}
+    self.strict = False
+    self.lazy_load_policy = 'warn'
+    if app is not None:
+      self.init_app(app)
+
+  def init_app(self, app):
+    self.slow_query = app.config.get('SLOW_QUERY_MS', 100) / 1000.0
+    self.slow_request = app.config.get('SLOW_REQUEST_MS', 500) / 1000.0
+    self.server_timing = app.config.get('SERVER_TIMING', True)
+    self.budgets = app.config.get('QUERY_BUDGETS', {})
+    self.strict = app.config.get('QUERY_BUDGET_STRICT', False)
+    self.lazy_load_policy = app.config.get('LAZY_LOAD_POLICY', 'warn')
+    if self.lazy_load_policy not in ('allow', 'warn', 'raise'):
+      raise ValueError("LAZY_LOAD_POLICY must be 'allow', 'warn' or 'raise', not {!r}".format(self.lazy_load_policy))
+
+    # listening on the Engine class covers the engine flask-sqlalchemy creates lazily
+    if not event.contains(Engine, 'before_cursor_execute', self.before_cursor_execute):
+      event.listen(Engine, 'before_cursor_execute', self.before_cursor_execute)
+      event.listen(Engine, 'after_cursor_execute', self.after_cursor_execute)
+      event.listen(Engine, 'handle_error', self.handle_error)
+      event.listen(Session, 'do_orm_execute', self.do_orm_execute)
+    app.before_request(self.before_request)
+    app.after_request(self.after_request)
+
+  def budget(self, endpoint):
+    return self.budgets.get(endpoint)
+
+  def before_request(self):
+    g.sql_stats = RequestStats()
+
+  def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+  def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+    # queries outside a request (scripts, migrations, the cli) aren't tracked
+    if not has_request_context() or 'sql_stats' not in g:
+      return
+
+    # rowcount is the number of rows fetched by a select on postgres, sqlite only reports it for writes (-1 otherwise)
+    rows = max(cursor.rowcount, 0)
+    stats = g.sql_stats
+    stats.queries += 1
+    stats.rows += rows
+    stats.db_time += elapsed
+
+    statement_fingerprint = fingerprint(statement)
+    entry = stats.statements.get(statement_fingerprint)
+    if entry is None:
+      stats.statements[statement_fingerprint] = [1, elapsed]
+    else:
+      entry[0] += 1
+      entry[1] += elapsed
+
+    if elapsed >= self.slow_query:
+      self.log('slow_query', duration_ms=round(elapsed * 1000, 2), rows=rows, statement=statement_fingerprint)
+
+  # a failed statement never gets to after_cursor_execute
+  def handle_error(self, context):
+    if context.connection is not None and context.connection.info.get('query_start'):
+      context.connection.info['query_start'].pop()
+
+  # lazy_loaded_from is only set for a lazy load that goes to the database (not for eager loads, refreshes of
+  # expired objects or many-to-ones found in the identity map)
+  def do_orm_execute(self, orm_execute_state):
+    if self.lazy_load_policy == 'allow' or not orm_execute_state.is_select or orm_execute_state.lazy_loaded_from is None:
+      return
+    if not has_request_context() or 'sql_stats' not in g:
+      return
+
+    # logged either way: a route that catches every exception around its writes would hide the raise
+    relationship = str(orm_execute_state.loader_strategy_path[-1])
+    self.log('lazy_load', relationship=relationship)
+    if self.lazy_load_policy == 'raise':
+      raise UnexpectedLazyLoad(request.endpoint, relationship)
+
+  def after_request(self, response):
+    stats = g.pop('sql_stats', None)
+    if stats is None:
+      return response
+
+    elapsed = time.perf_counter() - stats.start
+    if self.server_timing:
+      response.headers.add('Server-Timing', 'db;dur={:.2f};desc="{} queries, {} rows"'.format(stats.db_time * 1000, stats.queries, stats.rows))
+      response.headers.add('Server-Timing', 'app;dur={:.2f}'.format(elapsed * 1000))
+
+    budget = self.budget(request.endpoint)
+    over_budget = budget is not None and stats.queries > budget
+    if over_budget or elapsed >= self.slow_request:
+      repeated = sorted(stats.statements.items(), key=lambda item: item[1][0], reverse=True)[:3]
+      self.log('slow_request' if elapsed >= self.slow_request else 'over_budget',
+        status=response.status_code,
+        duration_ms=round(elapsed * 1000, 2),
+        db_ms=round(stats.db_time * 1000, 2),
+        queries=stats.queries,
+        rows=stats.rows,
+        budget=budget,
+        top_statements=[{ 'statement': statement, 'count': count, 'db_ms': round(seconds * 1000, 2) } for statement, (count, seconds) in repeated]
+      )
+    if over_budget and self.strict:
+      raise QueryBudgetExceeded(request.endpoint, stats.queries, budget)
+    return response
+
+  def log(self, event_name, **fields):
+    record = { 'event': event_name, 'endpoint': request.endpoint, 'method': request.method, 'path': request.path }
+    record.update(fields)
+    perf_logger.warning(json.dumps(record))
+
+
+sql_instrumentation = SQLInstrumentation()
@@ -0,0 +1,285 @@
+import random
+import time
+
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime
+from itertools import count
+from threading import Lock
+
+#------------------------------------------------------------------------------------------
+# Intervals
+#-------------------------------------------------------------------------------------------
+
+# in-memory interval index for booking checks: one interval tree per venue and per artist holding their bookings
+# (shows) as [start, end) intervals, so whether a new show overlaps one of them is a walk down one tree, O(log n)
+# in the number of bookings, instead of a query over the venue's / artist's show history
+
+# a stored interval: its start, its end and the key it was added under (a show id, or a pending booking's token)
+Interval = namedtuple('Interval', ['start', 'end', 'key'])
+
+
+class BookingConflict(Exception):
+  def __init__(self, owner, interval):
+    super().__init__('{} {} is already booked from {} to {}'.format(owner[0], owner[1], interval.start, interval.end))
+    self.owner = owner
+    self.interval = interval
+
+
+class Node:
+  __slots__ = ('interval', 'order', 'priority', 'max_end', 'left', 'right')
+
+  def __init__(self, interval, order):
+    self.interval = interval
+    self.order = order
+    self.priority = random.random()
+    self.max_end = interval.end
+    self.left = None
+    self.right = None
+
+
+def update(node):
+  node.max_end = node.interval.end
+  if node.left is not None and node.left.max_end > node.max_end:
+    node.max_end = node.left.max_end
+  if node.right is not None and node.right.max_end > node.max_end:
+    node.max_end = node.right.max_end
+
+
+def rotate_right(node):
+  left = node.left
+  node.left, left.right = left.right, node
+  update(node)
+  update(left)
+  return left
+
+
+def rotate_left(node):
+  right = node.right
+  node.right, right.left = right.left, node
+  update(node)
+  update(right)
+  return right
+
+
+def insert(node, new):
+  if node is None:
+    return new
+  if new.order < node.order:
+    node.left = insert(node.left, new)
+    if node.left.priority > node.priority:
+      return rotate_right(node)
+  else:
+    node.right = insert(node.right, new)
+    if node.right.priority > node.priority:
+      return rotate_left(node)
+  update(node)
+  return node
+
+
+def merge(left, right):
+  if left is None:
+    return right
+  if right is None:
+    return left
+  if left.priority > right.priority:
+    left.right = merge(left.right, right)
+    update(left)
+    return left
+  right.left = merge(left, right.left)
+  update(right)
+  return right
+
+
+def delete(node, order):
+  if node is None:
+    return None
+  if order < node.order:
+    node.left = delete(node.left, order)
+  elif node.order < order:
+    node.right = delete(node.right, order)
+  else:
+    return merge(node.left, node.right)
+  update(node)
+  return node
+
+
+# a treap ordered by interval start, each node also keeping the latest end in its subtree (max_end). that's what
+# lets find() skip a whole subtree: if nothing on the left ends after the new interval starts, nothing there
+# overlaps it (and if something does end after it but doesn't overlap, it starts after the new interval ends, and
+# so does everything on the right). the random priorities keep the tree's depth O(log n) whatever the insert order
+class IntervalTree:
+
+  def __init__(self, intervals=()):
+    self.root = None
+    # key -> (order, interval)
+    self.entries = {}
+    self.serial = count()
+    for interval in intervals:
+      self.add(*interval)
+
+  def __len__(self):
+    return len(self.entries)
+
+  def __iter__(self):
+    stack, node = [], self.root
+    while stack or node is not None:
+      while node is not None:
+        stack.append(node)
+        node = node.left
+      node = stack.pop()
+      yield node.interval
+      node = node.right
+
+  # (keys are unique: adding a key again replaces its interval)
+  def add(self, start, end, key):
+    self.remove(key)
+    # intervals with the same start are kept in insertion order
+    order = (start, next(self.serial))
+    interval = Interval(start, end, key)
+    self.entries[key] = (order, interval)
+    self.root = insert(self.root, Node(interval, order))
+
+  def get(self, key):
+    entry = self.entries.get(key)
+    return entry[1] if entry is not None else None
+
+  def remove(self, key):
+    entry = self.entries.pop(key, None)
+    if entry is not None:
+      self.root = delete(self.root, entry[0])
+    return entry is not None
+
+  # a stored interval overlapping [start, end) (None if there is none)
+  def find(self, start, end):
+    node = self.root
+    while node is not None:
+      if node.interval.start < end and start < node.interval.end:
+        return node.interval
+      if node.left is not None and node.left.max_end > start:
+        node = node.left
+      else:
+        node = node.right
+    return None
+
+
+LoadedTree = namedtuple('LoadedTree', ['tree', 'since', 'loaded_at'])
+
+# the trees are locked in stripes, by owner: a booking holds the stripes of its venue and artist (taken in order,
+# so two bookings can't deadlock) while their trees are loaded and checked, so a slow load only holds up the
+# bookings that share a stripe with it rather than every booking in the process
+LOCK_STRIPES = 64
+
+
+# the interval trees of the venues and artists (keyed by e.g. ('venue', 3)), each loaded on first use with the
+# bookings that end after the time it is loaded (load(owner, since) -> (start, end, show id) rows) and reloaded
+# after `refresh_seconds`, which picks up the shows created by other processes. a booking that starts before its
+# tree was loaded is checked against the bookings in that range instead (load(owner, start, end)). preload() loads
+# the trees of many owners at once (load_many(owners, since) -> {owner: rows}), for checking a batch of bookings.
+# a tree that goes unused past its refresh is dropped, and there are never more than about `max_trees` of them
+class BookingIndex:
+
+  def __init__(self, load, refresh_seconds, load_many=None, max_trees=100000):
+    self.load = load
+    self.load_many = load_many
+    self.refresh_seconds = refresh_seconds
+    self.max_trees = max_trees
+    self.trees = {}
+    # (guards the dict of trees, never held while loading)
+    self.lock = Lock()
+    self.stripes = [Lock() for _ in range(LOCK_STRIPES)]
+    self.swept_at = time.time()
+
+  def stripe(self, owner):
+    return self.stripes[hash(owner) % LOCK_STRIPES]
+
+  @contextmanager
+  def locked(self, owners):
+    stripes = [self.stripes[index] for index in sorted({ hash(owner) % LOCK_STRIPES for owner in owners })]
+    for stripe in stripes:
+      stripe.acquire()
+    try:
+      yield
+    finally:
+      for stripe in reversed(stripes):
+        stripe.release()
+
+  def stale(self, owner):
+    loaded = self.trees.get(owner)
+    return loaded is None or time.time() - loaded.loaded_at > self.refresh_seconds
+
+  # (the caller holds the owner's stripe)
+  def tree(self, owner):
+    loaded = self.trees.get(owner)
+    if self.stale(owner):
+      since = datetime.now()
+      loaded = LoadedTree(IntervalTree(self.load(owner, since)), since, time.time())
+      self.store({ owner: loaded })
+    return loaded
+
+  # the query runs without holding any lock; a tree some booking has reloaded meanwhile is kept
+  def preload(self, owners):
+    owners = set(owners)
+    current = { owner: self.trees.get(owner) for owner in owners if self.stale(owner) }
+    if not current:
+      return
+    since = datetime.now()
+    rows = self.load_many(list(current), since)
+    loaded_at = time.time()
+    with self.locked(current):
+      self.store({ owner: LoadedTree(IntervalTree(rows.get(owner, ())), since, loaded_at)
+        for owner, loaded in current.items() if self.trees.get(owner) is loaded })
+
+  # adds loaded trees. once per refresh (or when there are more than max_trees) the trees that went unused since
+  # their refresh are dropped, then the oldest ones if that isn't enough. trees whose stripe is held stay, since a
+  # booking may be working on them
+  def store(self, loaded_trees):
+    with self.lock:
+      self.trees.update(loaded_trees)
+      now = time.time()
+      if len(self.trees) <= self.max_trees and now - self.swept_at < self.refresh_seconds:
+        return
+      self.swept_at = now
+      excess = len(self.trees) - self.max_trees
+      for owner, loaded in sorted(self.trees.items(), key=lambda item: item[1].loaded_at):
+        if excess <= 0 and now - loaded.loaded_at <= self.refresh_seconds:
+          break
+        stripe = self.stripe(owner)
+        if stripe.acquire(blocking=False):
+          del self.trees[owner]
+          stripe.release()
+          excess -= 1
+
+  # books [start, end) for all the owners under `token`, or raises BookingConflict if one of them has an
+  # overlapping booking. checking and booking happen under the owners' stripes, so when requests race for the
+  # same slot in a process only the first one gets it (the database's booking constraint settles races between
+  # processes)
+  def reserve(self, owners, start, end, token):
+    with self.locked(owners):
+      trees = [self.tree(owner) for owner in owners]
+      for owner, loaded in zip(owners, trees):
+        conflict = loaded.tree.find(start, end)
+        if conflict is None and start < loaded.since:
+          conflict = next((Interval(*row) for row in self.load(owner, start, end)), None)
+        if conflict is not None:
+          raise BookingConflict(owner, conflict)
+      for loaded in trees:
+        loaded.tree.add(start, end, token)
+
+  # re-keys a reserved booking once its show is saved
+  def confirm(self, owners, token, key):
+    with self.locked(owners):
+      for owner in owners:
+        loaded = self.trees.get(owner)
+        interval = loaded.tree.get(token) if loaded is not None else None
+        if interval is not None:
+          loaded.tree.remove(token)
+          loaded.tree.add(interval.start, interval.end, key)
+
+  # drops a reservation whose show wasn't saved
+  def release(self, owners, key):
+    with self.locked(owners):
+      for owner in owners:
+        loaded = self.trees.get(owner)
+        if loaded is not None:
+          loaded.tree.remove(key)
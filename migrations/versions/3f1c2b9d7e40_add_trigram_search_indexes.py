@@ -0,0 +1,33 @@
+"""add pg_trgm trigram indexes for venue and artist search
+
+Revision ID: 3f1c2b9d7e40
+Revises: ac6594a8e7f6
+Create Date: 2026-10-18 10:03:17.552901
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2b9d7e40'
+down_revision = 'ac6594a8e7f6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # GIN trigram indexes serve both the fuzzy `%` similarity operator and ILIKE '%term%' used by the search
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.create_index('ix_Venue_name_trgm', 'Venue', ['name'], unique=False, postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'})
+    op.create_index('ix_Venue_city_trgm', 'Venue', ['city'], unique=False, postgresql_using='gin', postgresql_ops={'city': 'gin_trgm_ops'})
+    op.create_index('ix_Artist_name_trgm', 'Artist', ['name'], unique=False, postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'})
+    op.create_index('ix_Artist_city_trgm', 'Artist', ['city'], unique=False, postgresql_using='gin', postgresql_ops={'city': 'gin_trgm_ops'})
+
+
+def downgrade():
+    op.drop_index('ix_Artist_city_trgm', table_name='Artist')
+    op.drop_index('ix_Artist_name_trgm', table_name='Artist')
+    op.drop_index('ix_Venue_city_trgm', table_name='Venue')
+    op.drop_index('ix_Venue_name_trgm', table_name='Venue')
+    # the extension is left installed, other database objects may depend on it
@@ -0,0 +1,30 @@
+"""add updated_at to venues, artists and shows for conditional GETs
+
+Revision ID: 6d2e8a41c3b7
+Revises: 3f1c2b9d7e40
+Create Date: 2026-10-18 14:05:12.503981
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6d2e8a41c3b7'
+down_revision = '3f1c2b9d7e40'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # existing rows start out as modified at migration time
+    for table in ('Venue', 'Artist', 'Show'):
+        op.add_column(table, sa.Column('updated_at', sa.DateTime(), server_default=sa.func.now(), nullable=False))
+        # max(updated_at) for the listing pages' Last-Modified
+        op.create_index('ix_{}_updated_at'.format(table), table, ['updated_at'], unique=False)
+
+
+def downgrade():
+    for table in ('Show', 'Artist', 'Venue'):
+        op.drop_index('ix_{}_updated_at'.format(table), table_name=table)
+        op.drop_column(table, 'updated_at')
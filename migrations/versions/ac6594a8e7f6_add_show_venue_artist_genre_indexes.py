@@ -0,0 +1,41 @@
+"""add indexes for show times, foreign keys, venue areas and genre lookups
+
+Revision ID: ac6594a8e7f6
+Revises: 5ed159c283c2
+Create Date: 2026-10-18 09:12:40.118274
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'ac6594a8e7f6'
+down_revision = '5ed159c283c2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # per-venue / per-artist show lookups filter on the foreign key plus a start_time range and sort by start_time
+    op.create_index('ix_Show_venue_id_start_time', 'Show', ['venue_id', 'start_time'], unique=False)
+    op.create_index('ix_Show_artist_id_start_time', 'Show', ['artist_id', 'start_time'], unique=False)
+    # /shows listing (past/upcoming range + keyset pagination on start_time, id)
+    op.create_index('ix_Show_start_time_id', 'Show', ['start_time', 'id'], unique=False)
+    # /venues directory (grouped by area, keyset paginated on state, city, name, id)
+    op.create_index('ix_Venue_state_city_name_id', 'Venue', ['state', 'city', 'name', 'id'], unique=False)
+    # /artists listing (keyset paginated on name, id)
+    op.create_index('ix_Artist_name_id', 'Artist', ['name', 'id'], unique=False)
+    # reverse lookups (genre -> artists / venues); the primary keys only cover (entity_id, genre_name)
+    op.create_index('ix_Artist_Genres_genre_name', 'Artist_Genres', ['genre_name'], unique=False)
+    op.create_index('ix_Venue_Genres_genre_name', 'Venue_Genres', ['genre_name'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_Venue_Genres_genre_name', table_name='Venue_Genres')
+    op.drop_index('ix_Artist_Genres_genre_name', table_name='Artist_Genres')
+    op.drop_index('ix_Artist_name_id', table_name='Artist')
+    op.drop_index('ix_Venue_state_city_name_id', table_name='Venue')
+    op.drop_index('ix_Show_start_time_id', table_name='Show')
+    op.drop_index('ix_Show_artist_id_start_time', table_name='Show')
+    op.drop_index('ix_Show_venue_id_start_time', table_name='Show')
@@ -0,0 +1,45 @@
+"""add upcoming/past show counters to venues and artists
+
+Revision ID: b7e3d9f2a614
+Revises: 6d2e8a41c3b7
+Create Date: 2026-10-18 21:02:37.118402
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e3d9f2a614'
+down_revision = '6d2e8a41c3b7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table in ('Venue', 'Artist'):
+        op.add_column(table, sa.Column('upcoming_show_count', sa.Integer(), server_default='0', nullable=False))
+        op.add_column(table, sa.Column('past_show_count', sa.Integer(), server_default='0', nullable=False))
+
+    op.create_table('Show_Rollover',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('rolled_over_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+    # count the existing shows as of now (see ShowRollover in models.py)
+    op.execute('INSERT INTO "Show_Rollover" (id, rolled_over_at) VALUES (1, now())')
+    for table, key in (('Venue', 'venue_id'), ('Artist', 'artist_id')):
+        op.execute(
+            'UPDATE "{table}" SET '
+            'upcoming_show_count = (SELECT count(*) FROM "Show" WHERE "Show".{key} = "{table}".id AND "Show".start_time > r.rolled_over_at), '
+            'past_show_count = (SELECT count(*) FROM "Show" WHERE "Show".{key} = "{table}".id AND "Show".start_time <= r.rolled_over_at) '
+            'FROM "Show_Rollover" r WHERE r.id = 1'.format(table=table, key=key)
+        )
+
+
+def downgrade():
+    op.drop_table('Show_Rollover')
+    for table in ('Artist', 'Venue'):
+        op.drop_column(table, 'past_show_count')
+        op.drop_column(table, 'upcoming_show_count')
@@ -0,0 +1,115 @@
+"""range partition Show by month of start_time
+
+Revision ID: c5f8a2d41e97
+Revises: b7e3d9f2a614
+Create Date: 2026-10-19 09:41:12.603115
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5f8a2d41e97'
+down_revision = 'b7e3d9f2a614'
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ('ix_Show_venue_id_start_time', ['venue_id', 'start_time']),
+    ('ix_Show_artist_id_start_time', ['artist_id', 'start_time']),
+    ('ix_Show_start_time_id', ['start_time', 'id']),
+    ('ix_Show_updated_at', ['updated_at']),
+]
+
+# month partitions are created up to this many months ahead, later ones by ./bin/show_partitions.py
+MONTHS_AHEAD = 12
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def upgrade():
+    # postgres only: other databases (sqlite for local runs and benchmarks) keep the plain table
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    connection = op.get_bind()
+
+    # the partition key has to be part of the primary key, so start_time can't be null anymore
+    nulls = connection.execute(sa.text('SELECT count(*) FROM "Show" WHERE start_time IS NULL')).scalar()
+    if nulls:
+        raise RuntimeError('{} shows have no start_time: set or delete them before partitioning Show'.format(nulls))
+
+    for name, _ in INDEXES:
+        op.drop_index(name, table_name='Show')
+    op.execute('ALTER TABLE "Show" RENAME TO "Show_unpartitioned"')
+    op.execute('ALTER TABLE "Show_unpartitioned" RENAME CONSTRAINT "Show_pkey" TO "Show_unpartitioned_pkey"')
+    sequence = connection.execute(sa.text("SELECT pg_get_serial_sequence('\"Show_unpartitioned\"', 'id')")).scalar()
+
+    op.execute(
+        'CREATE TABLE "Show" ('
+        '  id integer NOT NULL DEFAULT nextval(\'{sequence}\'::regclass),'
+        '  start_time timestamp without time zone NOT NULL,'
+        '  venue_id integer NOT NULL REFERENCES "Venue" (id),'
+        '  artist_id integer NOT NULL REFERENCES "Artist" (id),'
+        '  updated_at timestamp without time zone NOT NULL DEFAULT now(),'
+        '  CONSTRAINT "Show_pkey" PRIMARY KEY (id, start_time)'
+        ') PARTITION BY RANGE (start_time)'.format(sequence=sequence)
+    )
+    op.execute('ALTER SEQUENCE {} OWNED BY "Show".id'.format(sequence))
+    op.execute('CREATE TABLE "Show_default" PARTITION OF "Show" DEFAULT')
+
+    # one partition per month from the oldest show to MONTHS_AHEAD months from now
+    oldest = connection.execute(sa.text('SELECT min(start_time) FROM "Show_unpartitioned"')).scalar() or datetime.now()
+    month = datetime(oldest.year, oldest.month, 1)
+    last = add_months(datetime.now(), MONTHS_AHEAD)
+    while month <= last:
+        op.execute('CREATE TABLE "Show_y{:%Ym%m}" PARTITION OF "Show" FOR VALUES FROM (\'{:%Y-%m-%d}\') TO (\'{:%Y-%m-%d}\')'.format(
+            month, month, add_months(month, 1)))
+        month = add_months(month, 1)
+
+    op.execute(
+        'INSERT INTO "Show" (id, start_time, venue_id, artist_id, updated_at) '
+        'SELECT id, start_time, venue_id, artist_id, updated_at FROM "Show_unpartitioned"'
+    )
+    op.execute('DROP TABLE "Show_unpartitioned"')
+    # indexes on the partitioned table are created on every partition (and on the ones attached later)
+    for name, columns in INDEXES:
+        op.create_index(name, 'Show', columns, unique=False)
+    op.execute('ANALYZE "Show"')
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    connection = op.get_bind()
+
+    for name, _ in INDEXES:
+        op.drop_index(name, table_name='Show')
+    op.execute('ALTER TABLE "Show" RENAME TO "Show_partitioned"')
+    op.execute('ALTER TABLE "Show_partitioned" RENAME CONSTRAINT "Show_pkey" TO "Show_partitioned_pkey"')
+    sequence = connection.execute(sa.text("SELECT pg_get_serial_sequence('\"Show_partitioned\"', 'id')")).scalar()
+
+    op.execute(
+        'CREATE TABLE "Show" ('
+        '  id integer NOT NULL DEFAULT nextval(\'{sequence}\'::regclass),'
+        '  start_time timestamp without time zone,'
+        '  venue_id integer NOT NULL REFERENCES "Venue" (id),'
+        '  artist_id integer NOT NULL REFERENCES "Artist" (id),'
+        '  updated_at timestamp without time zone NOT NULL DEFAULT now(),'
+        '  CONSTRAINT "Show_pkey" PRIMARY KEY (id)'
+        ')'.format(sequence=sequence)
+    )
+    op.execute('ALTER SEQUENCE {} OWNED BY "Show".id'.format(sequence))
+    op.execute(
+        'INSERT INTO "Show" (id, start_time, venue_id, artist_id, updated_at) '
+        'SELECT id, start_time, venue_id, artist_id, updated_at FROM "Show_partitioned"'
+    )
+    # dropping the partitioned table drops its partitions
+    op.execute('DROP TABLE "Show_partitioned"')
+    for name, columns in INDEXES:
+        op.create_index(name, 'Show', columns, unique=False)
@@ -0,0 +1,102 @@
+"""add Show.end_time and the venue/artist booking constraints
+
+Revision ID: e4b9c1d7a352
+Revises: c5f8a2d41e97
+Create Date: 2026-10-19 14:26:51.380742
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4b9c1d7a352'
+down_revision = 'c5f8a2d41e97'
+branch_labels = None
+depends_on = None
+
+# existing shows book their venue and artist for this long (models.DEFAULT_SHOW_DURATION), and no show can book
+# them for longer than MAX_DURATION_HOURS (models.MAX_SHOW_DURATION)
+DEFAULT_DURATION_HOURS = 2
+MAX_DURATION_HOURS = 12
+
+OWNERS = ('venue_id', 'artist_id')
+
+
+def booking_tables(connection):
+    # exclusion constraints can't be declared on a partitioned table (the partitions don't share an index that
+    # could enforce them), so on a partitioned Show each partition gets its own. shows are checked against the
+    # shows in their month's partition: a show crossing midnight into the next month is only checked by the app
+    partitions = [name for (name,) in connection.execute(sa.text(
+        "SELECT child.relname FROM pg_inherits i "
+        "JOIN pg_class parent ON parent.oid = i.inhparent JOIN pg_class child ON child.oid = i.inhrelid "
+        "WHERE parent.relname = 'Show' ORDER BY child.relname"
+    ))]
+    return partitions or ['Show']
+
+
+# the database side of the booking check (the app checks with its interval trees first, see models.py): postgres
+# rejects overlapping [start_time, end_time) ranges of a venue's or an artist's shows with GiST exclusion
+# constraints, sqlite with a trigger (sqlite runs one write transaction at a time, so the trigger's check can't race)
+def create_booking_constraints():
+    connection = op.get_bind()
+    if connection.dialect.name == 'postgresql':
+        # (btree_gist for the = on the integer ids in a GiST index)
+        op.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+        for table in booking_tables(connection):
+            for owner in OWNERS:
+                op.execute(
+                    'ALTER TABLE "{table}" ADD CONSTRAINT "ex_{table}_{owner}_booking" '
+                    'EXCLUDE USING gist ({owner} WITH =, tsrange(start_time, end_time) WITH &&)'.format(table=table, owner=owner)
+                )
+    elif connection.dialect.name == 'sqlite':
+        # (an overlapping show starts at most MAX_DURATION_HOURS before the new one, which bounds the index scans)
+        overlapping = ' OR '.join(
+            'EXISTS (SELECT 1 FROM "Show" WHERE {owner} = NEW.{owner} '
+            "AND start_time > datetime(NEW.start_time, '-{hours} hours') AND start_time < NEW.end_time "
+            'AND end_time > NEW.start_time)'.format(owner=owner, hours=MAX_DURATION_HOURS) for owner in OWNERS
+        )
+        op.execute(
+            'CREATE TRIGGER "tr_Show_booking" BEFORE INSERT ON "Show" WHEN {} '
+            "BEGIN SELECT RAISE(ABORT, 'booking conflict: the venue or artist has an overlapping show'); END".format(overlapping)
+        )
+
+
+def drop_booking_constraints():
+    connection = op.get_bind()
+    if connection.dialect.name == 'postgresql':
+        for table in booking_tables(connection):
+            for owner in OWNERS:
+                op.execute('ALTER TABLE "{table}" DROP CONSTRAINT IF EXISTS "ex_{table}_{owner}_booking"'.format(table=table, owner=owner))
+    elif connection.dialect.name == 'sqlite':
+        op.execute('DROP TRIGGER IF EXISTS "tr_Show_booking"')
+
+
+def upgrade():
+    connection = op.get_bind()
+    op.add_column('Show', sa.Column('end_time', sa.DateTime(), nullable=True))
+    if connection.dialect.name == 'postgresql':
+        op.execute('UPDATE "Show" SET end_time = start_time + interval \'{} hours\''.format(DEFAULT_DURATION_HOURS))
+    else:
+        op.execute('UPDATE "Show" SET end_time = datetime(start_time, \'+{} hours\')'.format(DEFAULT_DURATION_HOURS))
+    with op.batch_alter_table('Show') as batch_op:
+        batch_op.alter_column('end_time', existing_type=sa.DateTime(), nullable=False)
+        batch_op.create_check_constraint('ck_Show_end_after_start', 'end_time > start_time')
+
+    # existing double bookings have to be sorted out by hand first
+    for owner in OWNERS:
+        overlaps = connection.execute(sa.text(
+            'SELECT count(*) FROM "Show" a JOIN "Show" b ON b.{owner} = a.{owner} AND b.id > a.id '
+            'AND b.start_time < a.end_time AND a.start_time < b.end_time'.format(owner=owner)
+        )).scalar()
+        if overlaps:
+            raise RuntimeError('{} pairs of shows with the same {} overlap: move or delete them before adding the booking constraints'.format(
+                overlaps, owner))
+    create_booking_constraints()
+
+
+def downgrade():
+    drop_booking_constraints()
+    with op.batch_alter_table('Show') as batch_op:
+        batch_op.drop_constraint('ck_Show_end_after_start', type_='check')
+        batch_op.drop_column('end_time')
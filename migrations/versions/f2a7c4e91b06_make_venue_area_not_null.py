@@ -0,0 +1,32 @@
+"""make Venue.state and Venue.city NOT NULL for the /venues keyset pagination
+
+Revision ID: f2a7c4e91b06
+Revises: e4b9c1d7a352
+Create Date: 2026-10-19 10:12:37.214508
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2a7c4e91b06'
+down_revision = 'e4b9c1d7a352'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the /venues pages seek past (state, city, name, id): a NULL in the row value never compares true, so a venue
+    # without a state or city would drop out of every page after the first. such venues move to the '' area
+    for column in ('state', 'city'):
+        op.execute('UPDATE "Venue" SET {column} = \'\' WHERE {column} IS NULL'.format(column=column))
+    with op.batch_alter_table('Venue') as batch_op:
+        for column in ('state', 'city'):
+            batch_op.alter_column(column, existing_type=sa.String(length=120), nullable=False, server_default='')
+
+
+def downgrade():
+    with op.batch_alter_table('Venue') as batch_op:
+        for column in ('state', 'city'):
+            batch_op.alter_column(column, existing_type=sa.String(length=120), nullable=True, server_default=None)
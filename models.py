@@ -1,9 +1,20 @@
+import time
+
 from enum import Enum
-from datetime import datetime
+from collections import Counter, defaultdict, namedtuple
+from datetime import datetime, timedelta
 
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.orm import joinedload, make_transient_to_detached, selectinload
 
 from app_config import db
+from facets import FacetIndex
+from intervals import BookingConflict, BookingIndex
+from pagination import Page, clamp_limit, paginate, paginate_filtered
+from partitions import add_months
+from search import NgramIndex, PrefixIndex, SEARCH_LIMIT, SIMILARITY_THRESHOLD, similarity, trigrams
+from view_models import ArtistDetail, ShowCard, VenueDetail
 
 #------------------------------------------------------------------------------------------
 # Models
@@ -35,23 +46,30 @@ class Genre_Choices(Enum):
 # Association Tables for Arits/Genres and Venue/Genres
 Artist_Genres = db.Table('Artist_Genres',
     db.Column('artist_id', db.Integer, db.ForeignKey("Artist.id"), primary_key=True),
-    db.Column('genre_name', db.Enum(Genre_Choices), db.ForeignKey('Genre.name'), primary_key=True)
+    db.Column('genre_name', db.Enum(Genre_Choices), db.ForeignKey('Genre.name'), primary_key=True),
+    db.Index('ix_Artist_Genres_genre_name', 'genre_name')
 )
 
 Venue_Genres = db.Table('Venue_Genres',
     db.Column('venue_id', db.Integer, db.ForeignKey("Venue.id"), primary_key=True),
-    db.Column('genre_name', db.Enum(Genre_Choices), db.ForeignKey('Genre.name'), primary_key=True)
+    db.Column('genre_name', db.Enum(Genre_Choices), db.ForeignKey('Genre.name'), primary_key=True),
+    db.Index('ix_Venue_Genres_genre_name', 'genre_name')
 )
 
 # Models
 class Venue(db.Model):
     __tablename__ = 'Venue'
+    __table_args__ = (
+        db.Index('ix_Venue_state_city_name_id', 'state', 'city', 'name', 'id'),
+        db.Index('ix_Venue_updated_at', 'updated_at'),
+    )
 
     # note: elected not to put uniqueness constraints on name as there may be multiple venues with same name in different locations
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String, nullable=False)
-    city = db.Column(db.String(120))
-    state = db.Column(db.String(120))
+    # (NOT NULL: they are keys of the /venues keyset pagination, see pagination.py)
+    city = db.Column(db.String(120), nullable=False, server_default='')
+    state = db.Column(db.String(120), nullable=False, server_default='')
     address = db.Column(db.String(120))
     phone = db.Column(db.String(120))
     image_link = db.Column(db.String(500))
@@ -60,29 +78,164 @@ class Venue(db.Model):
     website = db.Column(db.String(120), unique=True)
     seeking_talent = db.Column(db.Boolean, default=False)
     seeking_description = db.Column(db.String(500))
-    shows = db.relationship('Show', backref='venue', lazy=True)
+    # bumped by every write that changes what the venue's page shows (see the create/edit routes), for conditional GETs
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.now, server_default=db.func.now())
+    # number of shows before / after ShowRollover.rolled_over_at (see there), for the listings and searches
+    upcoming_show_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    past_show_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # (passive_deletes: deleting a venue doesn't load its shows, delete_venue only deletes venues without any)
+    shows = db.relationship('Show', backref='venue', lazy=True, passive_deletes=True)
     genres = db.relationship("Genre", secondary=Venue_Genres, backref=db.backref('venues', lazy=True))
 
     @classmethod
-    def search(cls, search_term):
-       return cls.query.filter(cls.name.ilike('%{}%'.format(search_term))).all()
+    def search(cls, search_term, limit=SEARCH_LIMIT):
+       return search_entities(cls, search_term, limit)
+
+    # helper method to build the /venues directory (areas -> venues with upcoming show counts)
+    # from a single query over the venues and their upcoming counters, instead of one query per area plus one per venue
+    @classmethod
+    def get_directory(cls):
+      ShowRollover.rollover()
+      rows = cls.directory_query().order_by(*cls.directory_keys()).all()
+      return cls.build_areas(rows)
+
+    # same as get_directory, but only one page of venues (keyset paginated on state, city, name, id
+    # so that each area stays contiguous within a page)
+    @classmethod
+    def get_directory_page(cls, after=None, before=None, limit=None):
+      ShowRollover.rollover()
+      page = paginate(cls.directory_query(), cls.directory_keys(), after, before, limit)
+      return page._replace(items=cls.build_areas(page.items))
+
+    # same as get_directory_page, narrowed down to the venues matching a FacetFilter, along with their facet
+    # counts (see get_faceted_page)
+    @classmethod
+    def get_faceted_directory_page(cls, facet_filter, after=None, before=None, limit=None):
+      ShowRollover.rollover()
+      page, counts = get_faceted_page(cls, facet_filter, cls.directory_query(), cls.directory_keys(), after, before, limit)
+      return page._replace(items=cls.build_areas(page.items)), counts
+
+    @classmethod
+    def directory_keys(cls):
+      return [cls.state, cls.city, cls.name, cls.id]
 
-    # helper method to get shows for a particular venue
+    # (the upcoming counts are only current right after ShowRollover.rollover())
+    @classmethod
+    def directory_query(cls):
+      return db.session.query(cls.city, cls.state, cls.id, cls.name, cls.upcoming_show_count.label('num_upcoming_shows'))
+
+    # rows come back ordered by area, so each area is contiguous and can be built in one pass
+    @classmethod
+    def build_areas(cls, rows):
+      areas = []
+      for row in rows:
+        if not areas or areas[-1]['city'] != row.city or areas[-1]['state'] != row.state:
+          areas.append({"city": row.city, "state": row.state, "venues": []})
+        areas[-1]['venues'].append({"id": row.id, "name": row.name, "num_upcoming_shows": row.num_upcoming_shows})
+
+      return areas
+
+    # helper method to get shows for a particular venue (as ShowCards, oldest first)
     def get_shows(self, when='all'):
-      query = db.session.query(Show, Artist).join(Artist, Artist.id == Show.artist_id)
-      if when == 'upcoming':
-        shows = query.filter(Show.venue_id == self.id, Show.start_time > datetime.now()).order_by(Show.start_time).all()
-      if when == 'past':
-        shows =query.filter(Show.venue_id == self.id, Show.start_time <= datetime.now()).order_by(Show.start_time).all()
-      if when == 'all':
-        shows = query.filter(Show.venue_id == self.id).order_by(Show.start_time).all()
-      
-      shows = Show.unpack_tuples(shows) # convert from tuple to splatted dicts 
-      shows = Show.datetimes_to_strings(shows) # does what it says on the tin
-      return shows
+      return [ShowCard.from_row(row) for row in self.shows_query(self.id, when)]
+
+    # helper method to get past and upcoming shows for the venue page in one query (see Show.partition)
+    @classmethod
+    def get_shows_partitioned(cls, venue_id):
+      return Show.partition([ShowCard.from_row(row) for row in cls.shows_query(venue_id)])
+
+    @classmethod
+    def shows_query(cls, venue_id, when='all'):
+      query = db.session.query(
+          Show.id,
+          Show.artist_id,
+          Artist.name.label('artist_name'),
+          Artist.image_link.label('artist_image_link'),
+          Show.start_time
+        ) \
+        .join(Artist, Artist.id == Show.artist_id) \
+        .filter(Show.venue_id == venue_id)
+      return Show.filter_when(query, when).order_by(Show.start_time, Show.id)
+
+    # helper method for the venue's calendar: its name and its shows in the month starting at `month`, by day
+    # (None if there is no such venue)
+    @classmethod
+    def get_calendar(cls, venue_id, month):
+      venue = db.session.query(cls.id, cls.name).filter(cls.id == venue_id).first()
+      if venue is None:
+        return None
+
+      days = defaultdict(list)
+      for row in Show.filter_range(cls.shows_query(venue_id), month, add_months(month, 1)):
+        days[row.start_time.date()].append(ShowCard.from_row(row))
+      return venue, days
+
+    # helper method to load everything the venue page shows (None if there is no such venue)
+    @classmethod
+    def get_detail(cls, venue_id):
+      row = db.session.query(*[getattr(cls, column) for column in VenueDetail.columns]).filter(cls.id == venue_id).first()
+      if row is None:
+        return None
+
+      genres = db.session.query(Venue_Genres.c.genre_name).filter(Venue_Genres.c.venue_id == venue_id).all()
+      shows = cls.get_shows_partitioned(venue_id)
+      return VenueDetail.from_row(row,
+        genres=[genre.value for (genre,) in genres],
+        past_shows=shows.past,
+        upcoming_shows=shows.upcoming,
+        past_shows_count=shows.past_count,
+        upcoming_shows_count=shows.upcoming_count
+      )
+
+    # when the venue page last changed: the venue's last write or the start of its latest past show, in one
+    # primary key lookup plus one probe of ix_Show_venue_id_start_time (None if there is no such venue)
+    @classmethod
+    def get_last_modified(cls, venue_id):
+      last_started = db.session.query(db.func.max(Show.start_time)) \
+        .filter(Show.venue_id == cls.id, Show.start_time <= datetime.now()) \
+        .scalar_subquery()
+      row = db.session.query(cls.updated_at, last_started).filter(cls.id == venue_id).first()
+      return latest(*row) if row else None
+
+    # version of the /venues directory: last write to any venue or show, start of the latest past show
+    # (the upcoming counts change then) and the number of venues (the only way to notice a deleted one)
+    @classmethod
+    def get_directory_version(cls):
+      last_modified, last_show_modified, last_started, count = db.session.query(
+        db.session.query(db.func.max(cls.updated_at)).scalar_subquery(),
+        db.session.query(db.func.max(Show.updated_at)).scalar_subquery(),
+        db.session.query(db.func.max(Show.start_time)).filter(Show.start_time <= datetime.now()).scalar_subquery(),
+        db.session.query(db.func.count(cls.id)).scalar_subquery()
+      ).one()
+      return latest(last_modified, last_show_modified, last_started), count
+
+    # (state, city) of the venue, for the cache tag of its area on /venues
+    @classmethod
+    def get_area(cls, venue_id):
+      return db.session.query(cls.state, cls.city).filter(cls.id == venue_id).one()
+
+    # the distinct (state, city) areas of the given venues
+    @classmethod
+    def get_areas(cls, venue_ids):
+      return db.session.query(cls.state, cls.city).filter(cls.id.in_(set(venue_ids))).distinct().all()
+
+    # the ones of the given ids that are venues' (for the bulk import's shows)
+    @classmethod
+    def get_existing_ids(cls, venue_ids):
+      return [venue_id for (venue_id,) in db.session.query(cls.id).filter(cls.id.in_(set(venue_ids)))]
+
+    # bumps updated_at on the given venues, e.g. when an artist playing there is renamed
+    @classmethod
+    def touch(cls, venue_ids):
+      if venue_ids:
+        cls.query.filter(cls.id.in_(venue_ids)).update({ cls.updated_at: datetime.now() }, synchronize_session=False)
 
 class Artist(db.Model):
     __tablename__ = 'Artist'
+    __table_args__ = (
+        db.Index('ix_Artist_name_id', 'name', 'id'),
+        db.Index('ix_Artist_updated_at', 'updated_at'),
+    )
 
     # note: elected not to put uniqueness constraints on name as there can be multiple bands with same name in different locations
     id = db.Column(db.Integer, primary_key=True)
@@ -96,76 +249,652 @@ class Artist(db.Model):
     website = db.Column(db.String(120), unique=True)
     seeking_venue = db.Column(db.Boolean, default=False)
     seeking_description = db.Column(db.String(500))
+    # bumped by every write that changes what the artist's page shows (see the create/edit routes), for conditional GETs
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.now, server_default=db.func.now())
+    # number of shows before / after ShowRollover.rolled_over_at (see there), for the searches
+    upcoming_show_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    past_show_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     shows = db.relationship("Show", backref='artist', lazy=True)
     genres = db.relationship("Genre", secondary=Artist_Genres, backref=db.backref('artists', lazy=True))
 
     @classmethod
-    def search(cls, search_term):
-       return cls.query.filter(cls.name.ilike('%{}%'.format(search_term))).all()
+    def search(cls, search_term, limit=SEARCH_LIMIT):
+       return search_entities(cls, search_term, limit)
 
-    # helper method to get past or upcoming shows for a particular artist
+    # helper method to get one page of the /artists listing (keyset paginated on name, id)
+    @classmethod
+    def get_listing_page(cls, after=None, before=None, limit=None):
+      query = db.session.query(cls.id, cls.name)
+      return paginate(query, [cls.name, cls.id], after, before, limit)
+
+    # same as get_listing_page, narrowed down to the artists matching a FacetFilter, along with their facet
+    # counts (see get_faceted_page)
+    @classmethod
+    def get_faceted_listing_page(cls, facet_filter, after=None, before=None, limit=None):
+      query = db.session.query(cls.id, cls.name)
+      return get_faceted_page(cls, facet_filter, query, [cls.name, cls.id], after, before, limit)
+
+    # helper method to get past or upcoming shows for a particular artist (as ShowCards, oldest first)
     def get_shows(self, when='all'):
-      query = db.session.query(Show, Venue).join(Venue, Venue.id == Show.venue_id)
-      if when == 'upcoming':
-        shows = query.filter(Show.artist_id == self.id, Show.start_time > datetime.now()).order_by(Show.start_time).all()
-      if when == 'past':
-        shows = query.filter(Show.artist_id == self.id, Show.start_time <= datetime.now()).order_by(Show.start_time).all()
-      if when == 'all':
-        shows = query.filter(Show.artist_id == self.id).order_by(Show.start_time).all()
-      
-      shows = Show.unpack_tuples(shows) # convert tuples to splatted dicts 
-      shows = Show.datetimes_to_strings(shows) # does what it says on the tin
+      return [ShowCard.from_row(row) for row in self.shows_query(self.id, when)]
+
+    # helper method to get past and upcoming shows for the artist page in one query (see Show.partition)
+    @classmethod
+    def get_shows_partitioned(cls, artist_id):
+      return Show.partition([ShowCard.from_row(row) for row in cls.shows_query(artist_id)])
+
+    @classmethod
+    def shows_query(cls, artist_id, when='all'):
+      query = db.session.query(
+          Show.id,
+          Show.venue_id,
+          Venue.name.label('venue_name'),
+          Venue.image_link.label('venue_image_link'),
+          Show.start_time
+        ) \
+        .join(Venue, Venue.id == Show.venue_id) \
+        .filter(Show.artist_id == artist_id)
+      return Show.filter_when(query, when).order_by(Show.start_time, Show.id)
+
+    # helper method to load everything the artist page shows (None if there is no such artist)
+    @classmethod
+    def get_detail(cls, artist_id):
+      row = db.session.query(*[getattr(cls, column) for column in ArtistDetail.columns]).filter(cls.id == artist_id).first()
+      if row is None:
+        return None
+
+      genres = db.session.query(Artist_Genres.c.genre_name).filter(Artist_Genres.c.artist_id == artist_id).all()
+      shows = cls.get_shows_partitioned(artist_id)
+      return ArtistDetail.from_row(row,
+        genres=[genre.value for (genre,) in genres],
+        past_shows=shows.past,
+        upcoming_shows=shows.upcoming,
+        past_shows_count=shows.past_count,
+        upcoming_shows_count=shows.upcoming_count
+      )
+
+    # when the artist page last changed: the artist's last write or the start of its latest past show, in one
+    # primary key lookup plus one probe of ix_Show_artist_id_start_time (None if there is no such artist)
+    @classmethod
+    def get_last_modified(cls, artist_id):
+      last_started = db.session.query(db.func.max(Show.start_time)) \
+        .filter(Show.artist_id == cls.id, Show.start_time <= datetime.now()) \
+        .scalar_subquery()
+      row = db.session.query(cls.updated_at, last_started).filter(cls.id == artist_id).first()
+      return latest(*row) if row else None
+
+    # when the /artists listing (names only) last changed
+    @classmethod
+    def get_listing_last_modified(cls):
+      return db.session.query(db.func.max(cls.updated_at)).scalar()
+
+    # the ones of the given ids that are artists' (for the bulk import's shows)
+    @classmethod
+    def get_existing_ids(cls, artist_ids):
+      return [artist_id for (artist_id,) in db.session.query(cls.id).filter(cls.id.in_(set(artist_ids)))]
+
+    # bumps updated_at on the given artists, e.g. when a venue they play at is renamed
+    @classmethod
+    def touch(cls, artist_ids):
+      if artist_ids:
+        cls.query.filter(cls.id.in_(artist_ids)).update({ cls.updated_at: datetime.now() }, synchronize_session=False)
 
-      return shows
-      
 
 # COMPLETED Implement Show and Artist models, and complete all model relationships and properties, as a database migration.
 
+# latest of the given datetimes, ignoring missing ones
+def latest(*values):
+  values = [value for value in values if value is not None]
+  return max(values) if values else None
+
+# past and upcoming shows for a venue or artist page
+ShowPartition = namedtuple('ShowPartition', ['past', 'upcoming', 'past_count', 'upcoming_count'])
+
+# how long a show books its venue and artist when no duration is given, and the longest it can book them for
+# (which bounds how far back an overlapping show can start, see load_bookings)
+DEFAULT_SHOW_DURATION = timedelta(hours=2)
+MAX_SHOW_DURATION = timedelta(hours=12)
+
+def default_end_time(context):
+  return context.get_current_parameters()['start_time'] + DEFAULT_SHOW_DURATION
+
 class Show(db.Model):
     __tablename__ = 'Show'
+    __table_args__ = (
+        db.Index('ix_Show_venue_id_start_time', 'venue_id', 'start_time'),
+        db.Index('ix_Show_artist_id_start_time', 'artist_id', 'start_time'),
+        db.Index('ix_Show_start_time_id', 'start_time', 'id'),
+        db.Index('ix_Show_updated_at', 'updated_at'),
+        db.CheckConstraint('end_time > start_time', name='ck_Show_end_after_start'),
+    )
     id = db.Column(db.Integer, primary_key=True)
-    start_time = db.Column(db.DateTime)
+    # on postgres the table is partitioned by month of start_time, see partitions.py
+    start_time = db.Column(db.DateTime, nullable=False)
+    # a venue / an artist can't have overlapping shows: checked with the interval trees below (see Bookings) and
+    # enforced by the database's booking constraints (migration e4b9c1d7a352)
+    end_time = db.Column(db.DateTime, nullable=False, default=default_end_time)
     venue_id = db.Column(db.Integer, db.ForeignKey("Venue.id"), nullable=False)
     artist_id = db.Column(db.Integer, db.ForeignKey("Artist.id"), nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.now, server_default=db.func.now())
+
+    # helper method to split shows (ordered by start_time) into past and upcoming against a single "now".
+    # the past shows are a prefix of the list, so one pass finds the split point and that gives both counts
+    @classmethod
+    def partition(cls, shows, now=None):
+      now = now or datetime.now()
+      split = 0
+      for show in shows:
+        if show.start_time > now:
+          break
+        split += 1
+      return ShowPartition(shows[:split], shows[split:], split, len(shows) - split)
+
+    # helper method to narrow a show query down to past or upcoming shows ('all' leaves it as is)
+    @classmethod
+    def filter_when(cls, query, when='all'):
+      if when == 'upcoming':
+        return query.filter(cls.start_time > datetime.now())
+      if when == 'past':
+        return query.filter(cls.start_time <= datetime.now())
+      return query
 
-    # helper method to unpack tuple search results into splatted dicts with info about a show
+    # ?from= / ?to= values (ISO 8601 dates or date-times, either can be empty) -> (start, end) for filter_range.
+    # a `to` date includes that whole day. raises ValueError for anything else
     @classmethod
-    def unpack_tuples(cls, show_tuples):
-      return [{ **vars(_tuple[0]), **vars(_tuple[1]) } for _tuple in show_tuples]
+    def parse_range(cls, start=None, end=None):
+      start = datetime.fromisoformat(start) if start else None
+      if end:
+        end = datetime.fromisoformat(end) + (timedelta(days=1) if len(end) == 10 else timedelta(0))
+      return start, end or None
 
-    # helper method to donvert show.start_time from datetime object to tstring
+    # helper method to narrow a show query down to the shows starting from `start` up to (not including) `end`,
+    # either of which can be None. on postgres only the month partitions of the range are read
     @classmethod
-    def datetimes_to_strings(cls, shows):
-      converted_shows = shows
-      for show in converted_shows:
-        show['start_time'] = show['start_time'].strftime('%Y-%m-%d %H:%M:%S')
-      return converted_shows
+    def filter_range(cls, query, start=None, end=None):
+      if start is not None:
+        query = query.filter(cls.start_time >= start)
+      if end is not None:
+        query = query.filter(cls.start_time < end)
+      return query
 
+    # helper method to get the show listings in one joined query, selecting only the columns
+    # the listings need (as ShowCards, e.g. show.venue_name, show.artist_image_link)
     @classmethod
     def get_shows(cls, when='all'):
-      query = cls.query
-      if when == 'upcoming':
-        shows = query.filter(cls.start_time > datetime.now()).order_by(cls.start_time).all()
-      if when == 'past':
-        shows =query.filter(cls.start_time <= datetime.now()).order_by(cls.start_time).all()
-      if when == 'all':
-        shows = query.order_by(cls.start_time).all()
+      return [ShowCard.from_row(row) for row in cls.listing_query(when).order_by(cls.start_time, cls.id)]
+
+    # same as get_shows, but only one page of shows (keyset paginated on start_time, id)
+    @classmethod
+    def get_shows_page(cls, when='all', after=None, before=None, limit=None, start=None, end=None):
+      query = cls.filter_range(cls.listing_query(when), start, end)
+      page = paginate(query, [cls.start_time, cls.id], after, before, limit)
+      return page._replace(items=[ShowCard.from_row(row) for row in page.items])
+
+    @classmethod
+    def listing_query(cls, when='all'):
+      query = db.session.query(
+          cls.id,
+          cls.venue_id,
+          Venue.name.label('venue_name'),
+          cls.artist_id,
+          Artist.name.label('artist_name'),
+          Artist.image_link.label('artist_image_link'),
+          cls.start_time
+        ) \
+        .select_from(cls) \
+        .join(Venue, Venue.id == cls.venue_id) \
+        .join(Artist, Artist.id == cls.artist_id)
+
+      return cls.filter_when(query, when)
+
+    # when the /shows listing last changed: a new show, or a rename of one of the venues / artists it lists
+    @classmethod
+    def get_listing_last_modified(cls):
+      return latest(*db.session.query(
+        db.session.query(db.func.max(cls.updated_at)).scalar_subquery(),
+        db.session.query(db.func.max(Venue.updated_at)).scalar_subquery(),
+        db.session.query(db.func.max(Artist.updated_at)).scalar_subquery()
+      ).one())
 
-      show_info = []
+    # start time of the next upcoming show, i.e. when the upcoming counts change next (None if there is none)
+    @classmethod
+    def get_next_start_time(cls):
+      return db.session.query(db.func.min(cls.start_time)).filter(cls.start_time > datetime.now()).scalar()
+
+    # counts new shows into their venues' and artists' upcoming/past counters and bumps their updated_at, in the
+    # transaction that adds the shows. the rollover row stays locked until that commits, so a concurrent rollover
+    # can't move its window past a show it didn't see. one executemany update per counter, however many shows
+    # (the bulk import counts thousands at a time)
+    @classmethod
+    def count_new(cls, shows):
+      rolled_over_at = ShowRollover.get_rolled_over_at(for_update=True)
+      counts = Counter()
       for show in shows:
-        venue = Venue.query.get(show.venue_id)
-        artist = Artist.query.get(show.artist_id)
-        show_info.append({
-                          'venue_id': venue.id, 
-                          'venue_name': venue.name, 
-                          'artist_id': artist.id, 
-                          'artist_name': artist.name, 
-                          'artist_image_link': artist.image_link, 
-                          'start_time': show.start_time.strftime('%Y-%m-%d %H:%M:%S')
-                          })
-        
-      return show_info
+        column = 'upcoming_show_count' if show.start_time > rolled_over_at else 'past_show_count'
+        counts[(Venue, column, show.venue_id)] += 1
+        counts[(Artist, column, show.artist_id)] += 1
+
+      updates = defaultdict(list)
+      for (model, column, entity_id), count in counts.items():
+        updates[(model, column)].append({ 'entity_id': entity_id, 'count': count })
+      now = datetime.now()
+      for (model, column), params in updates.items():
+        table = model.__table__
+        db.session.execute(
+          table.update().where(table.c.id == db.bindparam('entity_id'))
+            .values({ column: table.c[column] + db.bindparam('count'), 'updated_at': now }),
+          params
+        )
+
+    # helper methods to find whose pages list a venue's / an artist's shows
+    @classmethod
+    def get_artist_ids(cls, venue_id):
+      return [artist_id for (artist_id,) in db.session.query(cls.artist_id).filter(cls.venue_id == venue_id).distinct()]
+
+    @classmethod
+    def get_venue_ids(cls, artist_id):
+      return [venue_id for (venue_id,) in db.session.query(cls.venue_id).filter(cls.artist_id == artist_id).distinct()]
+
+    # whether a venue has any shows (their venue_id is NOT NULL, so a venue with shows can't be deleted)
+    @classmethod
+    def venue_has_shows(cls, venue_id):
+      return db.session.query(db.exists().where(cls.venue_id == venue_id)).scalar()
+
+# Venue / Artist .upcoming_show_count and .past_show_count count the shows after / up to rolled_over_at, so the
+# listings and searches read them instead of counting shows. as shows start, rollover() moves them from upcoming
+# to past: one grouped count over the shows that started since rolled_over_at (a short range of ix_Show_start_time_id)
+# and an update per venue/artist that had one. it runs before the counters are read (and costs one query when there
+# is nothing to move), bin/check_show_counters.py checks the counters against the shows
+class ShowRollover(db.Model):
+    __tablename__ = 'Show_Rollover'
+    id = db.Column(db.Integer, primary_key=True)
+    rolled_over_at = db.Column(db.DateTime, nullable=False)
+
+    @classmethod
+    def get_rolled_over_at(cls, for_update=False):
+      query = db.session.query(cls.rolled_over_at).filter(cls.id == 1)
+      if for_update:
+        query = query.with_for_update()
+      rolled_over_at = query.scalar()
+      # a database created without the migration (db.create_all) starts from a full count
+      return rolled_over_at if rolled_over_at is not None else cls.recount()
+
+    # moves the shows that started since the last rollover to the past counts; commits (or rolls back) on its own
+    @classmethod
+    def rollover(cls, now=None):
+      now = now or datetime.now()
+      next_start = db.session.query(db.func.min(Show.start_time)) \
+        .filter(Show.start_time > cls.rolled_over_at) \
+        .scalar_subquery()
+      state = db.session.query(cls.rolled_over_at, next_start).filter(cls.id == 1).first()
+      if state is None:
+        cls.recount(now)
+        db.session.commit()
+        return
+      rolled_over_at, next_start = state
+      if next_start is None or next_start > now:
+        return
+
+      # claim the window (rolled_over_at, now]; a worker that loses the race leaves it to the winner
+      claimed = cls.query.filter(cls.id == 1, cls.rolled_over_at == rolled_over_at) \
+        .update({ cls.rolled_over_at: now }, synchronize_session=False)
+      if not claimed:
+        db.session.rollback()
+        return
+      for model, key in ((Venue, Show.venue_id), (Artist, Show.artist_id)):
+        started = db.session.query(key, db.func.count(Show.id)) \
+          .filter(Show.start_time > rolled_over_at, Show.start_time <= now) \
+          .group_by(key)
+        for entity_id, count in started:
+          model.query.filter(model.id == entity_id).update({
+            model.upcoming_show_count: model.upcoming_show_count - count,
+            model.past_show_count: model.past_show_count + count
+          }, synchronize_session=False)
+      db.session.commit()
+
+    # recomputes every counter from the shows as of `now` (for bulk loads, and to repair them); doesn't commit
+    @classmethod
+    def recount(cls, now=None):
+      now = now or datetime.now()
+      for model, key in ((Venue, Show.venue_id), (Artist, Show.artist_id)):
+        upcoming = db.session.query(db.func.count(Show.id)).filter(key == model.id, Show.start_time > now).scalar_subquery()
+        past = db.session.query(db.func.count(Show.id)).filter(key == model.id, Show.start_time <= now).scalar_subquery()
+        model.query.update({ model.upcoming_show_count: upcoming, model.past_show_count: past }, synchronize_session=False)
+      if not cls.query.filter(cls.id == 1).update({ cls.rolled_over_at: now }, synchronize_session=False):
+        db.session.add(cls(id=1, rolled_over_at=now))
+        db.session.flush()
+      return now
+
+    # venues / artists whose counters don't match their shows: [(model name, id, (upcoming, past) stored, counted)]
+    @classmethod
+    def check(cls):
+      rolled_over_at = cls.get_rolled_over_at()
+      mismatches = []
+      for model, key in ((Venue, Show.venue_id), (Artist, Show.artist_id)):
+        upcoming = db.func.count(Show.id).filter(Show.start_time > rolled_over_at)
+        past = db.func.count(Show.id).filter(Show.start_time <= rolled_over_at)
+        rows = db.session.query(model.id, model.upcoming_show_count, model.past_show_count, upcoming, past) \
+          .outerjoin(Show, key == model.id) \
+          .group_by(model.id, model.upcoming_show_count, model.past_show_count)
+        for entity_id, stored_upcoming, stored_past, counted_upcoming, counted_past in rows:
+          if (stored_upcoming, stored_past) != (counted_upcoming, counted_past):
+            mismatches.append((model.__name__, entity_id, (stored_upcoming, stored_past), (counted_upcoming, counted_past)))
+      return mismatches
 
 class Genre(db.Model):
      __tablename__ = 'Genre'
-     name = db.Column(db.Enum(Genre_Choices), primary_key=True)
\ No newline at end of file
+     name = db.Column(db.Enum(Genre_Choices), primary_key=True)
+
+     # helper method to turn genre names (e.g. from the genres form field) into Genre instances attached to
+     # the current session without a query per genre: merge(load=False) never goes to the database
+     @classmethod
+     def get_genres(cls, names):
+       return [db.session.merge(genre_registry[name], load=False) for name in names]
+
+# the Genre rows are fixed by Genre_Choices (bin/configure_db.py adds one per choice), so this is a
+# process-wide registry of detached instances, keyed by choice name like the form values are
+genre_registry = {}
+for choice in Genre_Choices:
+  genre_registry[choice.name] = Genre(name=choice)
+  make_transient_to_detached(genre_registry[choice.name])
+
+#------------------------------------------------------------------------------------------
+# Loader options
+#-------------------------------------------------------------------------------------------
+
+# the pages and the api read through the view models and column queries above, so the only routes that touch a
+# relationship are the ones working on the model itself. each names how it loads them here (nothing is lazy loaded
+# in a request, see LAZY_LOAD_POLICY):
+#  - the edit forms list the genres: selectinload, one more query for the genres of the one venue/artist
+#  - the edit submissions replace the genres, which needs the old ones: joinedload, so the venue/artist and its
+#    genres come back in one query, both here and when it is refreshed after the commit
+#  - deleting a venue removes its genre links
+LOADER_OPTIONS = {
+  'venue_form': (selectinload(Venue.genres),),
+  'venue_edit': (joinedload(Venue.genres),),
+  'venue_delete': (selectinload(Venue.genres),),
+  'artist_form': (selectinload(Artist.genres),),
+  'artist_edit': (joinedload(Artist.genres),),
+}
+
+#------------------------------------------------------------------------------------------
+# Search
+#-------------------------------------------------------------------------------------------
+
+# ranked fuzzy search over name, city, state and genre for Venue and Artist (see search.py)
+def search_entities(model, search_term, limit=SEARCH_LIMIT):
+    term = search_term.strip()
+    if not term:
+      return model.query.order_by(model.name, model.id).limit(limit).all()
+
+    if db.engine.dialect.name == 'postgresql':
+      return trigram_search(model, term, limit)
+
+    ids = [doc_id for doc_id, _ in fallback_search_index(model).search(term, limit)]
+    entities = {entity.id: entity for entity in model.query.filter(model.id.in_(ids))}
+    return [entities[doc_id] for doc_id in ids if doc_id in entities]
+
+# genres whose name contains or is similar to the search term, with their similarity
+def matching_genres(term):
+    term_grams = trigrams(term)
+    genres = {}
+    for choice in Genre_Choices:
+      score = similarity(term_grams, trigrams(choice.value))
+      if score >= SIMILARITY_THRESHOLD or term.lower() in choice.value.lower():
+        genres[choice] = score
+    return genres
+
+def trigram_search(model, term, limit):
+    pattern = '%{}%'.format(term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_'))
+    state_match = db.func.upper(model.state) == term.upper()
+
+    # ILIKE and `%` (similarity above pg_trgm.similarity_threshold) are both answered by the trigram GIN indexes
+    conditions = [
+      model.name.ilike(pattern, escape='\\'),
+      model.name.op('%')(term),
+      model.city.ilike(pattern, escape='\\'),
+      model.city.op('%')(term),
+      state_match
+    ]
+    scores = [
+      db.func.similarity(model.name, term),
+      db.func.similarity(model.city, term),
+      db.case((state_match, 1.0), else_=0.0)
+    ]
+
+    genres = matching_genres(term)
+    if genres:
+      genre_match = model.genres.any(Genre.name.in_(list(genres)))
+      conditions.append(genre_match)
+      scores.append(db.case((genre_match, max(genres.values())), else_=0.0))
+
+    return model.query \
+      .filter(db.or_(*conditions)) \
+      .order_by(db.func.greatest(*scores).desc(), model.id) \
+      .limit(limit) \
+      .all()
+
+# pure python stand-in for the trigram indexes on databases without pg_trgm (e.g. sqlite).
+# built on first search and dropped whenever a venue/artist is written through the ORM
+# (bulk inserts that bypass the ORM should call fallback_search_indexes.clear())
+fallback_search_indexes = {}
+
+def fallback_search_index(model):
+    index = fallback_search_indexes.get(model)
+    if index is None:
+      genres = defaultdict(list)
+      for entity_id, genre in db.session.query(model.id, Genre.name).join(model.genres):
+        genres[entity_id].append(genre.value)
+
+      index = NgramIndex()
+      for entity_id, name, city, state in db.session.query(model.id, model.name, model.city, model.state):
+        index.add(entity_id, name, city, state, *genres[entity_id])
+      fallback_search_indexes[model] = index
+    return index
+
+def drop_fallback_search_index(mapper, connection, target):
+    fallback_search_indexes.pop(type(target), None)
+
+for searchable_model in (Venue, Artist):
+    for event_name in ('after_insert', 'after_update', 'after_delete'):
+      event.listen(searchable_model, event_name, drop_fallback_search_index)
+
+
+#------------------------------------------------------------------------------------------
+# Autocomplete
+#-------------------------------------------------------------------------------------------
+
+# every venue and artist name, for /api/autocomplete. loaded on first use, then kept current by the
+# create/edit/delete routes in this process and reloaded every AUTOCOMPLETE_REFRESH_SECONDS to pick up
+# writes handled by other worker processes
+AUTOCOMPLETE_REFRESH_SECONDS = 300
+
+autocomplete_index = PrefixIndex()
+
+def get_autocomplete_index():
+    loaded_at = autocomplete_index.loaded_at
+    if loaded_at is None or time.time() - loaded_at > AUTOCOMPLETE_REFRESH_SECONDS:
+      names = [('venue', venue_id, name) for venue_id, name in db.session.query(Venue.id, Venue.name)]
+      names += [('artist', artist_id, name) for artist_id, name in db.session.query(Artist.id, Artist.name)]
+      autocomplete_index.load(names)
+    return autocomplete_index
+
+
+#------------------------------------------------------------------------------------------
+# Facets
+#-------------------------------------------------------------------------------------------
+
+# genre / area / seeking bitmaps of every venue and artist (see facets.py), for the filtered /venues and /artists
+# listings. loaded on first use, then kept current by the create/edit/delete routes in this process and reloaded
+# every FACET_REFRESH_SECONDS to pick up writes handled by other worker processes
+FACET_REFRESH_SECONDS = 300
+
+# up to this many matches, a page is looked up by id. above it, the listing is read in order (in chunks of up to
+# FACET_MAX_CHUNK rows) and the rows are checked against the matches, which is cheaper than a huge IN list
+FACET_IN_LIMIT = 5000
+FACET_MAX_CHUNK = 20000
+
+facet_indexes = { Venue: FacetIndex(), Artist: FacetIndex() }
+
+# (genre link column, seeking flag) of each model
+facet_columns = {
+  Venue: (Venue_Genres.c.venue_id, Venue.seeking_talent),
+  Artist: (Artist_Genres.c.artist_id, Artist.seeking_venue),
+}
+
+# genres are Genre_Choices names, like the form values
+def facet_keys(genres, state, city, seeking):
+    keys = [('genre', genre) for genre in genres]
+    if state:
+      keys.append(('state', state))
+      if city:
+        keys.append(('city', state, city))
+    if seeking:
+      keys.append(('seeking',))
+    return keys
+
+def get_facet_index(model):
+    index = facet_indexes[model]
+    loaded_at = index.loaded_at
+    if loaded_at is None or time.time() - loaded_at > FACET_REFRESH_SECONDS:
+      link_column, seeking_column = facet_columns[model]
+      genre_column = link_column.table.c.genre_name
+      def pairs():
+        for entity_id, state, city, seeking in db.session.query(model.id, model.state, model.city, seeking_column):
+          yield entity_id, None
+          for key in facet_keys((), state, city, seeking):
+            yield entity_id, key
+        for entity_id, genre in db.session.query(link_column, genre_column):
+          yield entity_id, ('genre', genre.name)
+      index.load(pairs())
+    return index
+
+# after a write to a venue/artist (genres: its Genre_Choices names), if this process has its index loaded
+def update_facets(entity, genres):
+    model = type(entity)
+    if facet_indexes[model].loaded_at is not None:
+      seeking_column = facet_columns[model][1]
+      facet_indexes[model].add(entity.id, facet_keys(genres, entity.state, entity.city, getattr(entity, seeking_column.key)))
+
+def remove_facets(model, entity_id):
+    facet_indexes[model].remove(entity_id)
+
+# bitset of the entities matching a FacetFilter
+def facet_match(index, facet_filter):
+    all_of = []
+    any_of = []
+    genre_keys = [('genre', genre) for genre in facet_filter.genres]
+    if facet_filter.match == 'all':
+      all_of += genre_keys
+    elif genre_keys:
+      any_of.append(genre_keys)
+
+    if facet_filter.state:
+      all_of.append(('city', facet_filter.state, facet_filter.city) if facet_filter.city else ('state', facet_filter.state))
+    elif facet_filter.city:
+      # a city name without a state is that city in any state
+      any_of.append([key for key in index.keys() if key[0] == 'city' and key[2] == facet_filter.city])
+    if facet_filter.seeking:
+      all_of.append(('seeking',))
+    return index.match(all_of, any_of)
+
+# how many of the matches have each genre, are in each state and are seeking (cities are too many to list)
+def facet_counts(index, bits):
+    genre_keys = [('genre', choice.name) for choice in Genre_Choices]
+    state_keys = sorted(key for key in index.keys() if key[0] == 'state')
+    counts = index.counts(bits, genre_keys + state_keys + [('seeking',)])
+    return {
+      'count': bits.bit_count(),
+      'genres': { key[1]: counts[key] for key in genre_keys },
+      'states': { key[1]: counts[key] for key in state_keys if counts[key] },
+      'seeking': counts[('seeking',)]
+    }
+
+# one page of `query` (a listing query with the entity id as `id`, paginated on `keys`) narrowed down to the
+# entities matching the FacetFilter, along with the facet counts of all the matches
+def get_faceted_page(model, facet_filter, query, keys, after=None, before=None, limit=None):
+    index = get_facet_index(model)
+    bits = facet_match(index, facet_filter)
+    matches = bits.bit_count()
+    if not matches:
+      page = Page([], None, None)
+    elif matches <= FACET_IN_LIMIT:
+      page = paginate(query.filter(model.id.in_(index.ids(bits))), keys, after, before, limit)
+    else:
+      # chunks sized to hold a page of matches at their density, with some to spare
+      chunk = int((clamp_limit(limit) + 1) * len(index) / matches * 1.25)
+      contains = index.contains(bits)
+      page = paginate_filtered(query, keys, lambda row: contains(row.id), after, before, limit, min(chunk, FACET_MAX_CHUNK))
+    return page, facet_counts(index, bits)
+
+# the in-memory indexes over a model's rows (search, autocomplete, facets) are dropped after a bulk write, which
+# bypasses the ORM events and the routes that keep them current: they are rebuilt on their next use
+def drop_in_memory_indexes(model):
+    fallback_search_indexes.pop(model, None)
+    if model in (Venue, Artist):
+      autocomplete_index.loaded_at = None
+      facet_indexes[model].loaded_at = None
+
+
+#------------------------------------------------------------------------------------------
+# Bookings
+#-------------------------------------------------------------------------------------------
+
+# interval trees of the venues' and artists' bookings (see intervals.py), for rejecting a show that overlaps one
+# of its venue's or artist's shows. each tree holds the owner's shows from the time it was loaded on, and is
+# reloaded every BOOKING_REFRESH_SECONDS to pick up the shows created by other worker processes. trees that go
+# unused for that long are dropped, and a process keeps at most BOOKING_MAX_TREES of them
+BOOKING_REFRESH_SECONDS = 60
+BOOKING_MAX_TREES = 100000
+
+# (start_time, end_time, id) of the owner's shows ending after `start` (and starting before `end`, when given).
+# a show ending after `start` starts after start - MAX_SHOW_DURATION, which keeps this a range scan of
+# ix_Show_venue_id_start_time / ix_Show_artist_id_start_time rather than a read of the whole history
+def load_bookings(owner, start, end=None):
+    kind, owner_id = owner
+    column = Show.venue_id if kind == 'venue' else Show.artist_id
+    query = db.session.query(Show.start_time, Show.end_time, Show.id) \
+      .filter(column == owner_id, Show.start_time > start - MAX_SHOW_DURATION, Show.end_time > start)
+    if end is not None:
+      query = query.filter(Show.start_time < end)
+    return query.order_by(Show.start_time).all()
+
+# load_bookings(owner, start) for many owners at once: {owner: rows}, one query per kind of owner
+def load_many_bookings(owners, start):
+    rows = defaultdict(list)
+    for kind, column in (('venue', Show.venue_id), ('artist', Show.artist_id)):
+      owner_ids = [owner_id for owner_kind, owner_id in owners if owner_kind == kind]
+      if not owner_ids:
+        continue
+      query = db.session.query(column, Show.start_time, Show.end_time, Show.id) \
+        .filter(column.in_(owner_ids), Show.start_time > start - MAX_SHOW_DURATION, Show.end_time > start) \
+        .order_by(Show.start_time)
+      for owner_id, start_time, end_time, show_id in query:
+        rows[(kind, owner_id)].append((start_time, end_time, show_id))
+    return rows
+
+bookings = BookingIndex(load_bookings, BOOKING_REFRESH_SECONDS, load_many_bookings, BOOKING_MAX_TREES)
+
+# a reserved booking: the owners it was booked for and the token it was booked under
+Booking = namedtuple('Booking', ['owners', 'token'])
+
+# books the (not yet saved) show's venue and artist for its time, or raises BookingConflict. the Booking is
+# confirmed with the show's id once the show is saved, or released if it isn't
+def reserve_booking(show):
+    booking = Booking([('venue', show.venue_id), ('artist', show.artist_id)], object())
+    bookings.reserve(booking.owners, show.start_time, show.end_time, booking.token)
+    return booking
+
+# loads the booking trees of the shows' venues and artists in a couple of queries (before reserving a batch)
+def preload_bookings(shows):
+    bookings.preload([owner for show in shows for owner in (('venue', show.venue_id), ('artist', show.artist_id))])
+
+def confirm_booking(booking, show_id):
+    bookings.confirm(booking.owners, booking.token, show_id)
+
+def release_booking(booking):
+    bookings.release(booking.owners, booking.token)
+
+# whether an IntegrityError is the database's booking constraint (or, on sqlite, trigger) rejecting an overlap
+def is_booking_conflict(error):
+    return 'booking' in str(getattr(error, 'orig', error))
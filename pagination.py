@@ -0,0 +1,116 @@
+import base64
+import json
+
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import tuple_
+
+#------------------------------------------------------------------------------------------
+# Keyset pagination
+#-------------------------------------------------------------------------------------------
+
+# pages are found by seeking past the sort key of the last row seen (e.g. WHERE (name, id) > ('Foo', 12))
+# rather than with OFFSET, so every page costs the same no matter how deep into the listing it is.
+# the last key column must be unique (normally the primary key) so that rows with equal sort values are never skipped
+# and every key column must be NOT NULL: a row with a NULL key never compares greater or smaller than the cursor,
+# so it would be on no page after the first
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+
+Page = namedtuple('Page', ['items', 'next_cursor', 'prev_cursor'])
+
+
+class InvalidCursor(ValueError):
+  pass
+
+
+def encode_cursor(row, keys):
+  values = []
+  for key in keys:
+    value = getattr(row, key.key)
+    values.append(value.isoformat() if isinstance(value, datetime) else value)
+  return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor, keys):
+  try:
+    values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+  except (ValueError, UnicodeError):
+    raise InvalidCursor(cursor)
+
+  if not isinstance(values, list) or len(values) != len(keys):
+    raise InvalidCursor(cursor)
+
+  decoded = []
+  for key, value in zip(keys, values):
+    if key.type.python_type is datetime and value is not None:
+      try:
+        value = datetime.fromisoformat(value)
+      except (TypeError, ValueError):
+        raise InvalidCursor(cursor)
+    decoded.append(value)
+  return decoded
+
+
+def clamp_limit(limit):
+  if not limit:
+    return DEFAULT_LIMIT
+  return max(1, min(int(limit), MAX_LIMIT))
+
+
+# applies keyset ordering/filtering to an (unordered) query and returns one Page of results
+# `after` continues forwards from a next_cursor, `before` goes backwards from a prev_cursor
+def paginate(query, keys, after=None, before=None, limit=None):
+  limit = clamp_limit(limit)
+  key_tuple = tuple_(*keys)
+
+  if before:
+    query = query.filter(key_tuple < tuple_(*decode_cursor(before, keys)))
+    rows = query.order_by(*[key.desc() for key in keys]).limit(limit + 1).all()
+  else:
+    if after:
+      query = query.filter(key_tuple > tuple_(*decode_cursor(after, keys)))
+    rows = query.order_by(*keys).limit(limit + 1).all()
+  return make_page(rows, keys, limit, after, before)
+
+
+# same as paginate, but only the rows for which keep(row) is true make it onto the page (e.g. the ones an
+# in-memory index matched). the query is read `chunk` rows at a time until there is a page of them, so chunk
+# should be about the number of rows it takes to find a page's worth
+def paginate_filtered(query, keys, keep, after=None, before=None, limit=None, chunk=None):
+  limit = clamp_limit(limit)
+  chunk = max(chunk or 0, limit + 1)
+  key_tuple = tuple_(*keys)
+  seek = decode_cursor(before or after, keys) if before or after else None
+  order = [key.desc() for key in keys] if before else list(keys)
+
+  kept = []
+  while len(kept) <= limit:
+    chunk_query = query
+    if seek is not None:
+      chunk_query = query.filter(key_tuple < tuple_(*seek) if before else key_tuple > tuple_(*seek))
+    rows = chunk_query.order_by(*order).limit(chunk).all()
+    kept.extend(row for row in rows if keep(row))
+    if len(rows) < chunk:
+      break
+    seek = [getattr(rows[-1], key.key) for key in keys]
+  return make_page(kept, keys, limit, after, before)
+
+
+# rows: up to limit + 1 rows in query order (descending when going backwards from `before`)
+def make_page(rows, keys, limit, after=None, before=None):
+  has_more = len(rows) > limit
+
+  if before:
+    rows = rows[:limit][::-1]
+    # we came from the page after this one, so there is always a next page
+    next_cursor = encode_cursor(rows[-1], keys) if rows else None
+    prev_cursor = encode_cursor(rows[0], keys) if rows and has_more else None
+    return Page(rows, next_cursor, prev_cursor)
+
+  rows = rows[:limit]
+  next_cursor = encode_cursor(rows[-1], keys) if rows and has_more else None
+  prev_cursor = encode_cursor(rows[0], keys) if rows and after else None
+  return Page(rows, next_cursor, prev_cursor)
@@ -0,0 +1,105 @@
+from datetime import datetime
+
+from sqlalchemy import text
+
+#------------------------------------------------------------------------------------------
+# Show partitions
+#-------------------------------------------------------------------------------------------
+
+# on postgres the Show table is range partitioned by month of start_time (migration c5f8a2d41e97): one partition
+# per month, "Show_y2026m10" for october 2026, plus "Show_default" for shows outside every month partition.
+# queries on a time range (upcoming shows, the /shows?from=&to= feed, a venue's calendar, the rollover) only touch
+# the partitions of that range, so they stay as fast as the history grows, and old months can be detached and
+# archived whole.
+#
+# ensure_show_partitions() creates the partitions up to PARTITION_MONTHS_AHEAD months from now. it runs on every
+# deploy (the release phase in the Procfile runs ./bin/show_partitions.py) and should also run daily (e.g. from a
+# scheduler), so there are always a year's worth of partitions ahead. a show past the last partition still goes in:
+# it lands in the default partition, and is moved to its month's partition when that gets created
+
+PARTITION_MONTHS_AHEAD = 12
+
+
+def month_start(when):
+  return datetime(when.year, when.month, 1)
+
+
+def add_months(month, count):
+  index = month.year * 12 + month.month - 1 + count
+  return datetime(index // 12, index % 12 + 1, 1)
+
+
+# first days of the months from the one `first` is in up to the one `last` is in
+def months(first, last):
+  month = month_start(first)
+  while month <= last:
+    yield month
+    month = add_months(month, 1)
+
+
+def partition_name(month):
+  return 'Show_y{:04d}m{:02d}'.format(month.year, month.month)
+
+
+def is_partitioned(connection):
+  if connection.dialect.name != 'postgresql':
+    return False
+  return connection.execute(text(
+    "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid WHERE c.relname = 'Show'"
+  )).first() is not None
+
+
+def existing_partitions(connection):
+  return set(name for (name,) in connection.execute(text(
+    "SELECT child.relname FROM pg_inherits i "
+    "JOIN pg_class parent ON parent.oid = i.inhparent JOIN pg_class child ON child.oid = i.inhrelid "
+    "WHERE parent.relname = 'Show'"
+  )))
+
+
+# whether the partitions carry the venue/artist booking constraints (migration e4b9c1d7a352), which new partitions
+# then need too: they can't be declared on the partitioned table itself
+def has_booking_constraints(connection):
+  return connection.execute(text(
+    "SELECT 1 FROM pg_constraint WHERE conname = 'ex_Show_default_venue_id_booking'"
+  )).first() is not None
+
+
+# creates the missing month partitions from the month of `first` to the month of `last` (returns their names).
+# each is created empty, filled with its month's shows from the default partition and then attached, which is the
+# one way to add a partition once the default partition may hold rows in its range
+def create_show_partitions(connection, first, last):
+  if not is_partitioned(connection):
+    return []
+
+  existing = existing_partitions(connection)
+  booking_constraints = has_booking_constraints(connection)
+  created = []
+  for month in months(first, last):
+    name = partition_name(month)
+    if name in existing:
+      continue
+    bounds = { 'start': month, 'end': add_months(month, 1) }
+    # (ATTACH PARTITION needs the partition to have the Show table's CHECK constraints, e.g. ck_Show_end_after_start)
+    connection.execute(text('CREATE TABLE "{}" (LIKE "Show" INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'.format(name)))
+    if booking_constraints:
+      for owner in ('venue_id', 'artist_id'):
+        connection.execute(text(
+          'ALTER TABLE "{table}" ADD CONSTRAINT "ex_{table}_{owner}_booking" '
+          'EXCLUDE USING gist ({owner} WITH =, tsrange(start_time, end_time) WITH &&)'.format(table=name, owner=owner)
+        ))
+    connection.execute(text(
+      'WITH moved AS (DELETE FROM "Show_default" WHERE start_time >= :start AND start_time < :end RETURNING *) '
+      'INSERT INTO "{}" SELECT * FROM moved'.format(name)
+    ), bounds)
+    connection.execute(text(
+      'ALTER TABLE "Show" ATTACH PARTITION "{}" FOR VALUES FROM (\'{:%Y-%m-%d}\') TO (\'{:%Y-%m-%d}\')'.format(
+        name, bounds['start'], bounds['end'])
+    ))
+    created.append(name)
+  return created
+
+
+def ensure_show_partitions(connection, now=None, months_ahead=PARTITION_MONTHS_AHEAD):
+  now = now or datetime.now()
+  return create_show_partitions(connection, now, add_months(month_start(now), months_ahead))
@@ -0,0 +1,181 @@
+import re
+import time
+
+from bisect import bisect_left, insort
+from collections import defaultdict
+from threading import Lock
+
+#------------------------------------------------------------------------------------------
+# Search
+#-------------------------------------------------------------------------------------------
+
+# on postgres, Venue.search / Artist.search rank with pg_trgm's similarity() and are served by the
+# trigram GIN indexes (see migration 3f1c2b9d7e40). other databases (e.g. sqlite for local/benchmark runs)
+# have no pg_trgm, so they fall back to NgramIndex below, which scores matches the same way in python.
+
+SEARCH_LIMIT = 50
+
+WORD = re.compile(r'[0-9a-z]+')
+
+# same as pg_trgm's default pg_trgm.similarity_threshold
+SIMILARITY_THRESHOLD = 0.3
+
+
+# trigrams the way pg_trgm builds them: lowercased alphanumeric words, padded with two spaces in front and one behind
+def trigrams(text):
+  grams = set()
+  for word in WORD.findall((text or '').lower()):
+    padded = '  ' + word + ' '
+    for i in range(len(padded) - 2):
+      grams.add(padded[i:i + 3])
+  return grams
+
+
+def similarity(grams, other_grams):
+  if not grams or not other_grams:
+    return 0.0
+  shared = len(grams & other_grams)
+  return shared / float(len(grams) + len(other_grams) - shared)
+
+
+# in-memory inverted index from trigram -> document ids, where each document is a handful of short fields
+# (e.g. name, city, state). a document matches when any field contains the term or is similar enough to it,
+# and scores as its best field, like GREATEST(similarity(name, term), similarity(city, term), ...) does in sql
+class NgramIndex:
+
+  def __init__(self):
+    self.postings = defaultdict(set)
+    self.documents = {}
+
+  def __len__(self):
+    return len(self.documents)
+
+  def add(self, doc_id, *fields):
+    self.remove(doc_id)
+    fields = [(field.lower(), trigrams(field)) for field in fields if field]
+    self.documents[doc_id] = fields
+    for _, grams in fields:
+      for gram in grams:
+        self.postings[gram].add(doc_id)
+
+  def remove(self, doc_id):
+    for _, grams in self.documents.pop(doc_id, []):
+      for gram in grams:
+        self.postings[gram].discard(doc_id)
+
+  def score(self, doc_id, term, term_grams):
+    best = 0.0
+    for text, grams in self.documents.get(doc_id, []):
+      score = similarity(term_grams, grams)
+      if score >= SIMILARITY_THRESHOLD or term in text:
+        # a plain substring match counts even when it shares no trigrams (e.g. 'a' in 'band')
+        best = max(best, score, 1e-9)
+    return best
+
+  # returns [(doc_id, score)] ordered by score (best first), then id
+  def search(self, term, limit=SEARCH_LIMIT):
+    term = term.strip().lower()
+    term_grams = trigrams(term)
+
+    # every similar field shares at least one trigram with the term, and every field containing a term with a
+    # word of 3+ characters shares that word's inner trigrams, so the postings union is a complete candidate set.
+    # shorter terms (e.g. 'a') have no inner trigrams, so they have to be checked against every document
+    if any(len(word) >= 3 for word in WORD.findall(term)):
+      candidates = set()
+      for gram in term_grams:
+        candidates |= self.postings.get(gram, set())
+    else:
+      candidates = self.documents.keys()
+
+    scored = []
+    for doc_id in candidates:
+      score = self.score(doc_id, term, term_grams)
+      if score:
+        scored.append((doc_id, score))
+
+    scored.sort(key=lambda match: (-match[1], match[0]))
+    return scored[:limit]
+
+
+# in-memory prefix index for autocomplete: one sorted list of (key, kind, id, name) entries where each name is
+# entered once per word, so 'hop' and 'the mu' both complete to 'The Musical Hop'. lookups are a bisect to the
+# first key >= prefix and a short forward scan. writers take a lock, readers don't need one: every change to the
+# entries list is a single insert/delete (or a swap of the whole list), so a lookup never sees a broken list
+class PrefixIndex:
+
+  def __init__(self):
+    self.entries = []
+    self.keys_by_entity = {}
+    self.lock = Lock()
+    self.loaded_at = None
+
+  def __len__(self):
+    return len(self.keys_by_entity)
+
+  @staticmethod
+  def normalize(text):
+    return ' '.join(WORD.findall((text or '').lower()))
+
+  # the normalized name starting from each of its words ('the musical hop', 'musical hop', 'hop')
+  @classmethod
+  def word_keys(cls, name):
+    normalized = cls.normalize(name)
+    keys = {normalized}
+    space = normalized.find(' ')
+    while space != -1:
+      keys.add(normalized[space + 1:])
+      space = normalized.find(' ', space + 1)
+    return keys
+
+  # replaces the whole index in one go (sorting once is much cheaper than inserting names one at a time)
+  def load(self, names):
+    entries = []
+    keys_by_entity = {}
+    for kind, entity_id, name in names:
+      keys = self.word_keys(name)
+      keys_by_entity[(kind, entity_id)] = (keys, name)
+      entries.extend((key, kind, entity_id, name) for key in keys)
+    entries.sort()
+    with self.lock:
+      self.entries, self.keys_by_entity = entries, keys_by_entity
+      self.loaded_at = time.time()
+
+  def add(self, kind, entity_id, name):
+    keys = self.word_keys(name)
+    with self.lock:
+      self._remove(kind, entity_id)
+      self.keys_by_entity[(kind, entity_id)] = (keys, name)
+      for key in keys:
+        insort(self.entries, (key, kind, entity_id, name))
+
+  def remove(self, kind, entity_id):
+    with self.lock:
+      self._remove(kind, entity_id)
+
+  def _remove(self, kind, entity_id):
+    keys, name = self.keys_by_entity.pop((kind, entity_id), ((), None))
+    for key in keys:
+      entry = (key, kind, entity_id, name)
+      i = bisect_left(self.entries, entry)
+      if i < len(self.entries) and self.entries[i] == entry:
+        del self.entries[i]
+
+  # returns up to `limit` distinct (kind, id, name) whose name has a word starting with `prefix`
+  def complete(self, prefix, limit=10, kind=None):
+    prefix = self.normalize(prefix)
+    if not prefix:
+      return []
+
+    results = []
+    seen = set()
+    entries = self.entries
+    i = bisect_left(entries, (prefix,))
+    while i < len(entries) and len(results) < limit:
+      key, entry_kind, entity_id, name = entries[i]
+      if not key.startswith(prefix):
+        break
+      if (kind is None or entry_kind == kind) and (entry_kind, entity_id) not in seen:
+        seen.add((entry_kind, entity_id))
+        results.append((entry_kind, entity_id, name))
+      i += 1
+    return results
@@ -0,0 +1,99 @@
+import secrets
+
+from flask.sessions import SessionInterface, SessionMixin, session_json_serializer
+from itsdangerous import BadSignature, Signer
+from werkzeug.datastructures import CallbackDict
+
+#------------------------------------------------------------------------------------------
+# Server-side sessions
+#-------------------------------------------------------------------------------------------
+
+# with SESSION_BACKEND = 'redis' the session (flash messages, the csrf token) lives in redis and the cookie only
+# carries its id, signed with SECRET_KEY (or one of SECRET_KEY_FALLBACKS while a key is being rotated), so every
+# worker and server behind the load balancer sees the same session
+
+
+class ServerSession(CallbackDict, SessionMixin):
+
+  def __init__(self, initial=None, sid=None, new=False):
+    def on_update(session):
+      session.modified = True
+      session.accessed = True
+    super().__init__(initial, on_update)
+    self.sid = sid
+    self.new = new
+    self.modified = False
+    self.accessed = False
+
+  # reads mark the session accessed too (like flask's SecureCookieSession), so a page that only reads it still
+  # gets Vary: Cookie and a shared cache doesn't hand one user's page to another
+  def __getitem__(self, key):
+    self.accessed = True
+    return super().__getitem__(key)
+
+  def get(self, key, default=None):
+    self.accessed = True
+    return super().get(key, default)
+
+  def setdefault(self, key, default=None):
+    self.accessed = True
+    return super().setdefault(key, default)
+
+
+class RedisSessionInterface(SessionInterface):
+
+  prefix = 'fyyur:session:'
+  salt = 'fyyur-session'
+
+  def __init__(self, url):
+    try:
+      import redis
+    except ImportError:
+      raise RuntimeError("SESSION_BACKEND = 'redis' needs the redis package (pip install redis)")
+    self.client = redis.Redis.from_url(url)
+
+  def signer(self, app):
+    # itsdangerous signs with the last key and accepts any of them
+    return Signer(list(app.config.get('SECRET_KEY_FALLBACKS') or []) + [app.secret_key], salt=self.salt)
+
+  def open_session(self, app, request):
+    cookie = request.cookies.get(self.get_cookie_name(app))
+    if cookie:
+      try:
+        sid = self.signer(app).unsign(cookie).decode()
+      except BadSignature:
+        sid = None
+      data = self.client.get(self.prefix + sid) if sid else None
+      if data is not None:
+        return ServerSession(session_json_serializer.loads(data), sid=sid)
+    return ServerSession(sid=secrets.token_urlsafe(32), new=True)
+
+  def save_session(self, app, session, response):
+    name = self.get_cookie_name(app)
+    domain = self.get_cookie_domain(app)
+    path = self.get_cookie_path(app)
+
+    if session.accessed:
+      response.vary.add('Cookie')
+
+    # an emptied session (e.g. its last flash message was shown) is removed along with its cookie
+    if not session:
+      if session.modified and not session.new:
+        self.client.delete(self.prefix + session.sid)
+        response.delete_cookie(name, domain=domain, path=path, secure=self.get_cookie_secure(app),
+          httponly=self.get_cookie_httponly(app), samesite=self.get_cookie_samesite(app))
+      return
+
+    if not self.should_set_cookie(app, session):
+      return
+
+    lifetime = int(app.permanent_session_lifetime.total_seconds())
+    self.client.set(self.prefix + session.sid, session_json_serializer.dumps(dict(session)), ex=lifetime)
+    response.set_cookie(name, self.signer(app).sign(session.sid).decode(),
+      expires=self.get_expiration_time(app, session),
+      httponly=self.get_cookie_httponly(app),
+      domain=domain,
+      path=path,
+      secure=self.get_cookie_secure(app),
+      samesite=self.get_cookie_samesite(app)
+    )
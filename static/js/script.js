@@ -2,3 +2,24 @@ window.parseISOString = function parseISOString(s) {
   var b = s.split(/\D+/);
   return new Date(Date.UTC(b[0], --b[1], b[2], b[3], b[4], b[5], b[6]));
 };
+
+// fill the search boxes' suggestion lists from /api/autocomplete as the user types
+document.querySelectorAll('input[data-autocomplete]').forEach(function (input) {
+  var suggestions = document.getElementById(input.getAttribute('list'));
+  input.addEventListener('input', function () {
+    var url = '/api/autocomplete?type=' + input.dataset.autocomplete + '&q=' + encodeURIComponent(input.value);
+    fetch(url)
+      .then(function (response) { return response.json(); })
+      .then(function (json) {
+        suggestions.innerHTML = '';
+        json.results.forEach(function (result) {
+          var option = document.createElement('option');
+          option.value = result.name;
+          suggestions.appendChild(option);
+        });
+      })
+      .catch(function (error) {
+        console.error(error);
+      });
+  });
+});
@@ -0,0 +1,41 @@
+#------------------------------------------------------------------------------------------
+# View models
+#-------------------------------------------------------------------------------------------
+
+# small fixed-shape objects handed to the templates in place of ORM instances / merged __dict__ copies.
+# each is built straight from a projected query row, so only the columns a page shows are ever loaded,
+# and __slots__ keeps them to one compact object per row (no per-instance dict, no _sa_instance_state)
+
+
+class ViewModel:
+  __slots__ = ()
+
+  def __init__(self, **fields):
+    for field in self.__slots__:
+      setattr(self, field, fields.get(field))
+
+  def __repr__(self):
+    return '<{} {}>'.format(type(self).__name__, ' '.join('{}={!r}'.format(field, getattr(self, field)) for field in self.__slots__))
+
+  @classmethod
+  def from_row(cls, row, **extra):
+    return cls(**row._asdict(), **extra)
+
+
+# one show tile; venue pages fill in the artist fields, artist pages the venue fields, /shows both
+class ShowCard(ViewModel):
+  __slots__ = ('id', 'start_time', 'venue_id', 'venue_name', 'venue_image_link', 'artist_id', 'artist_name', 'artist_image_link')
+
+
+class VenueDetail(ViewModel):
+  # columns selected from Venue to build one
+  columns = ('id', 'name', 'city', 'state', 'address', 'phone', 'website', 'facebook_link', 'seeking_talent', 'seeking_description', 'image_link')
+
+  __slots__ = columns + ('genres', 'past_shows', 'upcoming_shows', 'past_shows_count', 'upcoming_shows_count')
+
+
+class ArtistDetail(ViewModel):
+  # columns selected from Artist to build one
+  columns = ('id', 'name', 'city', 'state', 'phone', 'website', 'facebook_link', 'seeking_venue', 'seeking_description', 'image_link')
+
+  __slots__ = columns + ('genres', 'past_shows', 'upcoming_shows', 'past_shows_count', 'upcoming_shows_count')
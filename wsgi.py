@@ -0,0 +1,4 @@
+# Production entry point: gunicorn -c gunicorn.conf.py wsgi:app
+# (app.py's app.run() is the flask development server, for local use only)
+
+from app import app